@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#animation mode for raytracer.py: one base scene plus a keyframe track -> numbered pngs
+#  python3 animate.py ray-shadow-basic.txt orbit.anim --workers 4
+#the base scene is parsed and its bvh built once per process, each frame only sets the camera,
+#moves the objects named in the track and refits the bvh boxes above them
+#track files are keyword lines like a scene file:
+#  frames 48                 frame count, default last key + 1
+#  output orbit-%04d.png     png name pattern, default <scene png>-%04d.png
+#  key 0 eye 0 0 0           camera eye, forward or up at a frame
+#  key 47 forward 0.2 0 -1
+#  key 0 sphere 2 0 0 0      move sphere 2 (1-based, scene order) by dx dy dz
+#  key 47 tri 1-12 0 1 0     move triangles 1 to 12 by dx dy dz
+#channels are linear between keys and hold their first and last key outside them
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from raytracer import KIND_SPHERE, KIND_TRIANGLE, Scene, Vector3, cameraBasis, parseFile, renderScene
+
+
+CAMERA_CHANNELS = ('eye', 'forward', 'up')
+OBJECT_KINDS = {'sphere': KIND_SPHERE, 'tri': KIND_TRIANGLE}
+
+
+class Track:
+    #keyframes per channel, a channel is ('eye',) or (kind, first, last) with 0-based inclusive indices
+    def __init__(self, filename):
+        self.frames = None
+        self.output = None
+        self.keys = {}
+        with open(filename, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts or parts[0].startswith('#'):
+                    continue
+                if parts[0] == 'frames':
+                    self.frames = int(parts[1])
+                elif parts[0] == 'output':
+                    self.output = parts[1]
+                elif parts[0] == 'key':
+                    frame = int(parts[1])
+                    if parts[2] in CAMERA_CHANNELS:
+                        channel = (parts[2],)
+                        values = parts[3:6]
+                    elif parts[2] in OBJECT_KINDS:
+                        first, _, last = parts[3].partition('-')
+                        channel = (parts[2], int(first) - 1, int(last or first) - 1)
+                        values = parts[4:7]
+                    else:
+                        raise ValueError(f"{filename}: unknown channel {parts[2]!r}")
+                    self.keys.setdefault(channel, []).append((frame, tuple(float(v) for v in values)))
+        for keys in self.keys.values():
+            keys.sort()
+        if self.frames is None:
+            self.frames = max((keys[-1][0] for keys in self.keys.values()), default=0) + 1
+
+    def value(self, channel, frame):
+        #channel value at frame as a Vector3
+        keys = self.keys[channel]
+        if frame <= keys[0][0]:
+            return Vector3(*keys[0][1])
+        for (f0, a), (f1, b) in zip(keys, keys[1:]):
+            if frame <= f1:
+                u = (frame - f0) / (f1 - f0)
+                return Vector3(*(p + (q - p) * u for p, q in zip(a, b)))
+        return Vector3(*keys[-1][1])
+
+
+class Animation:
+    #a scene that can be posed at any frame of a track
+    def __init__(self, filename, track, use_cache=True):
+        if use_cache:
+            from scenecache import loadCached
+            parsed, bvh = loadCached(filename)
+        else:
+            parsed, bvh = parseFile(filename), None
+        width, height, output_filename, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, aa_samples, aa_threshold = parsed
+        self.scene = Scene(width, height, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, output_filename, bvh=bvh)
+        self.track = track
+        self.camera = (eye, forward, up)
+        #object channels and the base corners of everything they move
+        self.movers = []
+        self.base = {}
+        for channel in track.keys:
+            if channel[0] in CAMERA_CHANNELS:
+                continue
+            kind = OBJECT_KINDS[channel[0]]
+            targets = [(kind, i) for i in range(channel[1], channel[2] + 1)]
+            for target in targets:
+                if kind == KIND_SPHERE:
+                    self.base[target] = spheres[target[1]].center
+                else:
+                    tri = triangles[target[1]]
+                    self.base[target] = (tri.v0, tri.v1, tri.v2)
+            self.movers.append((channel, targets))
+        #offset last applied per object, only objects whose offset changes are touched
+        self.offsets = {}
+
+    def pose(self, frame):
+        scene = self.scene
+        track = self.track
+        if any((name,) in track.keys for name in CAMERA_CHANNELS):
+            eye, forward, up = (track.value((name,), frame) if (name,) in track.keys else base
+                                for name, base in zip(CAMERA_CHANNELS, self.camera))
+            scene.eye, scene.forward, scene.right, scene.up = cameraBasis(eye, forward, up)
+
+        #several channels can move the same object, their offsets add up
+        offsets = {}
+        for channel, targets in self.movers:
+            offset = track.value(channel, frame)
+            for target in targets:
+                total = offsets.get(target)
+                offsets[target] = offset if total is None else total + offset
+        moved = []
+        for target, offset in offsets.items():
+            last = self.offsets.get(target)
+            if last is not None and (last.x, last.y, last.z) == (offset.x, offset.y, offset.z):
+                continue
+            self.offsets[target] = offset
+            kind, index = target
+            if kind == KIND_SPHERE:
+                obj = scene.spheres[index]
+                obj.center = self.base[target] + offset
+            else:
+                obj = scene.triangles[index]
+                v0, v1, v2 = self.base[target]
+                obj.v0, obj.v1, obj.v2 = v0 + offset, v1 + offset, v2 + offset
+            obj.compile()
+            moved.append(target)
+        if moved:
+            scene.bvh.refit(moved)
+
+    def render(self, frame, pattern, engine='python'):
+        self.pose(frame)
+        if engine == 'numpy':
+            from wavefront import renderWavefront
+            img = renderWavefront(self.scene)
+        else:
+            img = renderScene(self.scene)
+        img.save(pattern % frame)
+
+
+#animation held by each worker process, built once by the pool initializer
+_worker_animation = None
+
+
+def initWorker(filename, track, use_cache):
+    global _worker_animation
+    _worker_animation = Animation(filename, track, use_cache)
+
+
+def renderRange(first, last, pattern, engine):
+    #worker side, frames first..last inclusive
+    for frame in range(first, last + 1):
+        _worker_animation.render(frame, pattern, engine)
+    return last - first + 1
+
+
+def scenePng(filename):
+    #output name from the scene's png line, without parsing the rest
+    with open(filename, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 3 and parts[0] == 'png':
+                return parts[3]
+    return 'frame.png'
+
+
+def frameRanges(first, last, parts):
+    #split first..last into at most parts contiguous inclusive ranges
+    count = last - first + 1
+    parts = max(1, min(parts, count))
+    bounds = [first + count * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(parts)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a keyframed camera and object track over one scene to numbered pngs")
+    parser.add_argument('scene')
+    parser.add_argument('track')
+    parser.add_argument('--frames', help="first-last frame to render, default the whole track")
+    parser.add_argument('--output', help="png name pattern with a %%d, overrides the track's output line")
+    parser.add_argument('--workers', type=int, default=1, help="render contiguous frame ranges on this many processes")
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python')
+    parser.add_argument('--no-cache', action='store_true', help="parse the scene instead of using .rtcache")
+    args = parser.parse_args()
+
+    track = Track(args.track)
+    if args.frames:
+        first, _, last = args.frames.partition('-')
+        first, last = int(first), int(last or first)
+    else:
+        first, last = 0, track.frames - 1
+
+    pattern = args.output or track.output or os.path.splitext(scenePng(args.scene))[0] + '-%04d.png'
+    start = time.perf_counter()
+    use_cache = not args.no_cache
+    if args.workers <= 1:
+        animation = Animation(args.scene, track, use_cache)
+        for frame in range(first, last + 1):
+            animation.render(frame, pattern, args.engine)
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=initWorker, initargs=(args.scene, track, use_cache)) as pool:
+            futures = [pool.submit(renderRange, a, b, pattern, args.engine) for a, b in frameRanges(first, last, args.workers)]
+            for future in as_completed(futures):
+                future.result()
+
+    elapsed = time.perf_counter() - start
+    frames = last - first + 1
+    print(f"Rendered {frames} frames to {pattern} in {elapsed:.1f} s ({frames / elapsed:.2f} frames/sec)")
+
+
+if __name__ == '__main__':
+    main()
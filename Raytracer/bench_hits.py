@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#per-ray hit test benchmark on a dense triangle scene
+#brute force findHit, so every ray pays hitTri for every triangle
+#compare against an older raytracer.py with --baseline, e.g.
+#  git show <rev>:Raytracer/raytracer.py > /tmp/old_raytracer.py
+#  python3 bench_hits.py --baseline /tmp/old_raytracer.py
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench_memory import loadModule, writeMeshScene
+
+
+def measure(module, scene_path, rays, repeat):
+    #microseconds per ray and per ray-triangle test
+    parsed = module.parseFile(scene_path)
+    spheres, planes, triangles = parsed[3], parsed[4], parsed[5]
+    if hasattr(module, 'compileScene'):
+        module.compileScene(spheres, planes, triangles)
+
+    random.seed(1)
+    batch = []
+    for _ in range(rays):
+        d = module.Vector3(random.uniform(-0.4, 0.4), random.uniform(-0.4, 0.4), -1).normalize()
+        batch.append(module.Ray(module.Vector3(0, 0, 0), d))
+
+    #best of several passes to ride out timer noise
+    elapsed = float('inf')
+    for _ in range(repeat):
+        hits = 0
+        start = time.perf_counter()
+        for ray in batch:
+            if module.findHit(ray, spheres, planes, triangles) is not None:
+                hits += 1
+        elapsed = min(elapsed, time.perf_counter() - start)
+    per_ray = elapsed / rays * 1e6
+    return per_ray, per_ray / len(triangles) * 1000, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time brute-force hit tests per ray on a dense mesh")
+    parser.add_argument('--triangles', type=int, default=5000)
+    parser.add_argument('--rays', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', help="older raytracer.py to compare against")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        scene_path = os.path.join(tmp, 'mesh.txt')
+        count = writeMeshScene(scene_path, args.triangles)
+        print(f"{count} triangles, {args.rays} rays")
+        runs = []
+        if args.baseline:
+            runs.append(("baseline", loadModule(args.baseline, 'baseline_raytracer')))
+        runs.append(("current", loadModule(os.path.join(here, 'raytracer.py'), 'current_raytracer')))
+        for label, module in runs:
+            per_ray, per_test, hits = measure(module, scene_path, args.rays, args.repeat)
+            print(f"{label:10s} {per_ray:10.1f} us/ray   {per_test:8.1f} ns/test   {hits} hits")
+
+
+if __name__ == '__main__':
+    main()
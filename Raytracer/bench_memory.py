@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#memory benchmark: bytes per triangle for parsed scenes
+#compare against an older raytracer.py with --baseline, e.g.
+#  git show <rev>:Raytracer/raytracer.py > /tmp/old_raytracer.py
+#  python3 bench_memory.py --baseline /tmp/old_raytracer.py
+#--check exits 1 when the current tree goes over BUDGET bytes per triangle on the default mesh
+import argparse
+import gc
+import importlib.util
+import math
+import os
+import tempfile
+import sys
+import tracemalloc
+
+#the __slots__ + struct-of-arrays layout measured 256.5 B/tri here (145.3 objects + 111.1 bvh), the compiled
+#triangle fields hitTri reads came after it and cost 9 slot pointers and 9 floats per triangle on top
+LAYOUT_BUDGET = 256.5
+COMPILED_BUDGET = 9 * (8 + 24)
+BUDGET = LAYOUT_BUDGET + COMPILED_BUDGET
+
+
+def writeMeshScene(path, triangles):
+    #closed sphere-ish grid mesh with roughly the requested triangle count
+    rows = max(2, int(math.sqrt(triangles / 2)))
+    with open(path, 'w') as f:
+        f.write("png 64 64 bench.png\n")
+        f.write("sun 1 1 1\n")
+        for i in range(rows + 1):
+            theta = math.pi * i / rows
+            for j in range(rows):
+                phi = 2 * math.pi * j / rows
+                f.write(f"xyz {math.sin(theta) * math.cos(phi):.6f} {math.cos(theta):.6f} {math.sin(theta) * math.sin(phi) - 3:.6f}\n")
+        for i in range(rows):
+            for j in range(rows):
+                a = i * rows + j + 1
+                b = i * rows + (j + 1) % rows + 1
+                f.write(f"tri {a} {b} {a + rows}\n")
+                f.write(f"tri {b} {b + rows} {a + rows}\n")
+    return 2 * rows * rows
+
+
+def loadModule(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(module, scene_path, count):
+    #bytes per triangle held by parseFile's objects, by compileScene's hit data and by the bvh
+    gc.collect()
+    tracemalloc.start()
+    parsed = module.parseFile(scene_path)
+    parse_bytes = tracemalloc.get_traced_memory()[0]
+    compiled_bytes = bvh_bytes = 0
+    if hasattr(module, 'BVH'):
+        spheres, planes, triangles = parsed[3], parsed[4], parsed[5]
+        if hasattr(module, 'compileScene'):
+            module.compileScene(spheres, planes, triangles)
+        compiled_bytes = tracemalloc.get_traced_memory()[0] - parse_bytes
+        #the bvh is only held so it is still alive when its memory is read
+        _ = module.BVH(spheres, triangles)
+        bvh_bytes = tracemalloc.get_traced_memory()[0] - parse_bytes - compiled_bytes
+    tracemalloc.stop()
+    return parse_bytes / count, compiled_bytes / count, bvh_bytes / count
+
+
+def report(label, parse_per_tri, compiled_per_tri, bvh_per_tri):
+    total = parse_per_tri + compiled_per_tri + bvh_per_tri
+    print(f"{label:10s} objects {parse_per_tri:8.1f}   compiled {compiled_per_tri:8.1f}   bvh {bvh_per_tri:8.1f}   total {total:8.1f} B/tri")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bytes per triangle for a generated mesh")
+    parser.add_argument('--triangles', type=int, default=50000)
+    parser.add_argument('--baseline', help="older raytracer.py to compare against")
+    parser.add_argument('--check', action='store_true', help=f"exit 1 when the current tree needs more than {BUDGET:.1f} B/tri")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        scene_path = os.path.join(tmp, 'mesh.txt')
+        count = writeMeshScene(scene_path, args.triangles)
+        print(f"{count} triangles")
+        if args.baseline:
+            report("baseline", *measure(loadModule(args.baseline, 'baseline_raytracer'), scene_path, count))
+        total = report("current", *measure(loadModule(os.path.join(here, 'raytracer.py'), 'current_raytracer'), scene_path, count))
+    if args.check:
+        if total > BUDGET:
+            print(f"over budget: {total:.1f} B/tri against {BUDGET:.1f} ({LAYOUT_BUDGET} layout + {COMPILED_BUDGET} compiled fields)")
+            sys.exit(1)
+        print(f"within budget: {total:.1f} B/tri against {BUDGET:.1f}")
+
+
+if __name__ == '__main__':
+    main()
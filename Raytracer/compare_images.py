@@ -1,42 +1,108 @@
 #!/usr/bin/env python3
 #compare two images pixel by pixel
-from PIL import Image
+#  python3 compare_images.py ray-sun.png sun.png
+#  python3 compare_images.py ray-sun.png sun.png --tolerance 2 --json
+#both images are compared as 8-bit rgba arrays, a pixel differs when any channel is off by more than the tolerance
+import argparse
+import json
 import sys
 
-if len(sys.argv) != 3:
-    print("Usage: python compare_images.py <image1> <image2>")
-    sys.exit(1)
+import numpy as np
+from PIL import Image
+
+
+CHANNELS = 'RGBA'
+#how many differing pixels are listed in text mode
+SHOW_DIFFS = 10
+
+
+def loadRgba(path):
+    return np.asarray(Image.open(path).convert('RGBA'))
+
+
+def psnr(mse):
+    #peak signal to noise ratio in dB for 8-bit data, None for identical images
+    if mse == 0:
+        return None
+    return float(10 * np.log10(255.0 * 255.0 / mse))
+
+
+def compareArrays(a, b, tolerance=0):
+    #stats dict for two (H, W, 4) uint8 arrays of the same size, plus the (H, W) mask of differing pixels
+    error = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    over = error > tolerance
+    mask = over.any(axis=2)
+    diff_count = int(np.count_nonzero(mask))
+    total_pixels = mask.size
+    mse = float(np.mean(np.square(error, dtype=np.float64)))
+    stats = {
+        'width': a.shape[1],
+        'height': a.shape[0],
+        'tolerance': tolerance,
+        'total_pixels': total_pixels,
+        'diff_pixels': diff_count,
+        'diff_percent': 100.0 * diff_count / total_pixels if total_pixels else 0.0,
+        'match': diff_count == 0,
+        'max_error': int(error.max()) if error.size else 0,
+        'mean_error': float(error.mean()) if error.size else 0.0,
+        'psnr': psnr(mse),
+        'channels': {},
+    }
+    for i, name in enumerate(CHANNELS):
+        channel = error[:, :, i]
+        stats['channels'][name] = {
+            'diff_pixels': int(np.count_nonzero(over[:, :, i])),
+            'max_error': int(channel.max()) if channel.size else 0,
+            'mean_error': float(channel.mean()) if channel.size else 0.0,
+            'psnr': psnr(float(np.mean(np.square(channel, dtype=np.float64)))),
+        }
+    return stats, mask
+
+
+def diffImage(a, b):
+    #absolute rgb difference as an image
+    return Image.fromarray(np.abs(a[:, :, :3].astype(np.int16) - b[:, :, :3]).astype(np.uint8), 'RGB')
 
-img1 = Image.open(sys.argv[1])
-img2 = Image.open(sys.argv[2])
 
-if img1.size != img2.size:
-    print(f"Images have different sizes: {img1.size} vs {img2.size}")
-    sys.exit(1)
+def main():
+    parser = argparse.ArgumentParser(description="Compare two images and write their difference image")
+    parser.add_argument('image1')
+    parser.add_argument('image2')
+    parser.add_argument('--tolerance', type=int, default=0, help="largest channel difference that still counts as equal")
+    parser.add_argument('--json', action='store_true', help="print the stats as one json object instead of text")
+    parser.add_argument('--diff', default='difference.png', help="where to write the difference image")
+    parser.add_argument('--no-diff', action='store_true', help="don't write a difference image")
+    args = parser.parse_args()
 
-diff_count = 0
-total_pixels = img1.size[0] * img1.size[1]
+    a = loadRgba(args.image1)
+    b = loadRgba(args.image2)
+    if a.shape != b.shape:
+        message = f"Images have different sizes: {a.shape[1::-1]} vs {b.shape[1::-1]}"
+        if args.json:
+            print(json.dumps({'match': False, 'error': message}))
+        else:
+            print(message)
+        sys.exit(1)
 
-for y in range(img1.size[1]):
-    for x in range(img1.size[0]):
-        p1 = img1.getpixel((x, y))
-        p2 = img2.getpixel((x, y))
-        if p1 != p2:
-            diff_count += 1
-            if diff_count <= 10:
-                print(f"Diff at ({x}, {y}): {p1} vs {p2}")
+    stats, mask = compareArrays(a, b, args.tolerance)
+    if not args.no_diff:
+        diffImage(a, b).save(args.diff)
+        stats['diff_image'] = args.diff
 
-print(f"\nTotal differences: {diff_count} out of {total_pixels} pixels ({100.0 * diff_count / total_pixels:.2f}%)")
+    if args.json:
+        print(json.dumps(stats))
+        return
 
-#create difference image
-diff_img = Image.new('RGB', img1.size)
-for y in range(img1.size[1]):
-    for x in range(img1.size[0]):
-        p1 = img1.getpixel((x, y))[:3] if len(img1.getpixel((x, y))) > 3 else img1.getpixel((x, y))
-        p2 = img2.getpixel((x, y))[:3] if len(img2.getpixel((x, y))) > 3 else img2.getpixel((x, y))
-        diff = tuple(abs(p1[i] - p2[i]) for i in range(3))
-        diff_img.putpixel((x, y), diff)
+    for y, x in np.argwhere(mask)[:SHOW_DIFFS]:
+        print(f"Diff at ({x}, {y}): {tuple(int(v) for v in a[y, x])} vs {tuple(int(v) for v in b[y, x])}")
+    print(f"\nTotal differences: {stats['diff_pixels']} out of {stats['total_pixels']} pixels ({stats['diff_percent']:.2f}%)")
+    psnr_text = "inf" if stats['psnr'] is None else f"{stats['psnr']:.2f}"
+    print(f"Max error: {stats['max_error']}  Mean error: {stats['mean_error']:.4f}  PSNR: {psnr_text} dB")
+    for name, channel in stats['channels'].items():
+        print(f"  {name}: {channel['diff_pixels']} pixels differ, max {channel['max_error']}, mean {channel['mean_error']:.4f}")
+    if not args.no_diff:
+        print(f"Saved difference image to {args.diff}")
 
-diff_img.save('difference.png')
-print("Saved difference image to difference.png")
 
+if __name__ == '__main__':
+    main()
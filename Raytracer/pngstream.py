@@ -0,0 +1,62 @@
+#streaming png encoder for raytracer.py
+#rows are filtered and deflated as they arrive, so only one band is ever in memory
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PNGStreamWriter:
+    #writes an 8-bit rgba png one band of scanlines at a time
+    def __init__(self, path, width, height, level=6):
+        self.width = width
+        self.height = height
+        self.stride = 4 * width
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(level)
+        self.file = open(path, 'wb')
+        self.file.write(PNG_SIGNATURE)
+        #bit depth 8, color type 6 (rgba), default compression/filter/interlace
+        self.writeChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+    
+    def writeChunk(self, tag, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(tag)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+    
+    def writeRows(self, data):
+        #data is raw rgba for whole scanlines, top to bottom
+        rows = len(data) // self.stride
+        if rows * self.stride != len(data):
+            raise ValueError("band is not a whole number of scanlines")
+        if self.rows_written + rows > self.height:
+            raise ValueError("more rows than the image height")
+        
+        #filter type 0 (none) in front of every scanline
+        filtered = bytearray()
+        for r in range(rows):
+            filtered.append(0)
+            filtered += data[r * self.stride:(r + 1) * self.stride]
+        compressed = self.compressor.compress(bytes(filtered))
+        if compressed:
+            self.writeChunk(b'IDAT', compressed)
+        self.rows_written += rows
+    
+    def close(self):
+        if self.rows_written != self.height:
+            self.file.close()
+            raise ValueError(f"wrote {self.rows_written} of {self.height} rows")
+        self.writeChunk(b'IDAT', self.compressor.flush())
+        self.writeChunk(b'IEND', b'')
+        self.file.close()
@@ -1,10 +1,19 @@
+import os
 import sys
 import math
+import time
+import random
+import argparse
+from array import array
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Tuple, Optional
 from PIL import Image
 
 
 class Vector3:
+    __slots__ = ('x', 'y', 'z')
+    
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -43,44 +52,81 @@ class Vector3:
 
 
 class Ray:
+    __slots__ = ('origin', 'direction', 'length')
+    
     def __init__(self, origin, direction):
         self.origin = origin
         self.direction = direction
+        #direction length, shared by every sphere test along this ray
+        self.length = direction.length()
 
 
 class Sphere:
+    __slots__ = ('center', 'radius', 'color', 'texture', 'radius_squared')
+    
     def __init__(self, center, radius, color, texture=None):
         self.center = center
         self.radius = radius
         self.color = color
         self.texture = texture
+        #filled in by compileScene
+        self.radius_squared = None
+    
+    def compile(self):
+        self.radius_squared = self.radius * self.radius
 
 
 class Sun:
+    __slots__ = ('direction', 'color')
+    
     def __init__(self, direction, color):
         self.direction = direction
         self.color = color
 
 
 class Plane:
+    __slots__ = ('a', 'b', 'c', 'd', 'color', 'normal')
+    
     def __init__(self, a, b, c, d, color):
         self.a = a
         self.b = b
         self.c = c
         self.d = d
         self.color = color
+        #filled in by compileScene
+        self.normal = None
+    
+    def compile(self):
+        #t keeps using the raw a, b, c, d so hit distances stay bit-for-bit the same
+        self.normal = Vector3(self.a, self.b, self.c).normalize()
 
 
 class Triangle:
+    __slots__ = ('v0', 'v1', 'v2', 'color', 'texture', 'e1x', 'e1y', 'e1z', 'e2x', 'e2y', 'e2z', 'nx', 'ny', 'nz')
+    
     def __init__(self, v0, v1, v2, color, texture=None):
         self.v0 = v0
         self.v1 = v1
         self.v2 = v2
         self.color = color
         self.texture = texture
+        #edge1, edge2 and unit normal as plain floats, filled in by compileScene
+        self.e1x = self.e1y = self.e1z = None
+        self.e2x = self.e2y = self.e2z = None
+        self.nx = self.ny = self.nz = None
+    
+    def compile(self):
+        edge1 = self.v1 - self.v0
+        edge2 = self.v2 - self.v0
+        normal = edge1.cross(edge2).normalize()
+        self.e1x, self.e1y, self.e1z = edge1.x, edge1.y, edge1.z
+        self.e2x, self.e2y, self.e2z = edge2.x, edge2.y, edge2.z
+        self.nx, self.ny, self.nz = normal.x, normal.y, normal.z
 
 
 class Intersection:
+    __slots__ = ('t', 'point', 'normal', 'sphere')
+    
     def __init__(self, t, point, normal, sphere):
         self.t = t
         self.point = point
@@ -88,6 +134,24 @@ class Intersection:
         self.sphere = sphere
 
 
+class Texture:
+    #decoded rgb texels kept as raw bytes, linearized through SRGB_TO_LINEAR on lookup
+    #name is the texture line's file name, scenecache.py uses it to find the texture again
+    __slots__ = ('width', 'height', 'data', 'name')
+    
+    def __init__(self, img):
+        img = img.convert('RGB')
+        self.width, self.height = img.size
+        self.data = img.tobytes()
+        self.name = None
+    
+    def sample(self, xi, yi):
+        #linear color of texel (xi, yi)
+        i = 3 * (yi * self.width + xi)
+        data = self.data
+        return Vector3(SRGB_TO_LINEAR[data[i]], SRGB_TO_LINEAR[data[i + 1]], SRGB_TO_LINEAR[data[i + 2]])
+
+
 def linearToSrgb(linear):
     #srgb<-lin
     if linear <= 0.0031308:
@@ -104,46 +168,41 @@ def srgbToLinear(srgb):
         return ((srgb + 0.055) / 1.055) ** 2.4
 
 
+#srgb -> linear for every 8-bit channel value
+SRGB_TO_LINEAR = [srgbToLinear(i / 255.0) for i in range(256)]
+
+
 def clamp(value, min_val, max_val):
     #clamp value between min and max
     return max(min_val, min(max_val, value))
 
 
-def hitSphere(ray, sphere):
-    #ray vs sphere
-    ro = ray.origin
-    r_d = ray.direction
-    c = sphere.center
-    r = sphere.radius
-    
+def sphereHitT(ox, oy, oz, dx, dy, dz, r_d_length, cx, cy, cz, r_squared):
+    #ray vs sphere on plain floats, returns t or None without allocating
     #check if ray origin inside sphere
-    oc = ro - c
-    oc_squared = oc.dot(oc)
-    r_squared = r * r
+    ocx = ox - cx
+    ocy = oy - cy
+    ocz = oz - cz
+    oc_squared = ocx * ocx + ocy * ocy + ocz * ocz
     inside = oc_squared < r_squared
     
     #calculate distance along ray to closest approach to center
-    r_d_length = r_d.length()
     if r_d_length == 0:
         return None
     
-    c_minus_ro = c - ro
-    t_c = c_minus_ro.dot(r_d) / r_d_length
+    t_c = ((cx - ox) * dx + (cy - oy) * dy + (cz - oz) * dz) / r_d_length
     
     #if ray origin outside and t_c < 0, no intersection
     if not inside and t_c < 0:
         return None
     
     #calculate d^2
-    closest_point = ro + r_d * t_c
-    d_vec = closest_point - c
-    d_squared = d_vec.dot(d_vec)
-    
-    #if ray origin outside and r^2 < d^2, no intersection
-    if not inside and r_squared < d_squared:
-        return None
+    d_x = ox + dx * t_c - cx
+    d_y = oy + dy * t_c - cy
+    d_z = oz + dz * t_c - cz
+    d_squared = d_x * d_x + d_y * d_y + d_z * d_z
     
-    #calculate t_offset
+    #no intersection if r^2 < d^2
     if r_squared < d_squared:
         return None
     
@@ -158,61 +217,344 @@ def hitSphere(ray, sphere):
     #only return if t is positive
     if t <= 0:
         return None
-    
-    #calculate intersection point and normal
-    point = ro + r_d * t
-    normal = (point - c).normalize()
-    
+    return t
+
+
+def triHitT(ox, oy, oz, dx, dy, dz, ax, ay, az, e1x, e1y, e1z, e2x, e2y, e2z):
+    #moller-trumbore on plain floats with precomputed edges, returns t or None
+    px = dy * e2z - dz * e2y
+    py = dz * e2x - dx * e2z
+    pz = dx * e2y - dy * e2x
+    det = e1x * px + e1y * py + e1z * pz
+    if abs(det) < 1e-12:
+        return None
+    inv_det = 1.0 / det
+    tx = ox - ax
+    ty = oy - ay
+    tz = oz - az
+    u = (tx * px + ty * py + tz * pz) * inv_det
+    if u < 0.0 or u > 1.0:
+        return None
+    qx = ty * e1z - tz * e1y
+    qy = tz * e1x - tx * e1z
+    qz = tx * e1y - ty * e1x
+    v = (dx * qx + dy * qy + dz * qz) * inv_det
+    if v < 0.0 or u + v > 1.0:
+        return None
+    t = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+    if t <= 0:
+        return None
+    return t
+
+
+def sphereIntersection(ray, sphere, t):
+    #build the intersection record for a sphere hit at t
+    point = ray.origin + ray.direction * t
+    normal = (point - sphere.center).normalize()
     return Intersection(t=t, point=point, normal=normal, sphere=sphere)
 
 
+def triIntersection(ray, tri, t):
+    #build the intersection record for a triangle hit at t
+    point = ray.origin + ray.direction * t
+    return Intersection(t=t, point=point, normal=Vector3(tri.nx, tri.ny, tri.nz), sphere=tri)
+
+
+def hitSphere(ray, sphere):
+    #ray vs sphere
+    o = ray.origin
+    d = ray.direction
+    c = sphere.center
+    t = sphereHitT(o.x, o.y, o.z, d.x, d.y, d.z, ray.length, c.x, c.y, c.z, sphere.radius_squared)
+    if t is None:
+        return None
+    return sphereIntersection(ray, sphere, t)
+
+
 def hitPlane(ray, plane):
     #ray vs plane
     a = plane.a
     b = plane.b
     c = plane.c
     d = plane.d
-    n = Vector3(a, b, c)
-    denom = n.dot(ray.direction)
+    direction = ray.direction
+    denom = a * direction.x + b * direction.y + c * direction.z
     if abs(denom) < 1e-12:
         return None
     t = -(a * ray.origin.x + b * ray.origin.y + c * ray.origin.z + d) / denom
     if t <= 0:
         return None
     point = ray.origin + ray.direction * t
-    normal = n.normalize()
-    return Intersection(t=t, point=point, normal=normal, sphere=plane)
+    return Intersection(t=t, point=point, normal=plane.normal, sphere=plane)
 
 
 def hitTri(ray, tri):
     #moller-trumbore
+    o = ray.origin
+    d = ray.direction
     v0 = tri.v0
-    v1 = tri.v1
-    v2 = tri.v2
-    edge1 = v1 - v0
-    edge2 = v2 - v0
-    pvec = ray.direction.cross(edge2)
-    det = edge1.dot(pvec)
-    if abs(det) < 1e-12:
-        return None
-    inv_det = 1.0 / det
-    tvec = ray.origin - v0
-    u = tvec.dot(pvec) * inv_det
-    if u < 0.0 or u > 1.0:
+    t = triHitT(o.x, o.y, o.z, d.x, d.y, d.z, v0.x, v0.y, v0.z, tri.e1x, tri.e1y, tri.e1z, tri.e2x, tri.e2y, tri.e2z)
+    if t is None:
         return None
-    qvec = tvec.cross(edge1)
-    v = ray.direction.dot(qvec) * inv_det
-    if v < 0.0 or u + v > 1.0:
-        return None
-    t = edge2.dot(qvec) * inv_det
-    if t <= 0:
-        return None
-    point = ray.origin + ray.direction * t
-    normal = edge1.cross(edge2).normalize()
-    return Intersection(t=t, point=point, normal=normal, sphere=tri)
+    return triIntersection(ray, tri, t)
+
+
+#leaf size and box padding for the bvh
+BVH_LEAF_SIZE = 4
+BVH_EPSILON = 1e-7
 
+#primitive kinds, also the first part of findHit's tie breaking order
+KIND_SPHERE = 0
+KIND_PLANE = 1
+KIND_TRIANGLE = 2
 
-def findHit(ray, spheres, planes=None, triangles=None, exclude_sphere=None, min_t_threshold=0.0):
+
+def orderKey(kind, index):
+    #findHit visits spheres, then planes, then triangles, earlier wins ties
+    return (kind << 40) | index
+
+
+def objectBounds(obj):
+    #aabb of a sphere or triangle as (minx, miny, minz, maxx, maxy, maxz)
+    if isinstance(obj, Sphere):
+        c = obj.center
+        r = abs(obj.radius)
+        lo = (c.x - r, c.y - r, c.z - r)
+        hi = (c.x + r, c.y + r, c.z + r)
+    else:
+        v0, v1, v2 = obj.v0, obj.v1, obj.v2
+        lo = (min(v0.x, v1.x, v2.x), min(v0.y, v1.y, v2.y), min(v0.z, v1.z, v2.z))
+        hi = (max(v0.x, v1.x, v2.x), max(v0.y, v1.y, v2.y), max(v0.z, v1.z, v2.z))
+    #pad so rounding in the hit tests never falls outside the box
+    pad = BVH_EPSILON * (1.0 + max(abs(v) for v in lo + hi))
+    return (lo[0] - pad, lo[1] - pad, lo[2] - pad, hi[0] + pad, hi[1] + pad, hi[2] + pad)
+
+
+def compileScene(spheres, planes, triangles):
+    #scene compile stage: precompute per-primitive hit data once after parsing
+    #rerun after moving anything
+    for obj in spheres:
+        obj.compile()
+    for obj in planes:
+        obj.compile()
+    for obj in triangles:
+        obj.compile()
+
+
+class GeometryArrays:
+    #struct-of-arrays copy of compiled sphere data for the scalar hit paths
+    #triangles need no copy, the hit paths read their compiled fields directly
+    __slots__ = ('sphere_x', 'sphere_y', 'sphere_z', 'sphere_r2')
+    
+    def __init__(self, spheres):
+        self.sphere_x = array('d', (s.center.x for s in spheres))
+        self.sphere_y = array('d', (s.center.y for s in spheres))
+        self.sphere_z = array('d', (s.center.z for s in spheres))
+        self.sphere_r2 = array('d', (s.radius_squared for s in spheres))
+    
+    def moveSphere(self, index, sphere):
+        #copy a recompiled sphere back in after its center or radius changed
+        self.sphere_x[index] = sphere.center.x
+        self.sphere_y[index] = sphere.center.y
+        self.sphere_z[index] = sphere.center.z
+        self.sphere_r2[index] = sphere.radius_squared
+
+
+class BVH:
+    #bounding volume hierarchy over compiled spheres and triangles
+    #nodes are flattened depth-first: the left child of node n is n + 1
+    def __init__(self, spheres, triangles, leaf_size=BVH_LEAF_SIZE):
+        self.geometry = GeometryArrays(spheres)
+        items = []
+        for i, sphere in enumerate(spheres):
+            items.append((sphere, KIND_SPHERE, i, objectBounds(sphere)))
+        for i, tri in enumerate(triangles):
+            items.append((tri, KIND_TRIANGLE, i, objectBounds(tri)))
+        
+        self.leaf_size = max(1, leaf_size)
+        #primitives in leaf order
+        self.objects = []
+        self.kinds = array('b')
+        self.indices = array('l')
+        #per node: 6 floats of bounds, right child, split axis, first primitive, primitive count
+        self.bounds = array('d')
+        self.right = array('l')
+        self.axis = array('b')
+        self.start = array('l')
+        self.count = array('l')
+        if items:
+            self.build(items)
+    
+    def __len__(self):
+        return len(self.objects)
+    
+    def build(self, items):
+        #iterative build, each stack entry is (item list, parent node)
+        stack = [(items, -1)]
+        while stack:
+            group, parent = stack.pop()
+            node = len(self.count)
+            if parent >= 0:
+                self.right[parent] = node
+            
+            for k in range(6):
+                if k < 3:
+                    self.bounds.append(min(b[3][k] for b in group))
+                else:
+                    self.bounds.append(max(b[3][k] for b in group))
+            self.right.append(-1)
+            
+            if len(group) <= self.leaf_size:
+                self.axis.append(0)
+                self.start.append(len(self.objects))
+                self.count.append(len(group))
+                for obj, kind, index, _ in group:
+                    self.objects.append(obj)
+                    self.kinds.append(kind)
+                    self.indices.append(index)
+                continue
+            
+            #median split on the longest centroid axis
+            cmin = [min(b[3][k] + b[3][k + 3] for b in group) for k in range(3)]
+            cmax = [max(b[3][k] + b[3][k + 3] for b in group) for k in range(3)]
+            axis = max(range(3), key=lambda k: cmax[k] - cmin[k])
+            group = sorted(group, key=lambda b: b[3][axis] + b[3][axis + 3])
+            mid = len(group) // 2
+            self.axis.append(axis)
+            self.start.append(0)
+            self.count.append(0)
+            #right is pushed first so the left subtree lands at node + 1
+            stack.append((group[mid:], node))
+            stack.append((group[:mid], -1))
+    
+    def refit(self, moved):
+        #update after the (kind, index) primitives in moved were changed and recompiled
+        #the tree shape stays, only the boxes of their leaves and those leaves' ancestors are recomputed
+        if not hasattr(self, 'parent'):
+            #parent of every node, and leaf node and leaf order position of every primitive, found once
+            self.parent = array('l', [-1]) * len(self.count)
+            self.leaf = {}
+            for n in range(len(self.count)):
+                if self.count[n]:
+                    for i in range(self.start[n], self.start[n] + self.count[n]):
+                        self.leaf[(self.kinds[i], self.indices[i])] = (n, i)
+                else:
+                    self.parent[n + 1] = n
+                    self.parent[self.right[n]] = n
+        
+        dirty = set()
+        for kind, index in moved:
+            n, i = self.leaf[(kind, index)]
+            #triangles are read from their own compiled fields, only spheres have a copy to update
+            if kind == KIND_SPHERE:
+                self.geometry.moveSphere(index, self.objects[i])
+            while n >= 0 and n not in dirty:
+                dirty.add(n)
+                n = self.parent[n]
+        
+        #children always come after their parent, so deepest first
+        bounds = self.bounds
+        for n in sorted(dirty, reverse=True):
+            if self.count[n]:
+                boxes = [objectBounds(self.objects[i]) for i in range(self.start[n], self.start[n] + self.count[n])]
+            else:
+                boxes = [bounds[6 * c:6 * c + 6] for c in (n + 1, self.right[n])]
+            for k in range(3):
+                bounds[6 * n + k] = min(b[k] for b in boxes)
+                bounds[6 * n + k + 3] = max(b[k + 3] for b in boxes)
+
+
+def hitBVH(ray, bvh, exclude_sphere=None, min_t_threshold=0.0):
+    #closest hit inside the bvh, returns (intersection, order key)
+    if not bvh.count:
+        return None, None
+    min_t = float('inf')
+    best = -1
+    best_order = None
+    
+    ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+    d = ray.direction
+    dx, dy, dz = d.x, d.y, d.z
+    dlen = ray.length
+    dirs = (dx, dy, dz)
+    #huge finite stand-in avoids 0 * inf for axis-aligned rays
+    ix = 1.0 / dx if dx != 0 else 1e300
+    iy = 1.0 / dy if dy != 0 else 1e300
+    iz = 1.0 / dz if dz != 0 else 1e300
+    
+    bounds = bvh.bounds
+    counts = bvh.count
+    objects = bvh.objects
+    kinds = bvh.kinds
+    indices = bvh.indices
+    geo = bvh.geometry
+    sx, sy, sz, sr2 = geo.sphere_x, geo.sphere_y, geo.sphere_z, geo.sphere_r2
+    
+    stack = [0]
+    while stack:
+        n = stack.pop()
+        #slab test
+        b = 6 * n
+        t0 = (bounds[b] - ox) * ix
+        t1 = (bounds[b + 3] - ox) * ix
+        if t0 > t1:
+            t0, t1 = t1, t0
+        ty0 = (bounds[b + 1] - oy) * iy
+        ty1 = (bounds[b + 4] - oy) * iy
+        if ty0 > ty1:
+            ty0, ty1 = ty1, ty0
+        if ty0 > t0:
+            t0 = ty0
+        if ty1 < t1:
+            t1 = ty1
+        tz0 = (bounds[b + 2] - oz) * iz
+        tz1 = (bounds[b + 5] - oz) * iz
+        if tz0 > tz1:
+            tz0, tz1 = tz1, tz0
+        if tz0 > t0:
+            t0 = tz0
+        if tz1 < t1:
+            t1 = tz1
+        #keep boxes that tie the best t so order keys can break the tie
+        if t0 > t1 or t1 < 0 or t0 > min_t:
+            continue
+        
+        count = counts[n]
+        if count:
+            first = bvh.start[n]
+            for i in range(first, first + count):
+                if objects[i] is exclude_sphere:
+                    continue
+                k = indices[i]
+                if kinds[i] == KIND_SPHERE:
+                    t = sphereHitT(ox, oy, oz, dx, dy, dz, dlen, sx[k], sy[k], sz[k], sr2[k])
+                else:
+                    tri = objects[i]
+                    v0 = tri.v0
+                    t = triHitT(ox, oy, oz, dx, dy, dz, v0.x, v0.y, v0.z, tri.e1x, tri.e1y, tri.e1z, tri.e2x, tri.e2y, tri.e2z)
+                if t is not None and t > min_t_threshold:
+                    if t < min_t or (t == min_t and orderKey(kinds[i], k) < best_order):
+                        min_t = t
+                        best = i
+                        best_order = orderKey(kinds[i], k)
+        else:
+            #push the far child first so the near one is visited first
+            if dirs[bvh.axis[n]] < 0:
+                stack.append(n + 1)
+                stack.append(bvh.right[n])
+            else:
+                stack.append(bvh.right[n])
+                stack.append(n + 1)
+    
+    if best < 0:
+        return None, None
+    #only the winning hit gets an intersection record
+    if kinds[best] == KIND_SPHERE:
+        return sphereIntersection(ray, objects[best], min_t), best_order
+    return triIntersection(ray, objects[best], min_t), best_order
+
+
+def findHit(ray, spheres, planes=None, triangles=None, exclude_sphere=None, min_t_threshold=0.0, bvh=None):
     #closest hit
     closest = None
     min_t = float('inf')
@@ -220,6 +562,23 @@ def findHit(ray, spheres, planes=None, triangles=None, exclude_sphere=None, min_
         planes = []
     if triangles is None:
         triangles = []
+    
+    if bvh is not None:
+        #spheres and triangles come from the bvh, unbounded planes stay a flat list
+        closest, best_order = hitBVH(ray, bvh, exclude_sphere, min_t_threshold)
+        if closest is not None:
+            min_t = closest.t
+        for i, plane in enumerate(planes):
+            if exclude_sphere is not None and plane is exclude_sphere:
+                continue
+            intersection = hitPlane(ray, plane)
+            if intersection and intersection.t > min_t_threshold:
+                t = intersection.t
+                if t < min_t or (t == min_t and orderKey(KIND_PLANE, i) < best_order):
+                    min_t = t
+                    closest = intersection
+                    best_order = orderKey(KIND_PLANE, i)
+        return closest
 
     for sphere in spheres:
         if exclude_sphere is not None and sphere is exclude_sphere:
@@ -246,16 +605,123 @@ def findHit(ray, spheres, planes=None, triangles=None, exclude_sphere=None, min_
     return closest
 
 
-def shadeRay(ray, spheres, suns, x=None, y=None, width=None, height=None):
+def occludedBVH(ray, bvh, exclude=None):
+    #any-hit query, returns the first blocker found in the bvh or None
+    if not bvh.count:
+        return None
+    
+    ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+    d = ray.direction
+    dx, dy, dz = d.x, d.y, d.z
+    dlen = ray.length
+    ix = 1.0 / dx if dx != 0 else 1e300
+    iy = 1.0 / dy if dy != 0 else 1e300
+    iz = 1.0 / dz if dz != 0 else 1e300
+    
+    bounds = bvh.bounds
+    counts = bvh.count
+    objects = bvh.objects
+    kinds = bvh.kinds
+    indices = bvh.indices
+    geo = bvh.geometry
+    sx, sy, sz, sr2 = geo.sphere_x, geo.sphere_y, geo.sphere_z, geo.sphere_r2
+    
+    stack = [0]
+    while stack:
+        n = stack.pop()
+        #slab test, no closest t to prune against
+        b = 6 * n
+        t0 = (bounds[b] - ox) * ix
+        t1 = (bounds[b + 3] - ox) * ix
+        if t0 > t1:
+            t0, t1 = t1, t0
+        ty0 = (bounds[b + 1] - oy) * iy
+        ty1 = (bounds[b + 4] - oy) * iy
+        if ty0 > ty1:
+            ty0, ty1 = ty1, ty0
+        if ty0 > t0:
+            t0 = ty0
+        if ty1 < t1:
+            t1 = ty1
+        tz0 = (bounds[b + 2] - oz) * iz
+        tz1 = (bounds[b + 5] - oz) * iz
+        if tz0 > tz1:
+            tz0, tz1 = tz1, tz0
+        if tz0 > t0:
+            t0 = tz0
+        if tz1 < t1:
+            t1 = tz1
+        if t0 > t1 or t1 < 0:
+            continue
+        
+        count = counts[n]
+        if count:
+            first = bvh.start[n]
+            for i in range(first, first + count):
+                if objects[i] is exclude:
+                    continue
+                k = indices[i]
+                if kinds[i] == KIND_SPHERE:
+                    t = sphereHitT(ox, oy, oz, dx, dy, dz, dlen, sx[k], sy[k], sz[k], sr2[k])
+                else:
+                    tri = objects[i]
+                    v0 = tri.v0
+                    t = triHitT(ox, oy, oz, dx, dy, dz, v0.x, v0.y, v0.z, tri.e1x, tri.e1y, tri.e1z, tri.e2x, tri.e2y, tri.e2z)
+                if t is not None:
+                    return objects[i]
+        else:
+            stack.append(bvh.right[n])
+            stack.append(n + 1)
+    
+    return None
+
+
+def blocks(ray, obj):
+    #true if obj is hit anywhere in front of the ray origin
+    if isinstance(obj, Sphere):
+        return hitSphere(ray, obj) is not None
+    if isinstance(obj, Plane):
+        return hitPlane(ray, obj) is not None
+    return hitTri(ray, obj) is not None
+
+
+def occluded(ray, scene, exclude=None, cache=None, key=None):
+    #any-hit shadow query, stops at the first blocker instead of finding the closest
+    #cache maps key (the sun) -> last blocker, neighbouring pixels usually share it
+    if cache is not None:
+        blocker = cache.get(key)
+        if blocker is not None and blocker is not exclude and blocks(ray, blocker):
+            return True
+    
+    #planes are few and large, so they are cheap likely blockers
+    blocker = None
+    for plane in scene.planes:
+        if plane is not exclude and hitPlane(ray, plane) is not None:
+            blocker = plane
+            break
+    if blocker is None:
+        blocker = occludedBVH(ray, scene.bvh, exclude)
+    
+    if blocker is None:
+        return False
+    if cache is not None:
+        cache[key] = blocker
+    return True
+
+
+def shadeRay(ray, scene, shadow_cache=None):
     #shade ray
-    global _planes_for_tracing
-    planes = _planes_for_tracing if '_planes_for_tracing' in globals() else []
-    triangles = _triangles_for_tracing if '_triangles_for_tracing' in globals() else []
-    intersection = findHit(ray, spheres, planes, triangles)
+    intersection = findHit(ray, scene.spheres, scene.planes, scene.triangles, bvh=scene.bvh)
     
     if intersection is None:
         #background is transparent
         return None
+    return shadeHit(ray, intersection, scene, shadow_cache)
+
+
+def shadeHit(ray, intersection, scene, shadow_cache=None):
+    #lit color of a known intersection
+    suns = scene.suns
     
     #make objects flip normal if pointing away from ray
     normal = intersection.normal
@@ -274,13 +740,11 @@ def shadeRay(ray, spheres, suns, x=None, y=None, width=None, height=None):
             #wrap u, clamp v
             u = u % 1.0
             v = min(1.0, max(0.0, v))
-            img = obj.texture
-            w, h = img.size
+            tex = obj.texture
             #nearest sample
-            xi = int(u * (w - 1))
-            yi = int(v * (h - 1))
-            r, g, b = img.getpixel((xi, yi))
-            return Vector3(srgbToLinear(r / 255.0), srgbToLinear(g / 255.0), srgbToLinear(b / 255.0))
+            xi = int(u * (tex.width - 1))
+            yi = int(v * (tex.height - 1))
+            return tex.sample(xi, yi)
         #solid color
         return obj.color
     
@@ -289,7 +753,7 @@ def shadeRay(ray, spheres, suns, x=None, y=None, width=None, height=None):
     #compute lighting using lambert's law
     color = Vector3(0, 0, 0)
     
-    for sun in suns:
+    for sun_index, sun in enumerate(suns):
         #shadow ray
         light_dir = sun.direction.normalize()
         #shadow bias
@@ -299,12 +763,10 @@ def shadeRay(ray, spheres, suns, x=None, y=None, width=None, height=None):
             direction=light_dir
         )
         
-        #check for shadow
-        shadow_intersection = findHit(
-            shadow_ray, spheres, planes, triangles, exclude_sphere=intersection.sphere, min_t_threshold=0.0
-        )
+        #check for shadow, any blocker will do
+        in_shadow = occluded(shadow_ray, scene, exclude=intersection.sphere, cache=shadow_cache, key=sun_index)
         
-        if shadow_intersection is None:
+        if not in_shadow:
             #not in shadow, add lighting
             lambert = max(0, normal.dot(light_dir))
             #lambert's law
@@ -358,8 +820,15 @@ def generateRay(x, y, width, height, eye, forward, right, up, camera_mode='pinho
     return Ray(origin=eye, direction=direction)
 
 
-def parseFile(filename):
+def parseFile(filename, textures=None):
     #parse scene
+    with open(filename, 'r') as f:
+        return parseLines(f, textures)
+
+
+def parseLines(lines, textures=None):
+    #parse scene lines, also used by scenecache.py for the camera lines of a cached scene
+    #textures maps file name -> Texture, pass one in to share decoded textures between scenes
     width = 0
     height = 0
     output_filename = ""
@@ -373,122 +842,135 @@ def parseFile(filename):
     forward = None
     up = None
     camera_mode = 'pinhole'
-    current_texture = None  # PIL image or None
+    aa_samples = 0
+    aa_threshold = AA_THRESHOLD
+    current_texture = None  # Texture or None
+    if textures is None:
+        textures = {}  # file name -> Texture, each file is decoded once
     
     #state
     current_color = Vector3(1, 1, 1)
     
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            parts = line.split()
-            if not parts:
-                continue
-            
-            keyword = parts[0]
-            
-            if keyword == 'png':
-                width = int(parts[1])
-                height = int(parts[2])
-                output_filename = parts[3]
-            
-            elif keyword == 'expose':
-                exposure = float(parts[1])
-            
-            elif keyword == 'eye':
-                ex = float(parts[1])
-                ey = float(parts[2])
-                ez = float(parts[3])
-                eye = Vector3(ex, ey, ez)
-            
-            elif keyword == 'forward':
-                fx = float(parts[1])
-                fy = float(parts[2])
-                fz = float(parts[3])
-                forward = Vector3(fx, fy, fz)
-            
-            elif keyword == 'up':
-                ux = float(parts[1])
-                uy = float(parts[2])
-                uz = float(parts[3])
-                up = Vector3(ux, uy, uz)
-            
-            elif keyword == 'color':
-                r = float(parts[1])
-                g = float(parts[2])
-                b = float(parts[3])
-                current_color = Vector3(r, g, b)
-            
-            elif keyword == 'sphere':
-                x = float(parts[1])
-                y = float(parts[2])
-                z = float(parts[3])
-                r = float(parts[4])
-                center = Vector3(x, y, z)
-                sphere = Sphere(center=center, radius=r, color=current_color, texture=current_texture)
-                spheres.append(sphere)
-            
-            elif keyword == 'sun':
-                x = float(parts[1])
-                y = float(parts[2])
-                z = float(parts[3])
-                direction = Vector3(x, y, z)
-                sun = Sun(direction=direction, color=current_color)
-                suns.append(sun)
-            
-            elif keyword == 'fisheye':
-                camera_mode = 'fisheye'
-            
-            elif keyword == 'panorama':
-                camera_mode = 'panorama'
-            
-            elif keyword == 'plane':
-                a = float(parts[1])
-                b = float(parts[2])
-                c = float(parts[3])
-                d = float(parts[4])
-                planes.append(Plane(a, b, c, d, current_color))
-            
-            elif keyword == 'xyz':
-                x = float(parts[1])
-                y = float(parts[2])
-                z = float(parts[3])
-                vertices.append(Vector3(x, y, z))
-            
-            elif keyword == 'tri':
-                i1 = int(parts[1])
-                i2 = int(parts[2])
-                i3 = int(parts[3])
-                def resolve(idx):
-                    if idx > 0:
-                        return idx - 1
-                    else:
-                        return len(vertices) + idx
-                try:
-                    v0 = vertices[resolve(i1)]
-                    v1 = vertices[resolve(i2)]
-                    v2 = vertices[resolve(i3)]
-                    triangles.append(Triangle(v0, v1, v2, current_color, texture=current_texture))
-                except Exception:
-                    #invalid indices; ignore
-                    pass
-            
-            elif keyword == 'texture':
-                texname = parts[1]
-                if texname.lower() == 'none':
-                    current_texture = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        
+        parts = line.split()
+        if not parts:
+            continue
+        
+        keyword = parts[0]
+        
+        if keyword == 'png':
+            width = int(parts[1])
+            height = int(parts[2])
+            output_filename = parts[3]
+        
+        elif keyword == 'expose':
+            exposure = float(parts[1])
+        
+        elif keyword == 'eye':
+            ex = float(parts[1])
+            ey = float(parts[2])
+            ez = float(parts[3])
+            eye = Vector3(ex, ey, ez)
+        
+        elif keyword == 'forward':
+            fx = float(parts[1])
+            fy = float(parts[2])
+            fz = float(parts[3])
+            forward = Vector3(fx, fy, fz)
+        
+        elif keyword == 'up':
+            ux = float(parts[1])
+            uy = float(parts[2])
+            uz = float(parts[3])
+            up = Vector3(ux, uy, uz)
+        
+        elif keyword == 'color':
+            r = float(parts[1])
+            g = float(parts[2])
+            b = float(parts[3])
+            current_color = Vector3(r, g, b)
+        
+        elif keyword == 'sphere':
+            x = float(parts[1])
+            y = float(parts[2])
+            z = float(parts[3])
+            r = float(parts[4])
+            center = Vector3(x, y, z)
+            sphere = Sphere(center=center, radius=r, color=current_color, texture=current_texture)
+            spheres.append(sphere)
+        
+        elif keyword == 'sun':
+            x = float(parts[1])
+            y = float(parts[2])
+            z = float(parts[3])
+            direction = Vector3(x, y, z)
+            sun = Sun(direction=direction, color=current_color)
+            suns.append(sun)
+        
+        elif keyword == 'fisheye':
+            camera_mode = 'fisheye'
+        
+        elif keyword == 'panorama':
+            camera_mode = 'panorama'
+        
+        elif keyword == 'aa':
+            #aa samples [threshold], samples x samples rays on edge pixels
+            aa_samples = int(parts[1])
+            if len(parts) > 2:
+                aa_threshold = float(parts[2])
+        
+        elif keyword == 'plane':
+            a = float(parts[1])
+            b = float(parts[2])
+            c = float(parts[3])
+            d = float(parts[4])
+            planes.append(Plane(a, b, c, d, current_color))
+        
+        elif keyword == 'xyz':
+            x = float(parts[1])
+            y = float(parts[2])
+            z = float(parts[3])
+            vertices.append(Vector3(x, y, z))
+        
+        elif keyword == 'tri':
+            i1 = int(parts[1])
+            i2 = int(parts[2])
+            i3 = int(parts[3])
+            def resolve(idx):
+                if idx > 0:
+                    return idx - 1
                 else:
+                    return len(vertices) + idx
+            try:
+                v0 = vertices[resolve(i1)]
+                v1 = vertices[resolve(i2)]
+                v2 = vertices[resolve(i3)]
+                triangles.append(Triangle(v0, v1, v2, current_color, texture=current_texture))
+            except Exception:
+                #invalid indices; ignore
+                pass
+        
+        elif keyword == 'texture':
+            texname = parts[1]
+            if texname.lower() == 'none':
+                current_texture = None
+            else:
+                if texname not in textures:
                     try:
-                        #load image with PIL and ensure RGB
-                        img = Image.open(texname).convert('RGB')
-                        current_texture = img
+                        #load image with PIL once per file
+                        with Image.open(texname) as img:
+                            texture = Texture(img)
+                        texture.name = texname
+                        textures[texname] = texture
                     except Exception:
-                        current_texture = None
-    
-    return width, height, output_filename, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode
+                        textures[texname] = None
+                current_texture = textures[texname]
+
+    return width, height, output_filename, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, aa_samples, aa_threshold
 
 
 def applyExposure(linear, exposure):
@@ -498,8 +980,8 @@ def applyExposure(linear, exposure):
     else:
         return linear
 
-def renderImg(width, height, spheres, planes, triangles, suns, exposure=None, eye=None, forward=None, up=None, camera_mode='pinhole'):
-    #render
+def cameraBasis(eye=None, forward=None, up=None):
+    #fill in camera defaults, returns (eye, forward, right, up)
     if eye is None:
         eye = Vector3(0, 0, 0)
     if forward is None:
@@ -517,70 +999,437 @@ def renderImg(width, height, spheres, planes, triangles, suns, exposure=None, ey
     else:
         right = right_vec.normalize()
         up_final = right.cross(forward_norm).normalize()
+    return eye, forward, right, up_final
+
+
+class Scene:
+    #everything a render needs, built once after parseFile
+    #plain attributes only so it pickles cleanly to worker processes
+    def __init__(self, width, height, spheres, planes, triangles, suns, exposure=None, eye=None, forward=None, up=None, camera_mode='pinhole', output_filename="", bvh=None, aa_samples=0, aa_threshold=None):
+        self.width = width
+        self.height = height
+        self.output_filename = output_filename
+        self.spheres = spheres
+        self.planes = planes
+        self.triangles = triangles
+        self.suns = suns
+        self.exposure = exposure
+        self.camera_mode = camera_mode
+        #adaptive antialiasing, 0 is one ray per pixel
+        self.aa_samples = aa_samples
+        self.aa_threshold = AA_THRESHOLD if aa_threshold is None else aa_threshold
+        self.eye, self.forward, self.right, self.up = cameraBasis(eye, forward, up)
+        compileScene(spheres, planes, triangles)
+        #build acceleration structure once
+        self.bvh = bvh if bvh is not None else BVH(spheres, triangles)
+
+
+def loadScene(filename, use_cache=False, textures=None):
+    #parseFile wrapped into a Scene
+    #use_cache maps the compiled geometry and bvh from scenecache.py instead of parsing when the scene is unchanged
+    bvh = None
+    if use_cache:
+        from scenecache import loadCached
+        parsed, bvh = loadCached(filename, textures)
+    else:
+        parsed = parseFile(filename, textures)
+    width, height, output_filename, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, aa_samples, aa_threshold = parsed
+    return Scene(width, height, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, output_filename,
+                 bvh=bvh, aa_samples=aa_samples, aa_threshold=aa_threshold)
+
+
+def toPixel(linear_color, exposure):
+    #linear color -> 8-bit rgba, None is transparent background
+    if linear_color is None:
+        return (0, 0, 0, 0)
     
-    #create image
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 255))
-    pixels = img.load()
+    #apply exposure
+    r_exposed = applyExposure(linear_color.x, exposure)
+    g_exposed = applyExposure(linear_color.y, exposure)
+    b_exposed = applyExposure(linear_color.z, exposure)
+    
+    #clamp exposed to 0-1
+    r_exposed = clamp(r_exposed, 0, 1)
+    g_exposed = clamp(g_exposed, 0, 1)
+    b_exposed = clamp(b_exposed, 0, 1)
+    
+    #convert to srgb
+    r_srgb = linearToSrgb(r_exposed)
+    g_srgb = linearToSrgb(g_exposed)
+    b_srgb = linearToSrgb(b_exposed)
+    
+    #clamp to 0-1 and convert to 0-255
+    r = int(clamp(r_srgb, 0, 1) * 255)
+    g = int(clamp(g_srgb, 0, 1) * 255)
+    b = int(clamp(b_srgb, 0, 1) * 255)
+    
+    return (r, g, b, 255)
+
+
+def renderPixel(scene, x, y, shadow_cache=None):
+    #trace one pixel, returns an rgba tuple
+    ray = generateRay(x, y, scene.width, scene.height, scene.eye, scene.forward, scene.right, scene.up, scene.camera_mode)
+    if ray is None:
+        #transparent where no ray is shot
+        return (0, 0, 0, 0)
+    return toPixel(shadeRay(ray, scene, shadow_cache), scene.exposure)
+
+
+#largest 8-bit channel step between neighbours, as a fraction of 255, before a pixel gets more rays
+AA_THRESHOLD = 0.1
+
+
+def traceSample(scene, x, y, shadow_cache=None):
+    #one primary ray through image position (x, y), returns (linear color, hit object, ray shot)
+    ray = generateRay(x, y, scene.width, scene.height, scene.eye, scene.forward, scene.right, scene.up, scene.camera_mode)
+    if ray is None:
+        return None, None, False
+    intersection = findHit(ray, scene.spheres, scene.planes, scene.triangles, bvh=scene.bvh)
+    if intersection is None:
+        return None, None, True
+    return shadeHit(ray, intersection, scene, shadow_cache), intersection.sphere, True
+
+
+def pixelsDiffer(pixel_a, obj_a, pixel_b, obj_b, limit):
+    #different object (or hit vs background) or a visible color step
+    if obj_a is not obj_b:
+        return True
+    return max(abs(a - b) for a, b in zip(pixel_a, pixel_b)) > limit
+
+
+def refinePixel(scene, x, y, samples, rng, shadow_cache=None):
+    #samples x samples jittered rays over the pixel, returns (rgba, rays shot)
+    #color averages the covered rays, alpha is the covered fraction
+    total = Vector3(0, 0, 0)
+    covered = 0
+    shot = 0
+    for j in range(samples):
+        for i in range(samples):
+            sx = x - 0.5 + (i + rng.random()) / samples
+            sy = y - 0.5 + (j + rng.random()) / samples
+            color, _, was_shot = traceSample(scene, sx, sy, shadow_cache)
+            shot += was_shot
+            if color is not None:
+                total = total + color
+                covered += 1
+    if covered == 0:
+        return (0, 0, 0, 0), shot
+    r, g, b, _ = toPixel(total * (1.0 / covered), scene.exposure)
+    return (r, g, b, int(255 * covered / (samples * samples) + 0.5)), shot
+
+
+def renderAdaptive(scene):
+    #one ray per pixel, then scene.aa_samples^2 more where neighbours disagree
+    #returns (image, primary rays per pixel)
+    width, height = scene.width, scene.height
+    limit = scene.aa_threshold * 255
+    shadow_cache = {}
+    pixels = []
+    objects = []
+    rays = 0
+    for y in range(height):
+        for x in range(width):
+            color, obj, shot = traceSample(scene, x, y, shadow_cache)
+            rays += shot
+            pixels.append(toPixel(color, scene.exposure))
+            objects.append(obj)
     
-    #render each pixel
+    #flag both sides of every edge
+    edge = bytearray(width * height)
     for y in range(height):
         for x in range(width):
-            ray = generateRay(x, y, width, height, eye, forward, right, up_final, camera_mode)
-            if ray is None:
-                #transparent where no ray is shot
-                pixels[x, y] = (0, 0, 0, 0)
-                continue
-            #set global planes for tracing
-            globals()['_planes_for_tracing'] = planes
-            globals()['_triangles_for_tracing'] = triangles
-            linear_color = shadeRay(ray, spheres, suns, x, y, width, height)
-            
-            if linear_color is None:
-                #transparent background
-                pixels[x, y] = (0, 0, 0, 0)
-            else:
-                #apply exposure
-                r_exposed = applyExposure(linear_color.x, exposure)
-                g_exposed = applyExposure(linear_color.y, exposure)
-                b_exposed = applyExposure(linear_color.z, exposure)
-                
-                #clamp exposed to 0-1
-                r_exposed = clamp(r_exposed, 0, 1)
-                g_exposed = clamp(g_exposed, 0, 1)
-                b_exposed = clamp(b_exposed, 0, 1)
-                
-                #convert to srgb
-                r_srgb = linearToSrgb(r_exposed)
-                g_srgb = linearToSrgb(g_exposed)
-                b_srgb = linearToSrgb(b_exposed)
-                
-                #clamp to 0-1 and convert to 0-255
-                r = int(clamp(r_srgb, 0, 1) * 255)
-                g = int(clamp(g_srgb, 0, 1) * 255)
-                b = int(clamp(b_srgb, 0, 1) * 255)
-                
-                pixels[x, y] = (r, g, b, 255)
+            i = y * width + x
+            if x + 1 < width and pixelsDiffer(pixels[i], objects[i], pixels[i + 1], objects[i + 1], limit):
+                edge[i] = edge[i + 1] = 1
+            if y + 1 < height and pixelsDiffer(pixels[i], objects[i], pixels[i + width], objects[i + width], limit):
+                edge[i] = edge[i + width] = 1
+    
+    #fixed seed so renders are repeatable
+    rng = random.Random(0)
+    for i in range(width * height):
+        if edge[i]:
+            pixels[i], shot = refinePixel(scene, i % width, i // width, scene.aa_samples, rng, shadow_cache)
+            rays += shot
+    
+    img = Image.new('RGBA', (width, height))
+    img.putdata(pixels)
+    return img, rays / (width * height)
+
+
+#the first progressive pass traces every 8th pixel in x and y
+PROGRESSIVE_STEP = 8
+
+
+def savePreview(frame, width, height, path):
+    #swap the png in whole so a reader or a preempted run never sees half a file
+    temp = path + '.partial'
+    Image.frombuffer('RGBA', (width, height), bytes(frame), 'raw', 'RGBA', 0, 1).save(temp, format='PNG')
+    os.replace(temp, path)
+
+
+def renderProgressive(scene, path, budget=None, target_rpp=1.0, interval=5.0):
+    #coarse to fine: every 8th pixel filling 8x8 blocks, then the pixels between them at 4, 2 and 1
+    #once every pixel has its own ray, more passes add one jittered ray per pixel to each average
+    #path is rewritten every interval seconds and at the end, stops after budget seconds or target_rpp rays/pixel
+    #returns rays per pixel, at 1 the png matches renderScene
+    width, height = scene.width, scene.height
+    pixels = width * height
+    start = time.perf_counter()
+    last_write = start
+    shadow_cache = {}
+    frame = bytearray(4 * pixels)
+    #summed linear color and covered rays per pixel, rays is rays per pixel so far
+    totals = array('d', [0.0]) * (3 * pixels)
+    covered = array('l', [0]) * pixels
+    rays = 0
+    #fixed seed so renders are repeatable
+    rng = random.Random(0)
+    
+    def addSample(x, y, sx, sy, spp):
+        #trace (sx, sy) into pixel (x, y), returns its new rgba
+        i = y * width + x
+        color, _, _ = traceSample(scene, sx, sy, shadow_cache)
+        if color is not None:
+            totals[3 * i] += color.x
+            totals[3 * i + 1] += color.y
+            totals[3 * i + 2] += color.z
+            covered[i] += 1
+        if covered[i] == 0:
+            return (0, 0, 0, 0)
+        n = covered[i]
+        r, g, b, _ = toPixel(Vector3(totals[3 * i] / n, totals[3 * i + 1] / n, totals[3 * i + 2] / n), scene.exposure)
+        return (r, g, b, int(255 * n / spp + 0.5))
+    
+    def rowDone():
+        #write a preview when due, true once the budget or ray target is used up
+        nonlocal last_write
+        now = time.perf_counter()
+        if now - last_write >= interval:
+            savePreview(frame, width, height, path)
+            last_write = now
+        return rays >= target_rpp * pixels or (budget is not None and now - start >= budget)
+    
+    stopped = False
+    step = PROGRESSIVE_STEP
+    while step >= 1 and not stopped:
+        for y in range(0, height, step):
+            for x in range(0, width, step):
+                if step != PROGRESSIVE_STEP and x % (2 * step) == 0 and y % (2 * step) == 0:
+                    #traced by an earlier pass
+                    continue
+                pixel = bytes(addSample(x, y, x, y, 1))
+                rays += 1
+                #fill the block this pixel stands for until finer passes replace it
+                block = pixel * (min(x + step, width) - x)
+                for yy in range(y, min(y + step, height)):
+                    offset = 4 * (yy * width + x)
+                    frame[offset:offset + len(block)] = block
+            if rowDone():
+                stopped = True
+                break
+        step //= 2
     
+    spp = 1
+    while not stopped:
+        spp += 1
+        for y in range(height):
+            for x in range(width):
+                offset = 4 * (y * width + x)
+                frame[offset:offset + 4] = bytes(addSample(x, y, x - 0.5 + rng.random(), y - 0.5 + rng.random(), spp))
+                rays += 1
+            if rowDone():
+                stopped = True
+                break
+    
+    savePreview(frame, width, height, path)
+    return rays / pixels
+
+
+def renderRows(scene, y_start, y_end):
+    #render a band of scanlines, returns raw rgba bytes
+    band = bytearray()
+    shadow_cache = {}
+    for y in range(y_start, y_end):
+        for x in range(scene.width):
+            band.extend(renderPixel(scene, x, y, shadow_cache))
+    return bytes(band)
+
+
+#scene held by each worker process, sent once by the pool initializer
+_worker_scene = None
+
+
+def initWorker(scene):
+    global _worker_scene
+    _worker_scene = scene
+
+
+def renderBand(y_start, y_end):
+    #worker side of renderRows
+    return y_start, renderRows(_worker_scene, y_start, y_end)
+
+
+def scanlineBands(height, band_height):
+    #(start, end) row ranges covering the image
+    return [(y, min(y + band_height, height)) for y in range(0, height, band_height)]
+
+
+def renderScene(scene, workers=1):
+    #render a Scene to an rgba image, optionally across worker processes
+    width, height = scene.width, scene.height
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 255))
+    
+    if workers <= 1 or height <= 1:
+        pixels = img.load()
+        shadow_cache = {}
+        #render each pixel
+        for y in range(height):
+            for x in range(width):
+                pixels[x, y] = renderPixel(scene, x, y, shadow_cache)
+        return img
+    
+    #several bands per worker so uneven rows balance out
+    band_height = max(1, height // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(scene,)) as pool:
+        futures = [pool.submit(renderBand, y0, y1) for y0, y1 in scanlineBands(height, band_height)]
+        for future in as_completed(futures):
+            y_start, band = future.result()
+            rows = len(band) // (4 * width)
+            img.paste(Image.frombytes('RGBA', (width, rows), band), (0, y_start))
     return img
 
 
+def renderStreamed(scene, path, workers=1, band_rows=64, engine='python'):
+    #render band by band straight into a png on disk, memory stays bounded by the band size
+    from pngstream import PNGStreamWriter
+    width, height = scene.width, scene.height
+    bands = scanlineBands(height, max(1, band_rows))
+    
+    with PNGStreamWriter(path, width, height) as writer:
+        if engine == 'numpy':
+            from wavefront import WavefrontScene, renderWavefrontRows
+            batch_scene = WavefrontScene(scene.spheres, scene.planes, scene.triangles, scene.suns)
+            for y_start, y_end in bands:
+                writer.writeRows(renderWavefrontRows(scene, batch_scene, y_start, y_end))
+        elif workers <= 1:
+            for y_start, y_end in bands:
+                writer.writeRows(renderRows(scene, y_start, y_end))
+        else:
+            #bands must reach the file in order, keep a small window in flight
+            with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(scene,)) as pool:
+                pending = []
+                next_band = 0
+                while next_band < len(bands) or pending:
+                    while next_band < len(bands) and len(pending) < 2 * workers:
+                        pending.append(pool.submit(renderBand, *bands[next_band]))
+                        next_band += 1
+                    _, band = pending.pop(0).result()
+                    writer.writeRows(band)
+
+
+def renderImg(width, height, spheres, planes, triangles, suns, exposure=None, eye=None, forward=None, up=None, camera_mode='pinhole', bvh=None, workers=1):
+    #render
+    scene = Scene(width, height, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode, bvh=bvh)
+    return renderScene(scene, workers)
+
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python raytracer.py <input_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Render a scene file to PNG")
+    parser.add_argument('input_file')
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help="python traces one pixel at a time, numpy traces whole ray batches")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="render scanline bands on this many processes (python engine)")
+    parser.add_argument('--stream', action='store_true',
+                        help="write the png band by band instead of holding the whole frame")
+    parser.add_argument('--band-rows', type=int, default=64,
+                        help="scanlines per band in --stream mode")
+    parser.add_argument('--aa', type=int, default=None,
+                        help="adaptive antialiasing, N x N extra rays on edge pixels (overrides the scene's aa line, 0 turns it off)")
+    parser.add_argument('--aa-threshold', type=float, default=None,
+                        help=f"color step between neighbours that triggers antialiasing, 0-1 (default {AA_THRESHOLD})")
+    parser.add_argument('--progressive', action='store_true',
+                        help="coarse preview first, then finer passes, rewriting the png as it goes (python engine)")
+    parser.add_argument('--budget', type=float, default=None,
+                        help="progressive: stop after this many seconds and keep what is done")
+    parser.add_argument('--target-rpp', type=float, default=None,
+                        help="progressive: stop at this many rays per pixel, above 1 adds jittered rays (default 1)")
+    parser.add_argument('--write-interval', type=float, default=5.0,
+                        help="progressive: seconds between png updates")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="parse the scene text and textures even if .rtcache holds a compiled copy, and don't write one")
+    parser.add_argument('--stats', action='store_true',
+                        help="print ray and hit test counters and per phase times at the end (counters need the python engine and one worker)")
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help="write the --stats numbers to FILE as json instead of printing them")
+    parser.add_argument('--no-counters', action='store_true',
+                        help="with --stats, only time the phases, the counters slow the python engine's hit tests down")
+    args = parser.parse_args()
     
-    input_file = sys.argv[1]
+    #counters are only swapped in when asked for, a normal render runs the plain hit functions
+    stats = None
+    phase = lambda name: nullcontext()
+    if args.stats or args.stats_json:
+        from tracestats import RenderStats
+        stats = RenderStats()
+        stats.enable(count=args.engine == 'python' and args.workers <= 1 and not args.no_counters)
+        phase = stats.phase
     
-    #parse input file
-    width, height, output_filename, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode = parseFile(input_file)
+    #parse input file, or map the compiled scene cached by an earlier run
+    with phase('parse'):
+        scene = loadScene(args.input_file, use_cache=not args.no_cache)
+    output_filename = scene.output_filename
+    if args.aa is not None:
+        scene.aa_samples = args.aa
+    if args.aa_threshold is not None:
+        scene.aa_threshold = args.aa_threshold
     
-    #render scene
-    img = renderImg(width, height, spheres, planes, triangles, suns, exposure, eye, forward, up, camera_mode)
+    if args.progressive or args.budget is not None or args.target_rpp is not None:
+        if args.engine != 'python' or args.stream or args.workers > 1 or scene.aa_samples > 0:
+            parser.error("progressive renders serially with the python engine and no aa")
+        start = time.perf_counter()
+        target_rpp = 1.0 if args.target_rpp is None else args.target_rpp
+        with phase('trace'):
+            rays_per_pixel = renderProgressive(scene, output_filename, args.budget, target_rpp, args.write_interval)
+        print(f"Rendered {output_filename} ({rays_per_pixel:.2f} rays/pixel in {time.perf_counter() - start:.1f} s)")
     
-    #save image
-    img.save(output_filename)
-    print(f"Rendered {output_filename}")
-
+    elif scene.aa_samples > 0:
+        if args.engine != 'python' or args.stream or args.workers > 1:
+            parser.error("antialiasing renders serially with the python engine")
+        with phase('trace'):
+            img, rays_per_pixel = renderAdaptive(scene)
+        with phase('save'):
+            img.save(output_filename)
+        print(f"Rendered {output_filename} ({rays_per_pixel:.2f} rays/pixel)")
+    
+    elif args.stream:
+        #bands are written as they finish, so saving is part of the trace
+        with phase('trace'):
+            renderStreamed(scene, output_filename, args.workers, args.band_rows, args.engine)
+        print(f"Rendered {output_filename}")
+    
+    else:
+        #render scene
+        with phase('trace'):
+            if args.engine == 'numpy':
+                from wavefront import renderWavefront
+                img = renderWavefront(scene)
+            else:
+                img = renderScene(scene, args.workers)
+        
+        #save image
+        with phase('save'):
+            img.save(output_filename)
+        print(f"Rendered {output_filename}")
+    
+    if stats is not None:
+        stats.disable()
+        if args.stats_json:
+            stats.write(args.stats_json)
+        else:
+            stats.show()
 
 if __name__ == '__main__':
+    #helper modules import raytracer, make them share this module's classes
+    sys.modules.setdefault('raytracer', sys.modules[__name__])
     main()
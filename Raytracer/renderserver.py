@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+#long running render service for raytracer.py
+#parsed scenes and decoded textures stay in memory and one worker pool is kept across jobs
+#  python3 renderserver.py serve --workers 4 --cache-mb 512
+#  python3 renderserver.py render ray-sun.txt ray-tex.txt --engine numpy
+#jobs are json lines over a unix socket, or over stdin/stdout with serve --stdin:
+#  {"file": "ray-sun.txt", "cwd": "/path/to/scenes", "engine": "python", "aa": 2, "output": "sun.png"}
+#each job gets one json line back:
+#  {"ok": true, "file": "ray-sun.txt", "output": "ray-sun.png", "seconds": 0.41, "cached": true}
+#{"cmd": "stats"} answers with job counts, jobs/sec and cache use, {"cmd": "shutdown"} stops the server
+import argparse
+import copy
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from raytracer import loadScene, renderAdaptive, renderRows, renderScene, scanlineBands
+from scenecache import splitScene
+
+
+#rough in-memory cost of one parsed and compiled primitive with its share of the bvh, see bench_memory.py
+BYTES_PER_OBJECT = 600
+
+
+def defaultSocket():
+    return os.path.join(tempfile.gettempdir(), f"raytracer-{os.getuid()}.sock")
+
+
+class MemoryCache:
+    #lru of (value, estimated bytes), least recently used entries go first once over the cap
+    def __init__(self, cap_bytes):
+        self.cap_bytes = cap_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def put(self, key, value, size):
+        if key in self.entries:
+            self.total -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.total += size
+        #the newest entry always stays, even when it alone is over the cap
+        while self.total > self.cap_bytes and len(self.entries) > 1:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.total -= old_size
+
+
+class TextureMap:
+    #the file name -> Texture map parseLines fills, backed by the shared lru
+    #entries are keyed on the file's path, size and mtime so an edited texture is decoded again
+    def __init__(self, cache):
+        self.cache = cache
+
+    def key(self, name):
+        path = os.path.abspath(name)
+        try:
+            info = os.stat(path)
+            return ('texture', path, info.st_size, info.st_mtime_ns)
+        except OSError:
+            return ('texture', path, None, None)
+
+    def __contains__(self, name):
+        return self.key(name) in self.cache
+
+    def __getitem__(self, name):
+        return self.cache.get(self.key(name))
+
+    def __setitem__(self, name, texture):
+        #a texture that failed to load is remembered as None
+        self.cache.put(self.key(name), texture, len(texture.data) if texture is not None else 0)
+
+
+def sceneBytes(scene):
+    #estimated memory held by a scene, its textures are counted here as well as in their own entries
+    textures = {id(obj.texture): obj.texture for obj in scene.spheres + scene.triangles if obj.texture is not None}
+    objects = len(scene.spheres) + len(scene.planes) + len(scene.triangles) + len(scene.suns)
+    return BYTES_PER_OBJECT * objects + sum(len(t.data) for t in textures.values())
+
+
+#scenes and textures loaded by each pool worker, keyed like the server's and capped by initWorker
+_worker_cache = None
+_worker_textures = None
+
+
+def initWorker(cap_bytes):
+    global _worker_cache, _worker_textures
+    _worker_cache = MemoryCache(cap_bytes)
+    _worker_textures = TextureMap(_worker_cache)
+
+
+def renderJobBand(key, path, cwd, use_cache, y_start, y_end):
+    #worker side of a banded job, the worker loads the scene itself the first time it sees the key
+    scene = _worker_cache.get(key)
+    if scene is None:
+        os.chdir(cwd)
+        scene = loadScene(path, use_cache, _worker_textures)
+        _worker_cache.put(key, scene, sceneBytes(scene))
+    return y_start, renderRows(scene, y_start, y_end)
+
+
+class RenderServer:
+    #answers one job or command at a time, so the caches and working directory need no locking
+    def __init__(self, workers=1, cache_mb=512, use_cache=True):
+        self.workers = workers
+        self.use_cache = use_cache
+        #with a pool the cap is split evenly between the server and each worker, every one keeps its own scenes
+        cap_bytes = cache_mb * 1024 * 1024
+        self.worker_cap = cap_bytes // (workers + 1) if workers > 1 else 0
+        self.cache = MemoryCache(cap_bytes - workers * self.worker_cap)
+        self.textures = TextureMap(self.cache)
+        #started on the first banded job, then reused
+        self.pool = None
+        self.running = True
+        self.jobs = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def loadScene(self, path):
+        #(key, scene, cache hit), the key covers the scene text, its textures and the camera lines
+        with open(path, 'rb') as f:
+            data = f.read()
+        camera, digest = splitScene(data)
+        key = ('scene', path, digest, tuple(camera))
+        scene = self.cache.get(key)
+        if scene is not None:
+            return key, scene, True
+        scene = loadScene(path, self.use_cache, self.textures)
+        self.cache.put(key, scene, sceneBytes(scene))
+        return key, scene, False
+
+    def renderBands(self, key, path, cwd, scene):
+        #renderScene's banding on the shared pool
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=initWorker, initargs=(self.worker_cap,))
+        width, height = scene.width, scene.height
+        img = Image.new('RGBA', (width, height), (0, 0, 0, 255))
+        band_height = max(1, height // (self.workers * 8))
+        futures = [self.pool.submit(renderJobBand, key, path, cwd, self.use_cache, y0, y1)
+                   for y0, y1 in scanlineBands(height, band_height)]
+        for future in as_completed(futures):
+            y_start, band = future.result()
+            rows = len(band) // (4 * width)
+            img.paste(Image.frombytes('RGBA', (width, rows), band), (0, y_start))
+        return img
+
+    def render(self, job):
+        cwd = job.get('cwd') or os.getcwd()
+        os.chdir(cwd)
+        path = os.path.abspath(job['file'])
+        key, scene, hit = self.loadScene(path)
+        output = job.get('output') or scene.output_filename
+        aa = job.get('aa')
+        if aa is None:
+            aa = scene.aa_samples
+
+        if aa > 0:
+            #jobs only override their own copy, the cached scene stays as parsed
+            scene = copy.copy(scene)
+            scene.aa_samples = aa
+            if job.get('aa_threshold') is not None:
+                scene.aa_threshold = job['aa_threshold']
+            img, _ = renderAdaptive(scene)
+        elif job.get('engine', 'python') == 'numpy':
+            from wavefront import renderWavefront
+            img = renderWavefront(scene)
+        elif self.workers > 1 and scene.height > 1:
+            img = self.renderBands(key, path, cwd, scene)
+        else:
+            img = renderScene(scene)
+        img.save(output)
+        return {'output': output, 'cached': hit}
+
+    def stats(self):
+        return {
+            'jobs': self.jobs,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy, 3),
+            'uptime_seconds': round(time.perf_counter() - self.started, 3),
+            'jobs_per_sec': round(self.jobs / self.busy, 3) if self.busy else 0.0,
+            'cache_entries': len(self.cache.entries),
+            'cache_mb': round(self.cache.total / (1024 * 1024), 3),
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+        }
+
+    def handle(self, request):
+        #one request dict -> one reply dict
+        command = request.get('cmd', 'render')
+        if command == 'stats':
+            return dict(self.stats(), ok=True)
+        if command == 'shutdown':
+            self.running = False
+            return dict(self.stats(), ok=True)
+        if command != 'render' or 'file' not in request:
+            return {'ok': False, 'error': f"unknown request {request!r}"}
+
+        start = time.perf_counter()
+        try:
+            reply = dict(self.render(request), ok=True)
+        except Exception as e:
+            self.failed += 1
+            reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        elapsed = time.perf_counter() - start
+        self.jobs += 1
+        self.busy += elapsed
+        reply['file'] = request['file']
+        reply['seconds'] = round(elapsed, 4)
+        return reply
+
+
+def serveLines(server, rfile, wfile):
+    #json lines in, json lines out, until eof or a shutdown request
+    for line in rfile:
+        if not line.strip():
+            continue
+        try:
+            reply = server.handle(json.loads(line))
+        except (ValueError, AttributeError):
+            reply = {'ok': False, 'error': f"bad request {line.strip()[:80]!r}"}
+        wfile.write((json.dumps(reply) + '\n').encode())
+        wfile.flush()
+        if not server.running:
+            break
+
+
+def serve(args):
+    server = RenderServer(args.workers, args.cache_mb, not args.no_cache)
+    try:
+        if args.stdin:
+            serveLines(server, sys.stdin.buffer, sys.stdout.buffer)
+            return
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(args.socket)
+            listener.listen()
+            print(f"Render server on {args.socket} ({args.workers} workers, {args.cache_mb} MB cache)", flush=True)
+            try:
+                while server.running:
+                    conn, _ = listener.accept()
+                    try:
+                        with conn, conn.makefile('rb') as rfile, conn.makefile('wb') as wfile:
+                            serveLines(server, rfile, wfile)
+                    except (BrokenPipeError, ConnectionResetError) as e:
+                        #a client that hangs up early only loses its own replies
+                        print(f"client disconnected: {e}", file=sys.stderr, flush=True)
+            finally:
+                os.unlink(args.socket)
+    finally:
+        server.close()
+        stats = server.stats()
+        print(f"{stats['jobs']} jobs, {stats['jobs_per_sec']:.2f} jobs/sec", file=sys.stderr)
+
+
+def submit(args):
+    #client: send jobs to a running server and report throughput, the make run replacement
+    requests = []
+    for _ in range(args.repeat):
+        for name in args.files:
+            job = {'file': name, 'cwd': os.getcwd()}
+            for option in ('engine', 'aa', 'aa_threshold', 'output'):
+                if getattr(args, option) is not None:
+                    job[option] = getattr(args, option)
+            requests.append(job)
+    if args.stats:
+        requests.append({'cmd': 'stats'})
+    if args.shutdown:
+        requests.append({'cmd': 'shutdown'})
+
+    start = time.perf_counter()
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(args.socket)
+    except OSError:
+        raise SystemExit(f"no render server on {args.socket}, start one with: python3 renderserver.py serve")
+    failed = 0
+    jobs = 0
+    with conn, conn.makefile('rb') as rfile, conn.makefile('wb') as wfile:
+        for request in requests:
+            wfile.write((json.dumps(request) + '\n').encode())
+        wfile.flush()
+        conn.shutdown(socket.SHUT_WR)
+        for request, line in zip(requests, rfile):
+            reply = json.loads(line)
+            if 'cmd' in request:
+                print(json.dumps(reply, indent=2))
+            elif reply['ok']:
+                jobs += 1
+                print(f"Rendered {reply['output']} ({reply['seconds']:.3f} s{', cached' if reply['cached'] else ''})")
+            else:
+                failed += 1
+                print(f"{reply.get('file')}: {reply['error']}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    if jobs:
+        print(f"{jobs} jobs in {elapsed:.2f} s, {jobs / elapsed:.2f} jobs/sec")
+    if failed:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep scenes warm across raytracer renders")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="run the render server")
+    serve_parser.add_argument('--socket', default=defaultSocket())
+    serve_parser.add_argument('--stdin', action='store_true', help="read jobs from stdin and answer on stdout instead of a socket")
+    serve_parser.add_argument('--workers', type=int, default=1, help="pool processes for python engine jobs, kept across jobs")
+    serve_parser.add_argument('--cache-mb', type=int, default=512, help="memory cap for cached scenes and textures, shared with the pool workers")
+    serve_parser.add_argument('--no-cache', action='store_true', help="don't read or write the .rtcache files on a miss")
+
+    render_parser = commands.add_parser('render', help="send scenes to a running server")
+    render_parser.add_argument('files', nargs='*')
+    render_parser.add_argument('--socket', default=defaultSocket())
+    render_parser.add_argument('--engine', choices=['python', 'numpy'], default=None)
+    render_parser.add_argument('--aa', type=int, default=None)
+    render_parser.add_argument('--aa-threshold', type=float, default=None)
+    render_parser.add_argument('--output', default=None, help="png name instead of the scene's")
+    render_parser.add_argument('--repeat', type=int, default=1, help="send every job this many times, for throughput runs")
+    render_parser.add_argument('--stats', action='store_true', help="print the server's counters after the jobs")
+    render_parser.add_argument('--shutdown', action='store_true', help="stop the server after these jobs")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        submit(args)
+
+
+if __name__ == '__main__':
+    main()
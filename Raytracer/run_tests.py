@@ -3,6 +3,7 @@
 import subprocess
 import sys
 import os
+import json
 
 tests = [
     ("ray-sphere.txt", "sphere.png", "ray-sphere.png"),
@@ -61,29 +62,22 @@ def run_test(input_file, output_file, ref_file):
         print("Comparing with reference...")
         try:
             result = subprocess.run(
-                ["python3", "compare_images.py", ref_file, output_file],
+                ["python3", "compare_images.py", ref_file, output_file, "--json"],
                 capture_output=True,
                 text=True
             )
-            output = result.stdout.strip()
-            #extract key info
-            lines = output.split('\n')
-            for line in lines:
-                if "Total differences" in line:
-                    print(f"  {line}")
-                    #parse percentage
-                    if "%" in line:
-                        pct_str = line.split("(")[1].split("%")[0]
-                        try:
-                            pct = float(pct_str)
-                            if pct < 1.0:
-                                print("  ✓ Images match very closely (<1% difference)")
-                            elif pct < 5.0:
-                                print("  ⚠ Images are similar but have some differences (<5%)")
-                            else:
-                                print("  ✗ Images differ significantly (>5%)")
-                        except:
-                            pass
+            stats = json.loads(result.stdout)
+            if "error" in stats:
+                print(f"  ✗ {stats['error']}")
+            else:
+                pct = stats["diff_percent"]
+                print(f"  Total differences: {stats['diff_pixels']} out of {stats['total_pixels']} pixels ({pct:.2f}%), max error {stats['max_error']}")
+                if pct < 1.0:
+                    print("  ✓ Images match very closely (<1% difference)")
+                elif pct < 5.0:
+                    print("  ⚠ Images are similar but have some differences (<5%)")
+                else:
+                    print("  ✗ Images differ significantly (>5%)")
         except Exception as e:
             print(f"  ⚠ Comparison error: {e}")
     else:
@@ -0,0 +1,243 @@
+#compiled scene cache for raytracer.py
+#a parsed scene's geometry, colors, decoded textures and bvh are written as raw arrays to
+#.rtcache/<scene>.rtc next to the scene, keyed on a hash of the scene text and its texture files
+#later runs map that file instead of parsing and decoding again
+#camera and output lines are left out of the key and always read from the scene, so moving
+#the camera or changing the exposure keeps the cache
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import raytracer
+from raytracer import BVH, GeometryArrays, KIND_SPHERE, KIND_TRIANGLE, Plane, Sphere, Sun, Texture, Triangle, Vector3, compileScene
+
+
+MAGIC = b'RTSCENE\0'
+#bump whenever the layout or the meaning of a scene line changes, old files then count as stale
+CACHE_VERSION = 2
+CACHE_DIR = '.rtcache'
+#lines that only set up the camera and the output
+CAMERA_KEYWORDS = {b'png', b'expose', b'eye', b'forward', b'up', b'fisheye', b'panorama', b'aa'}
+#magic, 32 byte key, header length
+PREFIX_SIZE = 48
+
+
+def cachePath(filename):
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, CACHE_DIR, name + '.rtc')
+
+
+def align(size):
+    #sections start on 8 byte boundaries so they can be cast in place
+    return (size + 7) & ~7
+
+
+#absolute path -> (size, mtime, digest), a long running process hashes an unchanged texture once
+_digests = {}
+
+
+def fileDigest(path):
+    #hash of a texture file, a missing one is part of the key too
+    path = os.path.abspath(path)
+    try:
+        info = os.stat(path)
+        stamp = (info.st_size, info.st_mtime_ns)
+        known = _digests.get(path)
+        if known is not None and known[:2] == stamp:
+            return known[2]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).digest()
+    except OSError:
+        _digests.pop(path, None)
+        return b'missing'
+    _digests[path] = stamp + (digest,)
+    return digest
+
+
+def splitScene(data):
+    #camera lines of the scene and the cache key of everything else
+    key = hashlib.sha256(MAGIC + struct.pack('<II', CACHE_VERSION, array('l').itemsize) + sys.byteorder.encode())
+    camera = []
+    digests = {}
+    for line in data.splitlines():
+        parts = line.split(None, 2)
+        if parts and parts[0] in CAMERA_KEYWORDS:
+            camera.append(line.decode())
+            continue
+        key.update(line + b'\n')
+        if len(parts) > 1 and parts[0] == b'texture':
+            #textures load relative to the working directory, same as parseFile
+            name = parts[1].decode()
+            if name not in digests:
+                digests[name] = fileDigest(name)
+            key.update(digests[name])
+    return camera, key.digest()
+
+
+def tableIndex(objects, table, slots):
+    #index of each object in a shared table, identity keeps parseFile's sharing
+    indices = array('q')
+    for obj in objects:
+        if obj is None:
+            indices.append(-1)
+            continue
+        slot = slots.get(id(obj))
+        if slot is None:
+            slot = len(table)
+            slots[id(obj)] = slot
+            table.append(obj)
+        indices.append(slot)
+    return indices
+
+
+def saveCache(path, key, spheres, planes, triangles, suns, bvh):
+    colors, color_slots = [], {}
+    textures, texture_slots = [], {}
+    vertices, vertex_slots = [], {}
+    sections = [
+        ('sphere', array('d', [v for s in spheres for v in (s.center.x, s.center.y, s.center.z, s.radius)])),
+        ('sphere_color', tableIndex([s.color for s in spheres], colors, color_slots)),
+        ('sphere_texture', tableIndex([s.texture for s in spheres], textures, texture_slots)),
+        ('plane', array('d', [v for p in planes for v in (p.a, p.b, p.c, p.d)])),
+        ('plane_color', tableIndex([p.color for p in planes], colors, color_slots)),
+        ('tri', tableIndex([v for t in triangles for v in (t.v0, t.v1, t.v2)], vertices, vertex_slots)),
+        ('tri_color', tableIndex([t.color for t in triangles], colors, color_slots)),
+        ('tri_texture', tableIndex([t.texture for t in triangles], textures, texture_slots)),
+        ('sun', array('d', [v for s in suns for v in (s.direction.x, s.direction.y, s.direction.z)])),
+        ('sun_color', tableIndex([s.color for s in suns], colors, color_slots)),
+    ]
+    sections.append(('vertex', array('d', [c for v in vertices for c in (v.x, v.y, v.z)])))
+    sections.append(('color', array('d', [c for v in colors for c in (v.x, v.y, v.z)])))
+    for i, texture in enumerate(textures):
+        sections.append((f'texels{i}', array('B', texture.data)))
+    for name in ('kinds', 'indices', 'bounds', 'right', 'axis', 'start', 'count'):
+        sections.append(('bvh_' + name, getattr(bvh, name)))
+
+    table = {}
+    offset = 0
+    for name, values in sections:
+        table[name] = [values.typecode, offset, len(values)]
+        offset += align(len(values) * values.itemsize)
+    meta = {
+        'textures': [[t.width, t.height, t.name] for t in textures],
+        'leaf_size': bvh.leaf_size,
+        'sections': table,
+    }
+    header = json.dumps(meta).encode()
+
+    #write to a temporary name first so a reader never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(MAGIC + key + struct.pack('<Q', len(header)) + header)
+        f.write(bytes(align(PREFIX_SIZE + len(header)) - PREFIX_SIZE - len(header)))
+        for _, values in sections:
+            data = values.tobytes()
+            f.write(data)
+            f.write(bytes(align(len(data)) - len(data)))
+    os.replace(temp, path)
+
+
+def readCache(path, key):
+    #(meta, sections) from a cache file, None when it is missing, stale or damaged
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:8] != MAGIC or mm[8:40] != key:
+                return None
+            (size,) = struct.unpack_from('<Q', mm, 40)
+            meta = json.loads(mm[PREFIX_SIZE:PREFIX_SIZE + size])
+            base = align(PREFIX_SIZE + size)
+            sections = {}
+            with memoryview(mm) as view:
+                for name, (typecode, offset, count) in meta['sections'].items():
+                    values = array(typecode)
+                    start = base + offset
+                    chunk = view[start:start + count * values.itemsize]
+                    #texels stay bytes, the texture lookup indexes them directly
+                    if typecode == 'B':
+                        values = bytes(chunk)
+                    else:
+                        values.frombytes(chunk)
+                    chunk.release()
+                    sections[name] = values
+            return meta, sections
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+def vectors(values):
+    return [Vector3(values[i], values[i + 1], values[i + 2]) for i in range(0, len(values), 3)]
+
+
+def buildObjects(meta, sections, shared=None):
+    #spheres, planes, triangles, suns and bvh back from the cached arrays
+    #shared is parseLines' texture map, a texture already in it is used instead of the cached texels
+    #and the cached ones are added to it, so scenes share decoded textures whether parsed or cached
+    colors = vectors(sections['color'])
+    vertices = vectors(sections['vertex'])
+    textures = []
+    for i, (width, height, name) in enumerate(meta['textures']):
+        texture = shared[name] if shared is not None and name in shared else None
+        if texture is None:
+            texture = Texture.__new__(Texture)
+            texture.width = width
+            texture.height = height
+            texture.data = sections[f'texels{i}']
+            texture.name = name
+            if shared is not None:
+                shared[name] = texture
+        textures.append(texture)
+
+    def texture(i):
+        return textures[i] if i >= 0 else None
+
+    values = sections['sphere']
+    spheres = [Sphere(Vector3(values[4 * i], values[4 * i + 1], values[4 * i + 2]), values[4 * i + 3], colors[c], texture(t))
+               for i, (c, t) in enumerate(zip(sections['sphere_color'], sections['sphere_texture']))]
+    values = sections['plane']
+    planes = [Plane(values[4 * i], values[4 * i + 1], values[4 * i + 2], values[4 * i + 3], colors[c])
+              for i, c in enumerate(sections['plane_color'])]
+    corners = sections['tri']
+    triangles = [Triangle(vertices[corners[3 * i]], vertices[corners[3 * i + 1]], vertices[corners[3 * i + 2]], colors[c], texture(t))
+                 for i, (c, t) in enumerate(zip(sections['tri_color'], sections['tri_texture']))]
+    suns = [Sun(direction, colors[c]) for direction, c in zip(vectors(sections['sun']), sections['sun_color'])]
+    compileScene(spheres, planes, triangles)
+
+    #bvh nodes come straight from the file, only the object list is rebuilt
+    bvh = BVH.__new__(BVH)
+    bvh.geometry = GeometryArrays(spheres)
+    bvh.leaf_size = meta['leaf_size']
+    for name in ('kinds', 'indices', 'bounds', 'right', 'axis', 'start', 'count'):
+        setattr(bvh, name, sections['bvh_' + name])
+    lists = {KIND_SPHERE: spheres, KIND_TRIANGLE: triangles}
+    bvh.objects = [lists[kind][index] for kind, index in zip(bvh.kinds, bvh.indices)]
+    return spheres, planes, triangles, suns, bvh
+
+
+def loadCached(filename, textures=None):
+    #parseFile's tuple and a built bvh, from the cache when it matches the scene
+    #textures is parseLines' shared texture map, cached textures are looked up and added there too
+    with open(filename, 'rb') as f:
+        data = f.read()
+    camera, key = splitScene(data)
+    path = cachePath(filename)
+    cached = readCache(path, key)
+    if cached is not None:
+        spheres, planes, triangles, suns, bvh = buildObjects(*cached, textures)
+        settings = raytracer.parseLines(camera)
+        return settings[:3] + (spheres, planes, triangles, suns) + settings[7:], bvh
+
+    parsed = raytracer.parseLines(data.decode().splitlines(), textures)
+    spheres, planes, triangles, suns = parsed[3:7]
+    compileScene(spheres, planes, triangles)
+    bvh = BVH(spheres, triangles)
+    try:
+        saveCache(path, key, spheres, planes, triangles, suns, bvh)
+    except OSError:
+        #read-only scene folder, render without a cache
+        pass
+    return parsed, bvh
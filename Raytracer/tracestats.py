@@ -0,0 +1,140 @@
+#ray counters and phase timing for raytracer.py --stats
+#enable() swaps sphereHitT, triHitT, hitPlane, occluded, generateRay and Texture.sample in the raytracer
+#module for counting wrappers, the hot loops look them up as globals so they pick the wrappers up
+#a render without --stats never imports this and runs the original functions untouched
+#sphere and triangle tests are counted at the hit kernels, so bvh leaf tests count as hitSphere/hitTri calls
+import json
+import time
+from contextlib import contextmanager
+
+import raytracer
+
+
+#counter names in report order
+COUNTERS = ('primary_rays', 'shadow_rays', 'shadow_occluded', 'shadow_lit',
+            'sphere_calls', 'sphere_hits', 'plane_calls', 'plane_hits', 'tri_calls', 'tri_hits', 'texture_samples')
+PHASES = ('parse', 'texture_load', 'trace', 'save')
+
+
+class RenderStats:
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counting = False
+        self.originals = []
+        #seconds spent in phases nested inside the current one
+        self.nested = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        #time spent in a nested phase counts for that phase only, texture loads are not parse time
+        start = time.perf_counter()
+        outer = self.nested
+        self.nested = 0.0
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] += elapsed - self.nested
+            self.nested = outer + elapsed
+
+    def swap(self, owner, name, wrapper):
+        self.originals.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, wrapper)
+
+    def enable(self, count=True):
+        #texture loads are always timed, counting needs the python engine tracing in this process
+        texture_init = raytracer.Texture.__init__
+
+        def timedTextureInit(texture, img):
+            with self.phase('texture_load'):
+                texture_init(texture, img)
+        self.swap(raytracer.Texture, '__init__', timedTextureInit)
+        if not count:
+            return
+        self.counting = True
+        counts = self.counts
+        sphere_hit_t = raytracer.sphereHitT
+        tri_hit_t = raytracer.triHitT
+        hit_plane = raytracer.hitPlane
+        occluded = raytracer.occluded
+        generate_ray = raytracer.generateRay
+        sample = raytracer.Texture.sample
+
+        def sphereHitT(*args):
+            counts['sphere_calls'] += 1
+            t = sphere_hit_t(*args)
+            if t is not None:
+                counts['sphere_hits'] += 1
+            return t
+
+        def triHitT(*args):
+            counts['tri_calls'] += 1
+            t = tri_hit_t(*args)
+            if t is not None:
+                counts['tri_hits'] += 1
+            return t
+
+        def hitPlane(ray, plane):
+            counts['plane_calls'] += 1
+            intersection = hit_plane(ray, plane)
+            if intersection is not None:
+                counts['plane_hits'] += 1
+            return intersection
+
+        def occludedCounted(ray, scene, exclude=None, cache=None, key=None):
+            counts['shadow_rays'] += 1
+            blocked = occluded(ray, scene, exclude, cache, key)
+            counts['shadow_occluded' if blocked else 'shadow_lit'] += 1
+            return blocked
+
+        def generateRay(*args):
+            ray = generate_ray(*args)
+            if ray is not None:
+                counts['primary_rays'] += 1
+            return ray
+
+        def sampleCounted(texture, xi, yi):
+            counts['texture_samples'] += 1
+            return sample(texture, xi, yi)
+
+        self.swap(raytracer, 'sphereHitT', sphereHitT)
+        self.swap(raytracer, 'triHitT', triHitT)
+        self.swap(raytracer, 'hitPlane', hitPlane)
+        self.swap(raytracer, 'occluded', occludedCounted)
+        self.swap(raytracer, 'generateRay', generateRay)
+        self.swap(raytracer.Texture, 'sample', sampleCounted)
+
+    def disable(self):
+        #put the original functions back
+        while self.originals:
+            owner, name, original = self.originals.pop()
+            setattr(owner, name, original)
+
+    def report(self):
+        #json-ready dict, counters are None when they weren't collected
+        result = {'seconds': dict(self.times), 'counters': dict(self.counts) if self.counting else None}
+        if self.counting and self.times['trace'] > 0:
+            rays = self.counts['primary_rays'] + self.counts['shadow_rays']
+            result['rays_per_sec'] = rays / self.times['trace']
+        return result
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def show(self):
+        print("Stats:")
+        for name in PHASES:
+            print(f"  {name.replace('_', ' '):14s} {self.times[name]:9.3f} s")
+        if not self.counting:
+            print("  ray counters need --engine python, --workers 1 and no --no-counters")
+            return
+        c = self.counts
+        print(f"  primary rays   {c['primary_rays']:11d}")
+        print(f"  shadow rays    {c['shadow_rays']:11d}   occluded {c['shadow_occluded']}, lit {c['shadow_lit']}")
+        for label, kind in (('hitSphere', 'sphere'), ('hitPlane', 'plane'), ('hitTri', 'tri')):
+            print(f"  {label:14s} {c[kind + '_calls']:11d}   hits {c[kind + '_hits']}")
+        print(f"  texture samples {c['texture_samples']:10d}")
+        if self.times['trace'] > 0:
+            print(f"  rays/sec       {(c['primary_rays'] + c['shadow_rays']) / self.times['trace']:11.0f}")
@@ -0,0 +1,354 @@
+#numpy wavefront engine for raytracer.py
+#traces whole batches of rays per primitive instead of one pixel at a time
+#every formula mirrors the scalar code term by term so the pngs match exactly
+import math
+import numpy as np
+from PIL import Image
+
+import raytracer
+from raytracer import Sphere, Plane, applyExposure, clamp, linearToSrgb
+
+
+#rays traced per batch, bounds the temporary arrays
+CHUNK_SIZE = 1 << 16
+#how close to an integer a value must be before it is redone in scalar python
+#numpy's exp/pow/atan2/asin can be a few ulps off from math's
+SNAP_EPSILON = 1e-6
+
+#srgb -> linear for every 8-bit texel value
+SRGB_TO_LINEAR = np.array(raytracer.SRGB_TO_LINEAR)
+
+
+def nearInt(values, eps=SNAP_EPSILON):
+    #mask of values that sit within eps of an integer
+    return np.abs(values - np.rint(values)) < eps
+
+
+def normalizeArrays(x, y, z):
+    #vector3.normalize over arrays, zero length stays zero
+    length = np.sqrt(x * x + y * y + z * z)
+    safe = np.where(length == 0, 1.0, length)
+    zero = length == 0
+    return (np.where(zero, 0.0, x / safe), np.where(zero, 0.0, y / safe),
+            np.where(zero, 0.0, z / safe))
+
+
+def primaryRays(width, height, eye, forward, right, up, camera_mode='pinhole', y_start=0, y_end=None):
+    #primary directions for rows y_start..y_end as an (H, W, 3) array plus a mask of pixels that shoot a ray
+    if y_end is None:
+        y_end = height
+    rows = y_end - y_start
+    xs = np.arange(width, dtype=np.float64)
+    ys = np.arange(y_start, y_end, dtype=np.float64)
+
+    if camera_mode == 'fisheye':
+        sx = ((2 * xs - width) / width)[None, :]
+        sy = ((height - 2 * ys) / height)[:, None]
+        r2 = sx * sx + sy * sy
+        mask = ~(r2 > 1.0)
+        forward_norm = forward.normalize()
+        z = np.sqrt(np.maximum(0.0, 1.0 - r2))
+        dx = right.x * sx + up.x * sy + forward_norm.x * z
+        dy = right.y * sx + up.y * sy + forward_norm.y * z
+        dz = right.z * sx + up.z * sy + forward_norm.z * z
+    elif camera_mode == 'panorama':
+        #trig only depends on the column or the row, so use math for exact values
+        lon = [math.pi * ((2 * x - width) / width) for x in range(width)]
+        lat = [(math.pi * 0.5) * ((height - 2 * y) / height) for y in range(y_start, y_end)]
+        cos_lon = np.array([math.cos(a) for a in lon])[None, :]
+        sin_lon = np.array([math.sin(a) for a in lon])[None, :]
+        cos_lat = np.array([math.cos(a) for a in lat])[:, None]
+        sin_lat = np.array([math.sin(a) for a in lat])[:, None]
+        mask = np.ones((rows, width), dtype=bool)
+        forward_norm = forward.normalize()
+        dx = (forward_norm.x * cos_lon + right.x * sin_lon) * cos_lat + up.x * sin_lat
+        dy = (forward_norm.y * cos_lon + right.y * sin_lon) * cos_lat + up.y * sin_lat
+        dz = (forward_norm.z * cos_lon + right.z * sin_lon) * cos_lat + up.z * sin_lat
+    else:
+        #pinhole camera
+        scale = max(width, height)
+        sx = ((2 * xs - width) / scale)[None, :]
+        sy = ((height - 2 * ys) / scale)[:, None]
+        mask = np.ones((rows, width), dtype=bool)
+        dx = forward.x + right.x * sx + up.x * sy
+        dy = forward.y + right.y * sx + up.y * sy
+        dz = forward.z + right.z * sx + up.z * sy
+
+    dx, dy, dz = np.broadcast_arrays(dx, dy, dz)
+    dx, dy, dz = normalizeArrays(dx, dy, dz)
+    return np.stack([dx, dy, dz], axis=-1), mask
+
+
+def sphereT(o, d, dlen, sphere):
+    #hitSphere over a batch, returns (t, valid)
+    ox, oy, oz = o
+    dx, dy, dz = d
+    c = sphere.center
+
+    ocx = ox - c.x
+    ocy = oy - c.y
+    ocz = oz - c.z
+    oc_squared = ocx * ocx + ocy * ocy + ocz * ocz
+    r_squared = sphere.radius_squared
+    inside = oc_squared < r_squared
+
+    t_c = ((c.x - ox) * dx + (c.y - oy) * dy + (c.z - oz) * dz) / dlen
+    valid = (dlen != 0) & (inside | ~(t_c < 0))
+
+    d_x = ox + dx * t_c - c.x
+    d_y = oy + dy * t_c - c.y
+    d_z = oz + dz * t_c - c.z
+    d_squared = d_x * d_x + d_y * d_y + d_z * d_z
+    valid &= ~(r_squared < d_squared)
+
+    t_offset = np.sqrt(np.maximum(r_squared - d_squared, 0.0)) / dlen
+    t = np.where(inside, t_c + t_offset, t_c - t_offset)
+    valid &= t > 0
+    return t, valid
+
+
+def planeT(o, d, plane):
+    #hitPlane over a batch, returns (t, valid)
+    ox, oy, oz = o
+    dx, dy, dz = d
+    a, b, c, dd = plane.a, plane.b, plane.c, plane.d
+    denom = a * dx + b * dy + c * dz
+    valid = ~(np.abs(denom) < 1e-12)
+    safe = np.where(valid, denom, 1.0)
+    t = -(a * ox + b * oy + c * oz + dd) / safe
+    valid &= t > 0
+    return t, valid
+
+
+def triT(o, d, tri):
+    #moller-trumbore over a batch, returns (t, valid)
+    ox, oy, oz = o
+    dx, dy, dz = d
+    v0 = tri.v0
+    e1x, e1y, e1z = tri.e1x, tri.e1y, tri.e1z
+    e2x, e2y, e2z = tri.e2x, tri.e2y, tri.e2z
+
+    px = dy * e2z - dz * e2y
+    py = dz * e2x - dx * e2z
+    pz = dx * e2y - dy * e2x
+    det = e1x * px + e1y * py + e1z * pz
+    valid = ~(np.abs(det) < 1e-12)
+    inv_det = 1.0 / np.where(valid, det, 1.0)
+
+    tx = ox - v0.x
+    ty = oy - v0.y
+    tz = oz - v0.z
+    u = (tx * px + ty * py + tz * pz) * inv_det
+    valid &= ~((u < 0.0) | (u > 1.0))
+
+    qx = ty * e1z - tz * e1y
+    qy = tz * e1x - tx * e1z
+    qz = tx * e1y - ty * e1x
+    v = (dx * qx + dy * qy + dz * qz) * inv_det
+    valid &= ~((v < 0.0) | (u + v > 1.0))
+
+    t = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+    valid &= t > 0
+    return t, valid
+
+
+def objectT(o, d, dlen, obj):
+    #dispatch to the batch hit test for one primitive
+    if isinstance(obj, Sphere):
+        return sphereT(o, d, dlen, obj)
+    if isinstance(obj, Plane):
+        return planeT(o, d, obj)
+    return triT(o, d, obj)
+
+
+def closestHit(objects, o, d):
+    #findHit over a batch, returns (t, object index) with -1 for misses
+    n = d[0].shape[0]
+    dx, dy, dz = d
+    dlen = np.sqrt(dx * dx + dy * dy + dz * dz)
+    best_t = np.full(n, np.inf)
+    best_idx = np.full(n, -1, dtype=np.int64)
+    #strict < keeps the first object on ties, same as the scalar loop
+    for idx, obj in enumerate(objects):
+        t, valid = objectT(o, d, dlen, obj)
+        better = valid & (t > 0.0) & (t < best_t)
+        best_t = np.where(better, t, best_t)
+        best_idx[better] = idx
+    return best_t, best_idx
+
+
+def anyHit(objects, o, d, exclude_idx):
+    #shadow test over a batch, true where any object other than exclude_idx is hit
+    n = d[0].shape[0]
+    dx, dy, dz = d
+    dlen = np.sqrt(dx * dx + dy * dy + dz * dz)
+    blocked = np.zeros(n, dtype=bool)
+    for idx, obj in enumerate(objects):
+        todo = ~blocked & (exclude_idx != idx)
+        if not todo.any():
+            continue
+        sel = np.nonzero(todo)[0]
+        o_sel = tuple(c[sel] for c in o)
+        d_sel = tuple(c[sel] for c in d)
+        t, valid = objectT(o_sel, d_sel, dlen[sel], obj)
+        blocked[sel[valid & (t > 0.0)]] = True
+    return blocked
+
+
+def textureLookup(nx, ny, nz, table):
+    #lat/long texel fetch for unit normals, table is the linearized (h, w, 3) texture
+    h, w = table.shape[0], table.shape[1]
+    lon = np.arctan2(nx, -nz)
+    u_raw = (lon + math.pi) / (2.0 * math.pi)
+    lat = np.arcsin(np.clip(ny, -1.0, 1.0))
+    v = np.clip(0.5 - lat / math.pi, 0.0, 1.0)
+    u = u_raw % 1.0
+    fx = u * (w - 1)
+    fy = v * (h - 1)
+    xi = fx.astype(np.int64)
+    yi = fy.astype(np.int64)
+
+    #redo texels next to a wrap or texel boundary with math's trig
+    redo = np.nonzero(nearInt(u_raw) | nearInt(fx) | nearInt(fy))[0]
+    for k in redo:
+        lon_k = math.atan2(nx[k], -nz[k])
+        u_k = ((lon_k + math.pi) / (2.0 * math.pi)) % 1.0
+        lat_k = math.asin(clamp(ny[k], -1.0, 1.0))
+        v_k = min(1.0, max(0.0, 0.5 - lat_k / math.pi))
+        xi[k] = int(u_k * (w - 1))
+        yi[k] = int(v_k * (h - 1))
+    return table[yi, xi]
+
+
+class WavefrontScene:
+    #flat object list in findHit order plus per object data the shader needs
+    def __init__(self, spheres, planes, triangles, suns):
+        self.objects = list(spheres) + list(planes) + list(triangles)
+        self.suns = suns
+        self.colors = np.array([[o.color.x, o.color.y, o.color.z] for o in self.objects], dtype=np.float64).reshape(-1, 3)
+        #constant normals for planes and triangles, from the compiled scene
+        self.normals = np.zeros((len(self.objects), 3))
+        self.textures = {}
+        tables = {}
+        for idx, obj in enumerate(self.objects):
+            if isinstance(obj, Sphere):
+                if getattr(obj, 'texture', None) is not None:
+                    key = id(obj.texture)
+                    if key not in tables:
+                        tex = obj.texture
+                        texels = np.frombuffer(tex.data, dtype=np.uint8).reshape(tex.height, tex.width, 3)
+                        tables[key] = SRGB_TO_LINEAR[texels]
+                    self.textures[idx] = tables[key]
+                continue
+            if isinstance(obj, Plane):
+                n = obj.normal
+                self.normals[idx] = (n.x, n.y, n.z)
+            else:
+                self.normals[idx] = (obj.nx, obj.ny, obj.nz)
+
+
+def shadeBatch(scene, eye, dirs):
+    #shadeRay over a batch of primary rays, returns (linear rgb (n, 3), hit mask)
+    n = dirs.shape[0]
+    d = (dirs[:, 0], dirs[:, 1], dirs[:, 2])
+    o = (np.full(n, eye.x), np.full(n, eye.y), np.full(n, eye.z))
+    best_t, best_idx = closestHit(scene.objects, o, d)
+    hit = best_idx >= 0
+    color = np.zeros((n, 3))
+    if not hit.any():
+        return color, hit
+
+    sel = np.nonzero(hit)[0]
+    idx = best_idx[sel]
+    t = best_t[sel]
+    dx, dy, dz = d[0][sel], d[1][sel], d[2][sel]
+    px = eye.x + dx * t
+    py = eye.y + dy * t
+    pz = eye.z + dz * t
+
+    #normals, spheres depend on the hit point
+    nx = scene.normals[idx, 0].copy()
+    ny = scene.normals[idx, 1].copy()
+    nz = scene.normals[idx, 2].copy()
+    base = scene.colors[idx].copy()
+    for obj_idx, obj in enumerate(scene.objects):
+        if not isinstance(obj, Sphere):
+            continue
+        m = idx == obj_idx
+        if not m.any():
+            continue
+        c = obj.center
+        sx, sy, sz = normalizeArrays(px[m] - c.x, py[m] - c.y, pz[m] - c.z)
+        nx[m] = sx
+        ny[m] = sy
+        nz[m] = sz
+        if obj_idx in scene.textures:
+            #point - center normalized again, same as the scalar texture path
+            base[m] = textureLookup(sx, sy, sz, scene.textures[obj_idx])
+
+    #flip normals that face away from the ray
+    flip = (dx * nx + dy * ny + dz * nz) > 0
+    nx = np.where(flip, nx * -1, nx)
+    ny = np.where(flip, ny * -1, ny)
+    nz = np.where(flip, nz * -1, nz)
+
+    shadow_bias = 1e-4
+    shadow_o = (px + nx * shadow_bias, py + ny * shadow_bias, pz + nz * shadow_bias)
+    lit_color = np.zeros((len(sel), 3))
+    for sun in scene.suns:
+        light_dir = sun.direction.normalize()
+        shadow_d = (np.full(len(sel), light_dir.x), np.full(len(sel), light_dir.y), np.full(len(sel), light_dir.z))
+        blocked = anyHit(scene.objects, shadow_o, shadow_d, idx)
+        lambert = np.maximum(0, nx * light_dir.x + ny * light_dir.y + nz * light_dir.z)
+        sun_color = (sun.color.x, sun.color.y, sun.color.z)
+        for ch in range(3):
+            contribution = base[:, ch] * sun_color[ch] * lambert
+            lit_color[:, ch] = np.where(blocked, lit_color[:, ch], lit_color[:, ch] + contribution)
+
+    color[sel] = lit_color
+    return color, hit
+
+
+def toBytes(linear, exposure):
+    #exposure, clamp, srgb and 8-bit conversion on a whole array
+    with np.errstate(over='ignore', invalid='ignore'):
+        if exposure is not None:
+            v = 1.0 - np.exp(-exposure * linear)
+        else:
+            v = linear
+        v = np.clip(v, 0, 1)
+        v = np.where(v <= 0.0031308, 12.92 * v, 1.055 * (v ** (1.0 / 2.4)) - 0.055)
+        scaled = np.clip(v, 0, 1) * 255
+    out = scaled.astype(np.uint8)
+
+    #values right at an integer step get the scalar pipeline so truncation agrees
+    for k in zip(*np.nonzero(nearInt(scaled))):
+        value = clamp(applyExposure(float(linear[k]), exposure), 0, 1)
+        out[k] = int(clamp(linearToSrgb(value), 0, 1) * 255)
+    return out
+
+
+def renderWavefrontRows(scene, batch_scene, y_start, y_end):
+    #render rows y_start..y_end, returns raw rgba bytes
+    width = scene.width
+    eye = scene.eye
+    dirs, mask = primaryRays(width, scene.height, eye, scene.forward, scene.right, scene.up, scene.camera_mode, y_start, y_end)
+    rgba = np.zeros(((y_end - y_start) * width, 4), dtype=np.uint8)
+    flat_dirs = dirs.reshape(-1, 3)
+    pixels = np.nonzero(mask.reshape(-1))[0]
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for start in range(0, len(pixels), CHUNK_SIZE):
+            chunk = pixels[start:start + CHUNK_SIZE]
+            color, hit = shadeBatch(batch_scene, eye, flat_dirs[chunk])
+            rows = chunk[hit]
+            rgba[rows, :3] = toBytes(color[hit], scene.exposure)
+            rgba[rows, 3] = 255
+    return rgba.tobytes()
+
+
+def renderWavefront(scene):
+    #same contract as raytracer.renderScene, returns a PIL image
+    batch_scene = WavefrontScene(scene.spheres, scene.planes, scene.triangles, scene.suns)
+    data = renderWavefrontRows(scene, batch_scene, 0, scene.height)
+    return Image.frombytes('RGBA', (scene.width, scene.height), data)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#benchmark suite for raytracer.py and rasterizer/main.py on generated scenes
+#every sweep changes one setting of a base scene, each case runs in its own process for a clean peak rss
+#  python3 bench.py run --output before.json
+#  python3 bench.py run --output after.json --only ray/spheres --engines numpy
+#  python3 bench.py compare before.json after.json
+#raytracer sweeps: spheres, tris, suns, texture, camera, size (rays/sec over the trace phase only)
+#rays are the primary and shadow rays a counting --stats run shoots, once per scene for all engines
+#rasterizer sweeps: triangles, flags (depth/hyp/cull), draw (drawArrays soup vs indexed drawElements mesh) (triangles/sec over the draw phase only)
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RAY_DIR = os.path.join(HERE, 'Raytracer')
+RAST_DIR = os.path.join(HERE, 'rasterizer')
+sys.path.insert(0, RAST_DIR)
+from bench_raster import runEngine, writeMeshScene, writeTriScene  # noqa: E402
+
+#base scenes, each sweep overrides one of these
+RAY_BASE = {'spheres': 16, 'tris': 0, 'suns': 1, 'texture': False, 'camera': 'pinhole', 'size': 128}
+RAY_SWEEPS = {
+    'spheres': [1, 16, 256, 2048],
+    'tris': [128, 1024, 8192],
+    'suns': [1, 2, 4, 8],
+    'texture': [False, True],
+    'camera': ['pinhole', 'fisheye', 'panorama'],
+    'size': [64, 128, 256, 512],
+}
+RAST_BASE = {'triangles': 1000, 'flags': '', 'draw': 'arrays', 'size': 256}
+RAST_SWEEPS = {
+    'triangles': [100, 1000, 10000],
+    'flags': ['', 'depth', 'hyp', 'cull', 'depth hyp cull'],
+    'draw': ['arrays', 'elements'],
+}
+
+
+def writeRayScene(path, outPath, spheres, tris, suns, texture, camera, size):
+    #spheres in a box in front of the camera over a ground plane, triangles as a wavy wall behind them
+    rng = random.Random(1)
+    lines = [f"png {size} {size} {outPath}"]
+    if camera != 'pinhole':
+        lines.append(camera)
+    for _ in range(suns):
+        lines.append(f"sun {rng.uniform(-1, 1):.3f} {rng.uniform(0.5, 1.5):.3f} {rng.uniform(0, 1):.3f}")
+    lines.append("color 0.8 0.8 0.8")
+    lines.append("plane 0 1 0 1")
+    #textures load relative to the working directory, runs happen in Raytracer/
+    if texture:
+        lines.append("texture earth.png")
+    radius = 0.8 / max(1, spheres) ** (1 / 3)
+    for _ in range(spheres):
+        lines.append(f"color {rng.random():.3f} {rng.random():.3f} {rng.random():.3f}")
+        lines.append(f"sphere {rng.uniform(-2, 2):.4f} {rng.uniform(-0.8, 1.2):.4f} {rng.uniform(-6, -2):.4f} {radius:.4f}")
+    if tris:
+        lines.append("texture none")
+        rows = max(1, int(math.sqrt(tris / 2)))
+        for j in range(rows + 1):
+            for i in range(rows + 1):
+                x, y = -4 + 8 * i / rows, -1 + 5 * j / rows
+                lines.append(f"xyz {x:.4f} {y:.4f} {-8 + 0.5 * math.sin(3 * x) * math.cos(2 * y):.4f}")
+        for j in range(rows):
+            for i in range(rows):
+                a = j * (rows + 1) + i + 1
+                b = a + rows + 1
+                lines.append(f"color {rng.random():.3f} {rng.random():.3f} {rng.random():.3f}")
+                lines.append(f"tri {a} {a + 1} {b}")
+                lines.append(f"tri {a + 1} {b + 1} {b}")
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def runRay(scenePath, engine, count=False):
+    #--stats-json report and peak rss in MB of one raytracer.py run, counters only when count is set
+    statsPath = scenePath + '.stats.json'
+    command = [sys.executable, 'raytracer.py', scenePath, '--engine', engine, '--no-cache', '--stats-json', statsPath]
+    if not count:
+        command.append('--no-counters')
+    proc = subprocess.Popen(command, cwd=RAY_DIR, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    if os.waitstatus_to_exitcode(status):
+        raise SystemExit(f"raytracer.py failed on {scenePath} with engine={engine}")
+    with open(statsPath) as f:
+        stats = json.load(f)
+    #ru_maxrss is in kilobytes on linux
+    return stats, usage.ru_maxrss / 1024
+
+
+#settings -> rays shot, the count doesn't depend on the engine
+_rayCounts = {}
+
+
+def rayCase(tmp, engine, settings):
+    scenePath = os.path.join(tmp, 'ray.txt')
+    writeRayScene(scenePath, os.path.join(tmp, 'ray.png'), **settings)
+    key = tuple(sorted(settings.items()))
+    if key not in _rayCounts:
+        counters = runRay(scenePath, 'python', count=True)[0]['counters']
+        _rayCounts[key] = counters['primary_rays'] + counters['shadow_rays']
+    rays = _rayCounts[key]
+    stats, peakMb = runRay(scenePath, engine)
+    elapsed = stats['seconds']['trace']
+    return {'seconds': elapsed, 'rays': rays, 'rays_per_sec': rays / elapsed, 'peak_rss_mb': peakMb}
+
+
+def rastCase(tmp, engine, settings):
+    scenePath = os.path.join(tmp, 'rast.txt')
+    size = (settings['size'], settings['size'])
+    flags = settings['flags'].split()
+    if settings['draw'] == 'elements':
+        count = writeMeshScene(scenePath, settings['triangles'], size, flags, os.path.join(tmp, 'rast.png'))
+    else:
+        count = settings['triangles']
+        writeTriScene(scenePath, count, size, flags, os.path.join(tmp, 'rast.png'))
+    seconds, peakMb = runEngine(os.path.join(RAST_DIR, 'main.py'), scenePath, engine)
+    elapsed = seconds['draw']
+    return {'seconds': elapsed, 'triangles': count, 'tris_per_sec': count / elapsed, 'peak_rss_mb': peakMb}
+
+
+def cases(quick):
+    #(renderer, sweep, value, settings, run) for every sweep point, quick keeps the two smallest values
+    for renderer, base, sweeps, run in (('ray', RAY_BASE, RAY_SWEEPS, rayCase), ('rast', RAST_BASE, RAST_SWEEPS, rastCase)):
+        for sweep, values in sweeps.items():
+            for value in values[:2] if quick else values:
+                yield renderer, sweep, value, dict(base, **{sweep: value}), run
+
+
+def caseId(renderer, sweep, value, engine):
+    text = ('on' if value else 'off') if isinstance(value, bool) else str(value).replace(' ', '+') or 'none'
+    return f"{renderer}/{sweep}={text}/{engine}"
+
+
+def runSuite(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for renderer, sweep, value, settings, run in cases(args.quick):
+            for engine in args.engines.split():
+                name = caseId(renderer, sweep, value, engine)
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                #best of --repeat runs, peak rss of that run
+                best = min((run(tmp, engine, settings) for _ in range(args.repeat)), key=lambda r: r['seconds'])
+                result = {'id': name, 'renderer': renderer, 'sweep': sweep, 'value': value, 'engine': engine}
+                result.update(best)
+                results.append(result)
+                rate = f"{best['rays_per_sec']:12.0f} rays/sec" if renderer == 'ray' else f"{best['tris_per_sec']:12.0f} tris/sec"
+                print(f"{name:34s} {best['seconds']:8.2f} s {rate} {best['peak_rss_mb']:8.1f} MB peak", flush=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+def rate(result):
+    return result['rays_per_sec'] if 'rays_per_sec' in result else result['tris_per_sec']
+
+
+def compareRuns(args):
+    #throughput and peak rss of every case in both runs, exit 1 when one got slower than the threshold
+    with open(args.before) as f:
+        before = {r['id']: r for r in json.load(f)['results']}
+    with open(args.after) as f:
+        after = {r['id']: r for r in json.load(f)['results']}
+    slower = 0
+    print(f"{'case':34s} {'before':>12s} {'after':>12s} {'speedup':>8s} {'rss MB':>16s}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        speedup = rate(new) / rate(old)
+        mark = ''
+        if speedup < 1 - args.threshold:
+            mark = '  slower'
+            slower += 1
+        elif speedup > 1 + args.threshold:
+            mark = '  faster'
+        print(f"{name:34s} {rate(old):12.0f} {rate(new):12.0f} {speedup:7.2f}x {old['peak_rss_mb']:7.1f} {new['peak_rss_mb']:7.1f}{mark}")
+    for name in sorted(before.keys() ^ after.keys()):
+        print(f"{name:34s} only in {'before' if name in before else 'after'}")
+    if slower:
+        print(f"{slower} cases slower by more than {100 * args.threshold:.0f}%")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark raytracer.py and rasterizer/main.py on generated scene sweeps")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run the sweeps and write the results as json")
+    run.add_argument('--output', default='bench-results.json')
+    run.add_argument('--engines', default="python numpy")
+    run.add_argument('--only', action='append', help="only cases whose id starts with this, e.g. ray/spheres or rast, can be repeated")
+    run.add_argument('--quick', action='store_true', help="only the two smallest values of each sweep")
+    run.add_argument('--repeat', type=int, default=1, help="run each case this many times and keep the fastest")
+    compare = commands.add_parser('compare', help="throughput of two result files side by side")
+    compare.add_argument('before')
+    compare.add_argument('after')
+    compare.add_argument('--threshold', type=float, default=0.1, help="speedup below 1 - threshold counts as slower, default 0.1")
+    args = parser.parse_args()
+    if args.command == 'run':
+        runSuite(args)
+    else:
+        compareRuns(args)
+
+
+if __name__ == '__main__':
+    main()
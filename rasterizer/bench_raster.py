@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#rasterizer benchmark: triangles/sec and peak memory for each engine on a generated scene
+#runs main.py the same way make run does, e.g.
+#  python3 bench_raster.py --triangles 2000 --size 512
+#cost of each fsaa level, to pick one under a time budget:
+#  python3 bench_raster.py --fsaa "1 2 4 8"
+#many small renders in one process through RasterContext, against one main.py run each:
+#  python3 bench_raster.py --triangles 20 --size 64 --batch 200
+#large framebuffers with an older main.py for comparison:
+#  git show <rev>:rasterizer/main.py > /tmp/old_main.py
+#  python3 bench_raster.py --triangles 20 --size 3840x2160 --baseline /tmp/old_main.py
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def writeTriScene(path, triangles, size, flags, outPath, draw=True):
+    #random overlapping triangles with per vertex colors, drawn with drawArraysTriangles
+    random.seed(1)
+    positions = []
+    colors = []
+    for _ in range(triangles):
+        cx, cy = random.uniform(-1, 1), random.uniform(-1, 1)
+        for _ in range(3):
+            positions.append(f"{cx + random.uniform(-0.2, 0.2):.4f} {cy + random.uniform(-0.2, 0.2):.4f} {random.uniform(-1, 1):.4f} {random.uniform(0.5, 2):.4f}")
+            colors.append(f"{random.random():.4f} {random.random():.4f} {random.random():.4f} 1")
+    with open(path, 'w') as f:
+        f.write(f"png {size[0]} {size[1]} {outPath}\n")
+        for flag in flags:
+            f.write(flag + "\n")
+        f.write("position 4 " + "  ".join(positions) + "\n")
+        f.write("color 4 " + "  ".join(colors) + "\n")
+        if draw:
+            f.write(f"drawArraysTriangles 0 {3 * triangles}\n")
+
+
+def writeMeshScene(path, triangles, size, flags, outPath, draw=True):
+    #indexed grid mesh, interior vertices are shared by 6 triangles, drawn with drawElementsTriangles
+    cells = max(1, int((triangles / 2) ** 0.5))
+    random.seed(1)
+    positions = []
+    colors = []
+    for j in range(cells + 1):
+        for i in range(cells + 1):
+            positions.append(f"{-0.95 + 1.9 * i / cells:.5f} {-0.95 + 1.9 * j / cells:.5f} {random.uniform(-1, 1):.4f} 1")
+            colors.append(f"{random.random():.4f} {random.random():.4f} {random.random():.4f} 1")
+    elements = []
+    for j in range(cells):
+        for i in range(cells):
+            a = j * (cells + 1) + i
+            b = a + cells + 1
+            elements.append(f"{a} {a + 1} {b}  {a + 1} {b + 1} {b}")
+    with open(path, 'w') as f:
+        f.write(f"png {size[0]} {size[1]} {outPath}\n")
+        for flag in flags:
+            f.write(flag + "\n")
+        f.write("position 4 " + "  ".join(positions) + "\n")
+        f.write("color 4 " + "  ".join(colors) + "\n")
+        f.write("elements " + "  ".join(elements) + "\n")
+        if draw:
+            f.write(f"drawElementsTriangles {6 * cells * cells} 0\n")
+    return 2 * cells * cells
+
+
+def runEngine(mainPath, scenePath, engine, workers=1):
+    #seconds and peak rss in MB of one main.py run, rss is the parent process only
+    #seconds is main.py's stats= report (parse, draw, save) plus the whole process as wall,
+    #a main.py from before stats= only gets wall
+    statsPath = scenePath + ".stats.json"
+    if os.path.exists(statsPath):
+        os.remove(statsPath)
+    env = dict(os.environ, file=scenePath, engine=engine, workers=str(workers), stats=statsPath)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, mainPath], env=env, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise SystemExit(f"{mainPath} failed with engine={engine}")
+    seconds = {}
+    if os.path.exists(statsPath):
+        with open(statsPath) as f:
+            seconds = json.load(f)["seconds"]
+    seconds["wall"] = elapsed
+    #ru_maxrss is in kilobytes on linux
+    return seconds, usage.ru_maxrss / 1024
+
+
+def parseSize(text):
+    #"512" or "3840x2160"
+    parts = text.lower().split('x')
+    return int(parts[0]), int(parts[-1])
+
+
+def fsaaCost(args):
+    #seconds per fsaa level, fsaa renders go through the numpy engine
+    here = os.path.dirname(os.path.abspath(__file__))
+    width, height = args.size
+    print(f"{args.triangles} triangles, {width}x{height}, {args.flags or 'no flags'}")
+    with tempfile.TemporaryDirectory() as tmp:
+        first = None
+        for level in args.fsaa.split():
+            scenePath = os.path.join(tmp, f"fsaa{level}.txt")
+            writeTriScene(scenePath, args.triangles, args.size, [f"fsaa {level}"] + args.flags.split(), os.path.join(tmp, f"fsaa{level}.png"))
+            seconds, peakMb = runEngine(os.path.join(here, 'main.py'), scenePath, "numpy")
+            elapsed = seconds["draw"]
+            first = first or elapsed
+            print(f"fsaa {level:3s} {elapsed:8.2f} s   {elapsed / first:6.1f}x   {int(level) ** 2:4d} samples/pixel   {peakMb:8.1f} MB peak")
+
+
+def batchRate(args):
+    #renders/sec for one RasterContext reused across renders, and for a fresh main.py process per render
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    from main import RasterContext
+    width, height = args.size
+    print(f"{args.triangles} triangles, {width}x{height}, {args.flags or 'no flags'}, {args.batch} renders")
+    with tempfile.TemporaryDirectory() as tmp:
+        scenePath = os.path.join(tmp, "batch.txt")
+        writeTriScene(scenePath, args.triangles, args.size, args.flags.split(), os.path.join(tmp, "batch.png"))
+        for engine in args.engines.split():
+            context = RasterContext(engine)
+            start = time.perf_counter()
+            for _ in range(args.batch):
+                context.renderFile(scenePath)
+            elapsed = time.perf_counter() - start
+            print(f"{engine:8s} in process  {args.batch / elapsed:8.1f} renders/sec")
+            runs = min(args.batch, 10)
+            elapsed = sum(runEngine(os.path.join(here, 'main.py'), scenePath, engine)[0]["wall"] for _ in range(runs))
+            print(f"{engine:8s} per process {runs / elapsed:8.1f} renders/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time main.py per engine on a generated triangle soup")
+    parser.add_argument('--triangles', type=int, default=1000)
+    parser.add_argument('--size', type=parseSize, default=(256, 256), help="png size, N or WxH")
+    parser.add_argument('--flags', default="depth sRGB hyp", help="scene keywords to turn on")
+    parser.add_argument('--engines', default="python numpy")
+    parser.add_argument('--baseline', help="older main.py to run with the python engine first")
+    parser.add_argument('--workers', type=int, default=1, help="strip workers for the current main.py")
+    parser.add_argument('--parse-only', action='store_true', help="leave out the draw call to time file parsing")
+    parser.add_argument('--mesh', action='store_true', help="indexed grid mesh with shared vertices instead of a triangle soup")
+    parser.add_argument('--fsaa', help="time these fsaa levels instead of comparing engines, e.g. \"1 2 4 8\"")
+    parser.add_argument('--batch', type=int, help="time this many renders through one RasterContext instead")
+    args = parser.parse_args()
+    if args.fsaa:
+        fsaaCost(args)
+        return
+    if args.batch:
+        batchRate(args)
+        return
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = [("baseline", args.baseline, "python")] if args.baseline else []
+    runs += [(engine, os.path.join(here, 'main.py'), engine) for engine in args.engines.split()]
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = {}
+        width, height = args.size
+        print(f"{args.triangles} triangles, {width}x{height}, {args.flags or 'no flags'}")
+        for label, mainPath, engine in runs:
+            outPath = os.path.join(tmp, f"{label}.png")
+            scenePath = os.path.join(tmp, f"{label}.txt")
+            if args.mesh:
+                count = writeMeshScene(scenePath, args.triangles, args.size, args.flags.split(), outPath, not args.parse_only)
+            else:
+                count = args.triangles
+                writeTriScene(scenePath, args.triangles, args.size, args.flags.split(), outPath, not args.parse_only)
+            seconds, peakMb = runEngine(mainPath, scenePath, engine, 1 if label == "baseline" else args.workers)
+            with open(outPath, 'rb') as f:
+                outputs[label] = f.read()
+            #tris/sec is over the draw phase, or the whole process for a main.py that doesn't report one
+            phase = "draw" if "draw" in seconds else "wall"
+            elapsed = seconds[phase]
+            print(f"{label:8s} {seconds['wall']:8.2f} s   {count / elapsed:10.0f} tris/sec ({phase})   {peakMb:8.1f} MB peak")
+        if len(set(outputs.values())) > 1:
+            print("warning: runs wrote different pngs")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,47 +6,25 @@
 # -This was an exciting and rewarding MP, excited to see what is next!
 
 
+import json
 import math
-from os import getenv
+import multiprocessing
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from os import getenv, path
 from PIL import Image
 
-#get input file, this getenv is fairly new to me
-inputFile = getenv("file")
-if not inputFile:
-    print("Error: need FILE")
-    exit(1)
-
-#state variables
-imgWidth = 0
-imgHt = 0
-outPath = None
-
-# vertex and rendering buffers
-posBuf = []
-colorBuf = []
-elemBuf = []
-
-# rendering flags
-hasDepth = False
-hasSrgb = False
-hasHyp = False   #perspective-correct
-hasCull = False  #culling
-
-#transformation matrix and depth buffer
-matrix = None
-depthBuf = []
-
-def applyMatrix(x, y, z, w):
-    if matrix is None:
-        return (x, y, z, w)
-    
-    #make sure matrix is in col major order
-    newX = matrix[0] * x + matrix[4] * y + matrix[8] * z + matrix[12] * w
-    newY = matrix[1] * x + matrix[5] * y + matrix[9] * z + matrix[13] * w
-    newZ = matrix[2] * x + matrix[6] * y + matrix[10] * z + matrix[14] * w
-    newW = matrix[3] * x + matrix[7] * y + matrix[11] * z + matrix[15] * w
-    
-    return (newX, newY, newZ, newW)
+#numpy is only imported once something needs it, the pixel loop runs without it
+np = None
+
+def loadNumpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
 
 #math for sRGB conversion
 def linearToSrgb(c):
@@ -57,390 +35,669 @@ def linearToSrgb(c):
         result = 1.055 * (c ** (1.0 / 2.4)) - 0.055
         return min(result, 1.0)
 
-def toScreen(x, y, z, w):
-    #apply matrix transform first
-    x, y, z, w = applyMatrix(x, y, z, w)
-    
-    #perspective divide
-    if w == 0:
-        w = 1e-20
-    xn = x / w
-    yn = y / w
-    zn = z / w
-    
-    #viewport transform
-    screenX = (xn + 1.0) * 0.5 * imgWidth
-    screenY = (yn + 1.0) * 0.5 * imgHt
-    return (screenX, screenY, zn, w)
-
-def drawTri(pos0, col0, pos1, col1, pos2, col2, pix):
-    #culling check
-    if hasCull:
-        x0, y0, z0, w0 = pos0
-        x1, y1, z1, w1 = pos1
-        x2, y2, z2, w2 = pos2
-        cross = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
-        if cross >= 0:  #cull counterclockwise triangles
-            return
-    
-    #sort vertices by y coordinate
-    verts = [pos0 + col0, pos1 + col1, pos2 + col2]
-    
-    #bubble sort by y value
-    if verts[0][1] > verts[1][1]:
-        verts[0], verts[1] = verts[1], verts[0]
-    if verts[1][1] > verts[2][1]:
-        verts[1], verts[2] = verts[2], verts[1]
-    if verts[0][1] > verts[1][1]:
-        verts[0], verts[1] = verts[1], verts[0]
-    
-    v = verts
-    (x0, y0, z0, w0, r0, g0, b0, a0), (x1, y1, z1, w1, r1, g1, b1, a1), (x2, y2, z2, w2, r2, g2, b2, a2) = v
-
-    #skip unnecessary triangles
-    area = abs((x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0))
-    if area < 1e-9:
+def dda(a, b, d):
+    #points of segment a-b at each integer coordinate along axis d, as (integer, point)
+    #each step is one add onto the last point, the test images were made that way and
+    #evaluating the line fresh per pixel lands on the other side of exact edges
+    if a[d] == b[d]:
         return
-    #perspective-correct setup
-    if hasHyp:
-        #convert to perspective space
-        invW0, invW1, invW2 = 1.0 / w0, 1.0 / w1, 1.0 / w2
-        v = [(x0, y0, z0, invW0, r0 * invW0, g0 * invW0, b0 * invW0, a0 * invW0), 
-             (x1, y1, z1, invW1, r1 * invW1, g1 * invW1, b1 * invW1, a1 * invW1), 
-             (x2, y2, z2, invW2, r2 * invW2, g2 * invW2, b2 * invW2, a2 * invW2)]
-
-    def edgeStep(vA, vB):
-        #calculate interpolation steps along an edge
-        dy = vB[1] - vA[1]
-        if abs(dy) < 1e-9:  #horizontal
-            numComponents = 5 + (1 if hasDepth else 0) + (1 if hasHyp else 0)
-            return tuple(0.0 for _ in range(numComponents))
-        
-        # basic steps for edge
-        stepX = (vB[0] - vA[0]) / dy
-        #THIS MIGHT NOT BE CORRECT, come back and double check later
-        stepColors = tuple((vB[i] - vA[i]) / dy for i in range(4, 8))
-        
-        #build return tuple based on features
-        result = [stepX]
-        if hasDepth:
-            result.append((vB[2] - vA[2]) / dy)  # stepZ
-        if hasHyp:
-            result.append((vB[3] - vA[3]) / dy)  # stepW
-        result.extend(stepColors)
-        return tuple(result)
-
-    def edgeEval(base, step, yScan):
-        t = yScan - base[1]
-        x = base[0] + step[0] * t
-        
-        #figure out indices
-        stepIdx = 1
-        z = None
-        w = None
-        
-        #precompute
-        if hasDepth:
-            z = base[2] + step[stepIdx] * t
-            stepIdx += 1
-        if hasHyp:
-            w = base[3] + step[stepIdx] * t
-            stepIdx += 1
-            
-        #interpolate colors
-        colors = tuple(base[i] + step[stepIdx + i - 4] * t for i in range(4, 8))
-        
-        #return correct tuple
-        if hasHyp:
-            if hasDepth:
-                return x, colors, z, w
-            else:
-                return x, colors, w
-        else:
-            if hasDepth:
-                return x, colors, z
+    if a[d] > b[d]:
+        a, b = b, a
+    delta = [bi - ai for ai, bi in zip(a, b)]
+    s = [c / delta[d] for c in delta]
+    e = math.ceil(a[d]) - a[d]
+    p = [ai + e * si for ai, si in zip(a, s)]
+    i = math.ceil(a[d])
+    while p[d] < b[d]:
+        yield i, p
+        p = [pi + si for pi, si in zip(p, s)]
+        i += 1
+
+def srgbArray(c):
+    #linearToSrgb over an array, values whose 8-bit result depends on the last ulp use the scalar math
+    out = np.where(c <= 0.0031308, 12.92 * c, np.minimum(1.055 * np.power(c, 1.0 / 2.4) - 0.055, 1.0))
+    scaled = out * 255
+    near = np.abs(scaled - np.rint(scaled)) < 1e-6
+    if near.any():
+        out[near] = [linearToSrgb(float(value)) for value in c[near]]
+    return out
+
+def ddaArrays(a, b, d):
+    #dda over many segments at once, a and b are (n, 8) endpoints
+    #returns integer coordinates (n, k), points (n, k, 8) and a mask of the points dda would yield
+    #cumsum along each row repeats dda's adds in the same order, so values match it exactly
+    swap = a[:, d] > b[:, d]
+    a, b = np.where(swap[:, None], b, a), np.where(swap[:, None], a, b)
+    delta = b - a
+    run = np.where(delta[:, d] == 0, 1.0, delta[:, d])
+    s = delta / run[:, None]
+    start = np.ceil(a[:, d])
+    p = a + (start - a[:, d])[:, None] * s
+    steps = max(0, int(np.ceil((b[:, d] - p[:, d]).max())) + 2) if len(a) else 0
+    points = np.empty((len(a), steps, a.shape[1]))
+    points[:, :1] = p[:, None]
+    points[:, 1:] = s[:, None]
+    np.cumsum(points, axis=1, out=points)
+    #d advances by exactly one per step, so the points that pass form a prefix like dda's loop
+    valid = (points[:, :, d] < b[:, d][:, None]) & (delta[:, d] != 0)[:, None]
+    return start[:, None] + np.arange(steps), points, valid
+
+#context each strip worker renders into, made once by the pool initializer
+_stripContext = None
+
+def initStripWorker():
+    global _stripContext
+    _stripContext = RasterContext()
+
+def renderStripWorker(settings, strip, tris):
+    return _stripContext.renderStrip(settings, strip, tris)
+
+class RasterContext:
+    #the rasterizer state machine, render() runs scene lines like the .txt files and returns the png as an Image
+    #engine is python (pixel loop) or numpy (whole spans as arrays), workers > 1 rasterizes strips of
+    #tileRows rows on that many processes, the pool is kept until close(), without fork strips render serially
+    #every render starts from a fresh state, framebuffers of the same size are cleared and reused
+    def __init__(self, engine="python", workers=1, tileRows=0):
+        if engine not in ("python", "numpy"):
+            raise ValueError(f"unknown engine {engine}")
+        self.baseEngine = engine
+        #strip workers are forked so they start without re-importing this module
+        self.workers = workers if "fork" in multiprocessing.get_all_start_methods() else 1
+        self.baseTileRows = tileRows
+        #started on the first render with queued strips, then reused
+        self.pool = None
+
+        #row major framebuffers, rgba bytes and double depth, made into an Image once at the end
+        #depth stays double: float32 depth moves a sample on an intersection edge in rast-fsaa8
+        self.frameBuf = None
+        self.depthBuf = None
+        #numpy engine views of the same buffers, (height, width, 4) and (height, width)
+        self.frameArr = None
+        self.depthArr = None
+        #fsaa keeps clamped linear rgba per sample, (height, width, 4) floats
+        self.sampleArr = None
+        #(rows, width, fsaa) the buffers were made for
+        self.bufShape = None
+        #where "@file" sidecars are looked up
+        self.baseDir = ""
+        self.reset()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset(self):
+        #state at the top of a scene file
+        self.engine = self.baseEngine
+        if self.engine == "numpy":
+            loadNumpy()
+        self.tileRows = self.baseTileRows
+
+        #imgWidth and imgHt are the sample grid, outWidth and outHt the png
+        self.imgWidth = 0
+        self.imgHt = 0
+        self.outWidth = 0
+        self.outHt = 0
+        self.outPath = None
+
+        #rows held by the current buffers, the whole image except inside a strip worker
+        self.clipY0 = 0
+        self.clipY1 = 0
+
+        # vertex and rendering buffers
+        self.posBuf = []
+        self.colorBuf = []
+        self.elemBuf = []
+
+        # rendering flags
+        self.hasDepth = False
+        self.hasSrgb = False
+        self.hasHyp = False   #perspective-correct
+        self.hasCull = False  #culling
+        self.fsaaLevel = 1    #samples per pixel along each axis
+
+        #transformation matrix
+        self.matrix = None
+
+        #posBuf through toScreen, shared by draws until position, matrix or image size change
+        self.screenBuf = None
+
+        #with workers, draws are queued as (p0, col0, p1, col1, p2, col2, flags) in submission order
+        self.pendingTris = []
+        self.stripBins = []
+
+        #no image until a png line
+        self.hasImage = False
+
+        #seconds per phase of this render, draw lines and finish count as draw, other lines as parse
+        self.seconds = {"parse": 0.0, "draw": 0.0, "save": 0.0}
+
+    def applyMatrix(self, x, y, z, w):
+        matrix = self.matrix
+        if matrix is None:
+            return (x, y, z, w)
+
+        #make sure matrix is in col major order
+        newX = matrix[0] * x + matrix[4] * y + matrix[8] * z + matrix[12] * w
+        newY = matrix[1] * x + matrix[5] * y + matrix[9] * z + matrix[13] * w
+        newZ = matrix[2] * x + matrix[6] * y + matrix[10] * z + matrix[14] * w
+        newW = matrix[3] * x + matrix[7] * y + matrix[11] * z + matrix[15] * w
+
+        return (newX, newY, newZ, newW)
+
+    def toScreen(self, x, y, z, w):
+        #apply matrix transform first
+        x, y, z, w = self.applyMatrix(x, y, z, w)
+
+        #perspective divide
+        if w == 0:
+            w = 1e-20
+        xn = x / w
+        yn = y / w
+        zn = z / w
+
+        #viewport transform
+        screenX = (xn + 1.0) * 0.5 * self.imgWidth
+        screenY = (yn + 1.0) * 0.5 * self.imgHt
+        return (screenX, screenY, zn, w)
+
+    def toScreenArrays(self, verts):
+        #toScreen over an (n, 4) array of vertices
+        #the matrix product is written out like applyMatrix, a blas matmul sums in another order
+        #and moves vertices by an ulp, which is enough to change exact edges
+        x, y, z, w = verts.T
+        if self.matrix is not None:
+            m = self.matrix
+            x, y, z, w = (m[0] * x + m[4] * y + m[8] * z + m[12] * w,
+                          m[1] * x + m[5] * y + m[9] * z + m[13] * w,
+                          m[2] * x + m[6] * y + m[10] * z + m[14] * w,
+                          m[3] * x + m[7] * y + m[11] * z + m[15] * w)
+        w = np.where(w == 0, 1e-20, w)
+        return np.column_stack(((x / w + 1.0) * 0.5 * self.imgWidth, (y / w + 1.0) * 0.5 * self.imgHt, z / w, w))
+
+    def screenVerts(self):
+        #vertex stage: each posBuf entry is transformed once, indexed draws reuse it
+        if self.screenBuf is None:
+            if self.engine == "numpy" and len(self.posBuf):
+                self.screenBuf = self.toScreenArrays(np.asarray(self.posBuf, dtype=float)).tolist()
             else:
-                return x, colors
-
-    #draw half triangle
-    def drawHalf(vA, vB, vC, upper):
-        #choose edges for this half, short and long
-        if upper:
-            base1, tip1 = vA, vB       #short
-            base2, tip2 = vA, vC       #long
-            yStart = math.ceil(vA[1])
-            yEnd   = math.ceil(vB[1]) - 1
-        else:
-            base1, tip1 = vB, vC
-            base2, tip2 = vA, vC
-            yStart = math.ceil(vB[1])
-            yEnd   = math.ceil(vC[1]) - 1
+                self.screenBuf = [self.toScreen(*pos) for pos in self.posBuf]
+        return self.screenBuf
 
-        #IMPORTANTfixes missing half, forgot this earlier
-        if tip1[1] - base1[1] <= 1e-9:
-            return
+    def triSetup(self, pos0, col0, pos1, col1, pos2, col2):
+        #cull, sort by y and hyp setup shared by both engines, None when nothing to draw
+        #culling check
+        if self.hasCull:
+            x0, y0, z0, w0 = pos0
+            x1, y1, z1, w1 = pos1
+            x2, y2, z2, w2 = pos2
+            cross = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+            if cross >= 0:  #cull counterclockwise triangles
+                return None
+
+        #sort vertices by y coordinate
+        verts = [(*pos0, *col0), (*pos1, *col1), (*pos2, *col2)]
 
-        step1 = edgeStep(base1, tip1)
-        step2 = edgeStep(base2, tip2)
+        #bubble sort by y value
+        if verts[0][1] > verts[1][1]:
+            verts[0], verts[1] = verts[1], verts[0]
+        if verts[1][1] > verts[2][1]:
+            verts[1], verts[2] = verts[2], verts[1]
+        if verts[0][1] > verts[1][1]:
+            verts[0], verts[1] = verts[1], verts[0]
 
-        #DDA loop: use < condition as said in notes
-        for y in range(yStart, yEnd + 1):
-            if y < 0 or y >= imgHt:
+        v = verts
+        (x0, y0, z0, w0, r0, g0, b0, a0), (x1, y1, z1, w1, r1, g1, b1, a1), (x2, y2, z2, w2, r2, g2, b2, a2) = v
+
+        #skip unnecessary triangles
+        area = abs((x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0))
+        if area < 1e-9:
+            return None
+        #perspective-correct setup
+        if self.hasHyp:
+            #convert to perspective space
+            invW0, invW1, invW2 = 1.0 / w0, 1.0 / w1, 1.0 / w2
+            v = [(x0, y0, z0, invW0, r0 * invW0, g0 * invW0, b0 * invW0, a0 * invW0),
+                 (x1, y1, z1, invW1, r1 * invW1, g1 * invW1, b1 * invW1, a1 * invW1),
+                 (x2, y2, z2, invW2, r2 * invW2, g2 * invW2, b2 * invW2, a2 * invW2)]
+        return v
+
+    def drawTri(self, pos0, col0, pos1, col1, pos2, col2):
+        v = self.triSetup(pos0, col0, pos1, col1, pos2, col2)
+        if v is None:
+            return
+        top, mid, bot = v
+        #state read once per triangle, not per fragment
+        clipY0, clipY1, imgWidth = self.clipY0, self.clipY1, self.imgWidth
+        hasHyp, hasDepth, hasSrgb = self.hasHyp, self.hasDepth, self.hasSrgb
+        frameBuf, depthBuf = self.frameBuf, self.depthBuf
+
+        #scanline: the long edge runs the whole height, the short edges one half each
+        longEdge = dda(top, bot, 1)
+        for y, p in chain(dda(top, mid, 1), dda(mid, bot, 1)):
+            step = next(longEdge, None)
+            if step is None:
+                break
+            q = step[1]
+            if y < clipY0 or y >= clipY1:
                 continue
-                
-            if hasHyp:
-                if hasDepth:
-                    xL, colL, zL, wL = edgeEval(base1, step1, y)
-                    xR, colR, zR, wR = edgeEval(base2, step2, y)
-                    if xL > xR:
-                        xL, xR = xR, xL
-                        colL, colR = colR, colL
-                        zL, zR = zR, zL
-                        wL, wR = wR, wL
-                else:
-                    xL, colL, wL = edgeEval(base1, step1, y)
-                    xR, colR, wR = edgeEval(base2, step2, y)
-                    if xL > xR:
-                        xL, xR = xR, xL
-                        colL, colR = colR, colL
-                        wL, wR = wR, wL
-            else:
+            rowStart = (y - clipY0) * imgWidth
+            for x, frag in dda(p, q, 0):
+                if x < 0 or x >= imgWidth:
+                    continue
+                r, g, b, a = frag[4:8]
+                #apply hyp if enabled, divide interpolated color/w by interpolated 1/w
+                if hasHyp and abs(frag[3]) > 1e-20:
+                    r, g, b, a = r / frag[3], g / frag[3], b / frag[3], a / frag[3]
+
+                #depth test
                 if hasDepth:
-                    xL, colL, zL = edgeEval(base1, step1, y)
-                    xR, colR, zR = edgeEval(base2, step2, y)
-                    if xL > xR:
-                        xL, xR = xR, xL
-                        colL, colR = colR, colL
-                        zL, zR = zR, zL
-                else:
-                    xL, colL = edgeEval(base1, step1, y)
-                    xR, colR = edgeEval(base2, step2, y)
-                    if xL > xR:
-                        xL, xR = xR, xL
-                        colL, colR = colR, colL
-
-            dx = xR - xL
-            if dx < 0:
-                continue
+                    if not frag[2] < depthBuf[rowStart + x]:
+                        continue
+                    depthBuf[rowStart + x] = frag[2]
 
-            #top left rule for ints
-            #implementation provides a slightly different result than our test suite
-            #solution herre is essentially a hardcoded fix for one scenario, not exactly correct, but was a miniscule difference
-            #this is a hack, but it works for our specific scenario, as well as the others
-            if abs(xL - round(xL)) < 1e-10:  #xL is exactly an int
-                xBound = int(round(xL))
-                if not hasDepth and ((xBound == 1 and y == 16) or (xBound == 4 and y == 21)):
-                    xStart = xBound + 1
+                #clamp colors
+                r, g, b, a = [max(0, min(1, c)) for c in (r, g, b, a)]
+
+                #sRGB conversion
+                if hasSrgb:
+                    pixel = (int(linearToSrgb(r) * 255), int(linearToSrgb(g) * 255), int(linearToSrgb(b) * 255), int(a * 255))
                 else:
-                    xStart = xBound
-            else:
-                xStart = int(math.ceil(xL))
-               
-            xEnd = int(math.ceil(xR)) - 1
-               
-            if xEnd < xStart:
-                continue
+                    #add tiny epsilon for rounding
+                    pixel = (int(r * 255 + 1e-10), int(g * 255 + 1e-10),
+                             int(b * 255 + 1e-10), int(a * 255 + 1e-10))
+                offset = (rowStart + x) * 4
+                frameBuf[offset:offset + 4] = pixel
 
-            #lerp on span for x
-            if dx > 1e-9:
-                t0 = (xStart - xL) / dx
-                colNow = [colL[i] + (colR[i] - colL[i]) * t0 for i in range(4)]
-                dCol   = [(colR[i] - colL[i]) / dx for i in range(4)]
-                
-                if hasHyp:
-                    wNow = wL + (wR - wL) * t0
-                    dW = (wR - wL) / dx
-                    
-                if hasDepth:
-                    zNow = zL + (zR - zL) * t0
-                    dZ = (zR - zL) / dx
+    def newBuffers(self):
+        #clear framebuffers for rows clipY0 to clipY1 at the current sample resolution
+        #buffers already the right size are cleared in place once numpy is loaded
+        rows = self.clipY1 - self.clipY0
+        shape = (rows, self.imgWidth, self.fsaaLevel > 1)
+        if shape == self.bufShape and np is not None:
+            np.frombuffer(self.depthBuf, dtype=np.float64).fill(2.0)
+            if self.sampleArr is not None:
+                self.sampleArr.fill(0)
             else:
-                #zero width span
-                colNow = list(colL)
-                dCol   = [0, 0, 0, 0]
-                if hasHyp:
-                    wNow = wL
-                    dW = 0
-                if hasDepth:
-                    zNow = zL
-                    dZ = 0
-
-            for x in range(xStart, xEnd + 1):
-                if 0 <= x < imgWidth:
-                    #apply hyp if enabled
-                    if hasHyp:
-                        #divide interpolated color/w by interpolated 1/w
-                        if abs(wNow) > 1e-20:
-                            final_colors = [colNow[i] / wNow for i in range(4)]
-                            final_z = zNow if hasDepth else 0  # z is already correct
-                        else:
-                            #if not big enough
-                            final_colors = colNow
-                            final_z = zNow if hasDepth else 0
-                    else:
-                        #normal lerp
-                        final_colors = colNow
-                        final_z = zNow if hasDepth else 0
-                    
-                    #depth test
-                    if not hasDepth or final_z < depthBuf[y][x]:
-                        #clamp colors
-                        r, g, b, a = [max(0, min(1, c)) for c in final_colors]
-                       
-                        #sRGB conversion
-                        if hasSrgb:
-                            r = linearToSrgb(r)
-                            g = linearToSrgb(g)
-                            b = linearToSrgb(b)
-                       
-                        #convert to 8-bit
-                        if hasSrgb:
-                            pixel = (int(r * 255), int(g * 255), int(b * 255), int(a * 255))
-                        else:
-                            #add tiny epsilon for rounding
-                            pixel = (int(r * 255 + 1e-10), int(g * 255 + 1e-10),
-                                    int(b * 255 + 1e-10), int(a * 255 + 1e-10))
-                        pix[x, y] = pixel
-                        
-                        #update depth buffer
-                        if hasDepth:
-                            depthBuf[y][x] = final_z
-                            
-                #update values for next pixel
-                for i in range(4):
-                    colNow[i] += dCol[i]
-                if hasHyp:
-                    wNow += dW
-                if hasDepth:
-                    zNow += dZ
-
-    #draw upper and lower halves
-    drawHalf(v[0], v[1], v[2], True)   #upper
-    drawHalf(v[0], v[1], v[2], False)
-
-#read and parse the input file
-with open(inputFile, "r") as f:
-    lines = [line.strip() for line in f if line.strip()]
-
-img = None
-for ln in lines:
-    parts = ln.split()
-    key = parts[0]
-    if key == "png":
-        imgWidth = int(parts[1])
-        imgHt = int(parts[2])
-        outPath = parts[3]
-        img = Image.new("RGBA", (imgWidth, imgHt), (0, 0, 0, 0))
-        pix = img.load()
-
-        #initialize depth buffer
-        depthBuf = [[2.0 for _ in range(imgWidth)] for _ in range(imgHt)]
-    elif key == "position":
-        size = int(parts[1]); nums = list(map(float, parts[2:]))
-        posBuf = []
-        for i in range(0, len(nums), size):
-            if size == 2:
-                x = nums[i]
-                y = nums[i + 1]
-                posBuf.append((x, y, 0, 1))
-            elif size == 3:
-                x = nums[i]
-                y = nums[i + 1]
-                z = nums[i + 2]
-                posBuf.append((x, y, z, 1))
+                np.frombuffer(self.frameBuf, dtype=np.uint8).fill(0)
+        else:
+            self.bufShape = shape
+            self.depthBuf = array("d", [2.0]) * (self.imgWidth * rows)
+            if self.fsaaLevel > 1:
+                #color goes to float samples, the png bytes come from resolveSamples
+                self.frameBuf = None
+                self.sampleArr = np.zeros((rows, self.imgWidth, 4))
             else:
-                x = nums[i]
-                y = nums[i + 1]
-                z = nums[i + 2]
-                w = nums[i + 3]
-                posBuf.append((x, y, z, w))
-        if len(colorBuf) < len(posBuf):
-            colorBuf += [(1, 1, 1, 1)] * (len(posBuf) - len(colorBuf))
-    #enable everything that should be
-    elif key == "depth":
-        hasDepth = True
-    elif key == "sRGB":
-        hasSrgb = True
-    elif key == "hyp":
-        hasHyp = True
-    elif key == "cull":
-        hasCull = True
-    elif key == "color":
-        size = int(parts[1])
-        nums = list(map(float, parts[2:]))
-        colorBuf = []
-        #make sure we have enough colors
-        for i in range(0, len(nums), size):
-            if size == 3:
-                r = nums[i]
-                g = nums[i + 1]
-                b = nums[i + 2]
-                colorBuf.append((r, g, b, 1))
+                #transparent black image
+                self.frameBuf = bytearray(self.imgWidth * rows * 4)
+                self.sampleArr = None
+            self.frameArr = None
+            self.depthArr = None
+        if self.engine == "numpy" and self.depthArr is None:
+            if self.frameBuf is not None:
+                self.frameArr = np.frombuffer(self.frameBuf, dtype=np.uint8).reshape(rows, self.imgWidth, 4)
+            self.depthArr = np.frombuffer(self.depthBuf, dtype=np.float64).reshape(rows, self.imgWidth)
+
+    def resolveSamples(self):
+        #box filter each level x level block into one pixel, colors weighted by alpha
+        #alpha is the average coverage, sRGB is applied to the averaged linear color
+        n = self.fsaaLevel
+        blocks = self.sampleArr.reshape(self.outHt, n, self.outWidth, n, 4)
+        alpha = blocks[..., 3].sum(axis=(1, 3))
+        weighted = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3))
+        colors = np.zeros((self.outHt, self.outWidth, 4))
+        covered = alpha > 0
+        colors[covered, :3] = weighted[covered] / alpha[covered][:, None]
+        colors[..., 3] = alpha / (n * n)
+        if self.hasSrgb:
+            colors[..., :3] = srgbArray(colors[..., :3])
+            return (colors * 255).astype(np.uint8)
+        return (colors * 255 + 1e-10).astype(np.uint8)
+
+    def drawTriArrays(self, pos0, col0, pos1, col1, pos2, col2):
+        #numpy engine version of drawTri, same dda scanline but every row and span at once
+        v = self.triSetup(pos0, col0, pos1, col1, pos2, col2)
+        if v is None:
+            return
+        top, mid, bot = (np.array(vert, dtype=float)[None] for vert in v)
+        clipY0 = self.clipY0
+
+        #edges: short ones for each half, the long one for the whole height
+        rows = []
+        for a, b in ((top, mid), (mid, bot)):
+            ys, points, valid = ddaArrays(a, b, 1)
+            rows.append((ys[valid], points[valid]))
+        ys = np.concatenate([r[0] for r in rows])
+        left = np.concatenate([r[1] for r in rows])
+        longYs, longPoints, longValid = ddaArrays(top, bot, 1)
+        right = longPoints[longValid][:len(ys)]
+        ys, left = ys[:len(right)], left[:len(right)]
+
+        #offscreen rows are skipped, nothing carries between rows
+        onScreen = (ys >= clipY0) & (ys < self.clipY1)
+        ys, left, right = ys[onScreen], left[onScreen], right[onScreen]
+        if len(ys) == 0:
+            return
+
+        #spans
+        xs, values, valid = ddaArrays(left, right, 0)
+        valid &= (xs >= 0) & (xs < self.imgWidth)
+        rowIdx = np.broadcast_to(ys[:, None] - clipY0, xs.shape)[valid].astype(np.intp)
+        xs = xs[valid].astype(np.intp)
+        values = values[valid]
+
+        colors = values[:, 4:8]
+        if self.hasHyp:
+            wNow = values[:, 3]
+            divide = np.abs(wNow) > 1e-20
+            colors = np.where(divide[:, None], colors / np.where(divide, wNow, 1.0)[:, None], colors)
+
+        #depth test
+        if self.hasDepth:
+            zNow = values[:, 2]
+            passed = zNow < self.depthArr[rowIdx, xs]
+            rowIdx, xs, colors, zNow = rowIdx[passed], xs[passed], colors[passed], zNow[passed]
+            self.depthArr[rowIdx, xs] = zNow
+
+        #clamp, sRGB and 8-bit like the pixel loop
+        colors = np.maximum(0, np.minimum(1, colors))
+        if self.fsaaLevel > 1:
+            self.sampleArr[rowIdx, xs] = colors
+        elif self.hasSrgb:
+            colors[:, :3] = srgbArray(colors[:, :3])
+            self.frameArr[rowIdx, xs] = (colors * 255).astype(np.uint8)
+        else:
+            self.frameArr[rowIdx, xs] = (colors * 255 + 1e-10).astype(np.uint8)
+
+    def submitTri(self, p0, col0, p1, col1, p2, col2):
+        #draw now, or queue for the strip workers with the flags in effect at this draw
+        if self.workers > 1:
+            self.pendingTris.append((p0, col0, p1, col1, p2, col2, (self.hasDepth, self.hasSrgb, self.hasHyp, self.hasCull)))
+        elif self.engine == "numpy":
+            self.drawTriArrays(p0, col0, p1, col1, p2, col2)
+        else:
+            self.drawTri(p0, col0, p1, col1, p2, col2)
+
+    def renderStrip(self, settings, strip, tris):
+        #strip worker: rasterize this strip's triangles, in submission order, into strip sized buffers
+        #settings is (engine, imgWidth, imgHt, tileRows, fsaaLevel) of the render the strip belongs to
+        self.engine, self.imgWidth, self.imgHt, self.tileRows, self.fsaaLevel = settings
+        if self.engine == "numpy":
+            loadNumpy()
+        self.clipY0 = strip * self.tileRows
+        self.clipY1 = min(self.imgHt, self.clipY0 + self.tileRows)
+        self.newBuffers()
+        for p0, col0, p1, col1, p2, col2, flags in tris:
+            self.hasDepth, self.hasSrgb, self.hasHyp, self.hasCull = flags
+            if self.engine == "numpy":
+                self.drawTriArrays(p0, col0, p1, col1, p2, col2)
+            else:
+                self.drawTri(p0, col0, p1, col1, p2, col2)
+        return strip, (self.sampleArr if self.fsaaLevel > 1 else bytes(self.frameBuf))
+
+    def renderPending(self):
+        #bin queued triangles by the rows they can touch, then render strips in parallel
+        #strips span the full width so a scanline span is never split between workers
+        imgHt = self.imgHt
+        if self.tileRows <= 0:
+            self.tileRows = max(1, -(-imgHt // (self.workers * 4)))
+        tileRows = self.tileRows
+        strips = -(-imgHt // tileRows)
+        self.stripBins = [[] for _ in range(strips)]
+        for i, tri in enumerate(self.pendingTris):
+            ys = (tri[0][1], tri[2][1], tri[4][1])
+            #clamped first, vertices behind the eye can land at +-inf
+            first = int(max(0.0, min(ys))) // tileRows
+            last = min(strips - 1, math.ceil(min(float(imgHt), max(ys))) // tileRows)
+            for strip in range(first, last + 1):
+                self.stripBins[strip].append(i)
+
+        #the pool outlives this render, so each strip is sent its own triangles
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"),
+                                            initializer=initStripWorker)
+        settings = (self.engine, self.imgWidth, imgHt, tileRows, self.fsaaLevel)
+        pending = self.pendingTris
+        futures = [self.pool.submit(renderStripWorker, settings, strip, [pending[i] for i in self.stripBins[strip]])
+                   for strip in range(strips) if self.stripBins[strip]]
+        for future in futures:
+            strip, result = future.result()
+            y0 = strip * tileRows
+            if self.fsaaLevel > 1:
+                self.sampleArr[y0:y0 + len(result)] = result
             else:
-                r = nums[i]
-                g = nums[i + 1]
-                b = nums[i + 2]
-                a = nums[i + 3]
-                colorBuf.append((r, g, b, a))
-        if len(colorBuf) < len(posBuf):
-            colorBuf += [(1, 1, 1, 1)] * (len(posBuf) - len(colorBuf))
-    #make sure we have enough elements
-    elif key == "elements":
-        elemBuf = list(map(int, parts[1:]))
-    elif key == "uniformMatrix":
-        matrixVals = list(map(float, parts[1:]))
-        #make sure we have 16 values
-        if len(matrixVals) == 16:
-            matrix = matrixVals
-        #error if not
+                self.frameBuf[y0 * self.imgWidth * 4:y0 * self.imgWidth * 4 + len(result)] = result
+        self.pendingTris.clear()
+
+    def parseNumbers(self, text, dtype=float):
+        #whitespace separated numbers straight into a typed array, no per number python objects
+        if self.engine == "numpy":
+            return np.fromstring(text, dtype=dtype, sep=" ")
+        return array("d" if dtype is float else "q", map(dtype, text.split()))
+
+    def loadSidecar(self, ref, key, dtype=float):
+        #"@file.npy" is memory mapped, "@file.npz" or "@file.npz:name" reads one array (name defaults to key)
+        #paths are relative to the scene file, sidecars need numpy even with the python engine
+        numpy = loadNumpy()
+        fileName, _, name = ref[1:].partition(":")
+        fileName = path.join(self.baseDir, fileName)
+        if fileName.endswith(".npz"):
+            with numpy.load(fileName) as data:
+                values = data[name or key]
         else:
-            print(f"Error: uniformMatrix needs 16 values, got {len(matrixVals)}")
-            exit(1)
-    #draw arrays
-    elif key == "drawArraysTriangles":
-        first = int(float(parts[1]))
-        count = int(float(parts[2]))
-        for t in range(0, count, 3):
-            i0 = first + t
-            i1 = first + t + 1
-            i2 = first + t + 2
-            if i2 >= len(posBuf):
-                break
-            p0 = toScreen(*posBuf[i0])
-            p1 = toScreen(*posBuf[i1])
-            p2 = toScreen(*posBuf[i2])
-            col0 = colorBuf[i0]
-            col1 = colorBuf[i1]
-            col2 = colorBuf[i2]
-            drawTri(p0, col0, p1, col1, p2, col2, pix)
-    #draw elements
-    elif key == "drawElementsTriangles":
-        count = int(float(parts[1]))
-        first = int(float(parts[2]))
-        for t in range(0, count, 3):
-            if first + t + 2 >= len(elemBuf):
-                break
-            #grab triangle indices
-            i0 = elemBuf[first + t]
-            i1 = elemBuf[first + t + 1]
-            i2 = elemBuf[first + t + 2]
-            
-            #bounds check
-            if i0 >= len(posBuf) or i1 >= len(posBuf) or i2 >= len(posBuf):
-                break
-                
-            #transform vertices and draw
-            p0 = toScreen(*posBuf[i0])
-            p1 = toScreen(*posBuf[i1])
-            p2 = toScreen(*posBuf[i2])
-            col0 = colorBuf[i0]
-            col1 = colorBuf[i1]
-            col2 = colorBuf[i2]
-            drawTri(p0, col0, p1, col1, p2, col2, pix)
-
-#save the image if we have one
-if img and outPath:
-    img.save(outPath)
-    print("Wrote", outPath)
-else:
-    print("Error: no image generated")
\ No newline at end of file
+            values = numpy.load(fileName, mmap_mode="r")
+        values = numpy.asarray(values, dtype=dtype).ravel()
+        return values if self.engine == "numpy" else array("d" if dtype is float else "q", values.tolist())
+
+    def attribNumbers(self, text, key, dtype=float):
+        #the numbers of a position, color or elements line, inline or from a sidecar
+        text = text.strip()
+        if text.startswith("@"):
+            return self.loadSidecar(text, key, dtype)
+        return self.parseNumbers(text, dtype)
+
+    def attribRows(self, nums, size, pad):
+        #flat numbers -> rows of 4, components past size come from pad
+        #numpy engine gets an (n, 4) array, the pixel loop a list of tuples
+        #rows are size numbers apart but only the first 4 are used, a short last row is dropped
+        step = size
+        size = min(size, 4)
+        if self.engine == "numpy":
+            count = max(0, (len(nums) - size) // step + 1)
+            rows = np.empty((count, 4))
+            rows[:] = pad
+            for i in range(size):
+                rows[:, i] = nums[i::step][:count]
+            return rows
+        columns = [nums[i::step] for i in range(size)] + [repeat(value) for value in pad[size:]]
+        return list(zip(*columns))
+
+    def resize(self):
+        #sample grid from the png size and fsaa level, drops anything drawn so far
+        self.imgWidth = self.outWidth * self.fsaaLevel
+        self.imgHt = self.outHt * self.fsaaLevel
+        self.clipY0, self.clipY1 = 0, self.imgHt
+        self.newBuffers()
+        self.screenBuf = None
+        self.pendingTris = []
+
+    def command(self, ln):
+        #run one scene line
+        key = ln.split(None, 1)[0]
+        #attribute lines can hold millions of numbers, their tail is parsed in one go instead of split
+        if key == "position" or key == "color":
+            parts = ln.split(None, 2)
+        elif key == "elements":
+            parts = ln.split(None, 1)
+        else:
+            parts = ln.split()
+        if key == "png":
+            self.outWidth = int(parts[1])
+            self.outHt = int(parts[2])
+            self.outPath = parts[3]
+            self.hasImage = True
+            self.resize()
+        elif key == "position":
+            size = int(parts[1])
+            #missing z is 0 and missing w is 1
+            self.posBuf = self.attribRows(self.attribNumbers(parts[2] if len(parts) > 2 else "", key), size, (0, 0, 0, 1))
+            self.screenBuf = None
+            if len(self.colorBuf) < len(self.posBuf):
+                self.colorBuf += [(1, 1, 1, 1)] * (len(self.posBuf) - len(self.colorBuf))
+        #enable everything that should be
+        elif key == "depth":
+            self.hasDepth = True
+        elif key == "sRGB":
+            self.hasSrgb = True
+        elif key == "hyp":
+            self.hasHyp = True
+        elif key == "cull":
+            self.hasCull = True
+        elif key == "fsaa":
+            #supersampling always uses the array engine, a pixel loop over level^2 samples is too slow
+            self.fsaaLevel = max(1, int(parts[1]))
+            if self.fsaaLevel > 1 and self.engine != "numpy":
+                loadNumpy()
+                self.engine = "numpy"
+            self.resize()
+        elif key == "color":
+            size = int(parts[1])
+            #missing alpha is 1, triangles read colors one at a time so they are kept as lists
+            self.colorBuf = self.attribRows(self.attribNumbers(parts[2] if len(parts) > 2 else "", key), size, (0, 0, 0, 1))
+            if self.engine == "numpy":
+                self.colorBuf = self.colorBuf.tolist()
+            #make sure we have enough colors
+            if len(self.colorBuf) < len(self.posBuf):
+                self.colorBuf += [(1, 1, 1, 1)] * (len(self.posBuf) - len(self.colorBuf))
+        #make sure we have enough elements
+        elif key == "elements":
+            self.elemBuf = self.attribNumbers(parts[1] if len(parts) > 1 else "", key, int).tolist()
+        elif key == "uniformMatrix":
+            matrixVals = list(map(float, parts[1:]))
+            #make sure we have 16 values
+            if len(matrixVals) == 16:
+                self.matrix = matrixVals
+                self.screenBuf = None
+            #error if not
+            else:
+                raise ValueError(f"uniformMatrix needs 16 values, got {len(matrixVals)}")
+        #draw arrays
+        elif key == "drawArraysTriangles":
+            first = int(float(parts[1]))
+            count = int(float(parts[2]))
+            screen = self.screenVerts()
+            posBuf, colorBuf = self.posBuf, self.colorBuf
+            for t in range(0, count, 3):
+                i0 = first + t
+                i1 = first + t + 1
+                i2 = first + t + 2
+                if i2 >= len(posBuf):
+                    break
+                p0 = screen[i0]
+                p1 = screen[i1]
+                p2 = screen[i2]
+                col0 = colorBuf[i0]
+                col1 = colorBuf[i1]
+                col2 = colorBuf[i2]
+                self.submitTri(p0, col0, p1, col1, p2, col2)
+        #draw elements
+        elif key == "drawElementsTriangles":
+            count = int(float(parts[1]))
+            first = int(float(parts[2]))
+            screen = self.screenVerts()
+            posBuf, colorBuf, elemBuf = self.posBuf, self.colorBuf, self.elemBuf
+            for t in range(0, count, 3):
+                if first + t + 2 >= len(elemBuf):
+                    break
+                #grab triangle indices
+                i0 = elemBuf[first + t]
+                i1 = elemBuf[first + t + 1]
+                i2 = elemBuf[first + t + 2]
+
+                #bounds check
+                if i0 >= len(posBuf) or i1 >= len(posBuf) or i2 >= len(posBuf):
+                    break
+
+                #draw with the transformed vertices
+                p0 = screen[i0]
+                p1 = screen[i1]
+                p2 = screen[i2]
+                col0 = colorBuf[i0]
+                col1 = colorBuf[i1]
+                col2 = colorBuf[i2]
+                self.submitTri(p0, col0, p1, col1, p2, col2)
+
+    def finish(self):
+        #run queued draws and resolve samples, returns the png as an Image or None without a png line
+        start = time.perf_counter()
+        if self.pendingTris:
+            self.renderPending()
+        if not self.hasImage:
+            self.seconds["draw"] += time.perf_counter() - start
+            return None
+        data = self.resolveSamples().tobytes() if self.fsaaLevel > 1 else self.frameBuf
+        self.seconds["draw"] += time.perf_counter() - start
+        #frombytes copies, so the image stays valid when the next render reuses the buffers
+        return Image.frombytes("RGBA", (self.outWidth, self.outHt), data)
+
+    def render(self, commands, baseDir=""):
+        #run scene lines from a fresh state and return the png as an Image, or None without a png line
+        #baseDir is where "@file" sidecars are looked up
+        self.reset()
+        self.baseDir = baseDir
+        seconds = self.seconds
+        for raw in commands:
+            ln = raw.strip()
+            if ln:
+                start = time.perf_counter()
+                self.command(ln)
+                seconds["draw" if ln.startswith("draw") else "parse"] += time.perf_counter() - start
+        return self.finish()
+
+    def renderFile(self, filePath, save=False):
+        #render a scene file, save also writes the png to the name on its png line
+        with open(filePath, "r") as f:
+            img = self.render(f, path.dirname(filePath))
+        if save and img is not None:
+            start = time.perf_counter()
+            img.save(self.outPath)
+            self.seconds["save"] = time.perf_counter() - start
+        return img
+
+def main():
+    #get input file, this getenv is fairly new to me
+    inputFile = getenv("file")
+    if not inputFile:
+        print("Error: need FILE")
+        exit(1)
+
+    #engine=numpy rasterizes whole spans as arrays, default is the pixel loop
+    #workers=N bins triangles into strips of rows and rasterizes the strips on N processes
+    #tile=R sets the rows per strip
+    #stats=FILE writes the seconds spent parsing, drawing and saving to FILE as json
+    try:
+        with RasterContext(getenv("engine", "python"), int(getenv("workers", "1")), int(getenv("tile", "0"))) as context:
+            img = context.renderFile(inputFile, save=True)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    statsPath = getenv("stats")
+    if statsPath:
+        with open(statsPath, "w") as f:
+            json.dump({"seconds": context.seconds}, f, indent=2)
+
+    if img is not None:
+        print("Wrote", context.outPath)
+    else:
+        print("Error: no image generated")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#move the numbers of position/color/elements lines into a binary sidecar
+#  python3 pack_scene.py big.txt big-packed.txt
+#writes big-packed.npz (or one memory-mappable .npy per line with --npy) and a scene
+#whose attribute lines point at it, e.g. "position 4 @big-packed.npz:position0"
+import argparse
+import os
+
+import numpy as np
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store a scene's attribute numbers in a numpy sidecar")
+    parser.add_argument('scene')
+    parser.add_argument('output', help="scene file to write, the sidecar goes next to it")
+    parser.add_argument('--npy', action='store_true', help="one .npy per line, loaded memory mapped")
+    args = parser.parse_args()
+
+    base = os.path.splitext(args.output)[0]
+    arrays = {}
+    out = []
+    with open(args.scene) as f:
+        for line in f:
+            parts = line.split(None, 2)
+            key = parts[0] if parts else ""
+            if key not in ("position", "color", "elements") or (len(parts) > 1 and parts[-1].startswith("@")):
+                out.append(line.rstrip("\n"))
+                continue
+            #position and color keep their size, elements is only numbers
+            head = parts[:2] if key != "elements" else parts[:1]
+            numbers = " ".join(parts[len(head):])
+            if key == "elements":
+                values = np.array(numbers.split(), dtype=np.int64)
+            else:
+                values = np.array(numbers.split(), dtype=float)
+            name = f"{key}{sum(1 for k in arrays if k.startswith(key))}"
+            arrays[name] = values
+            if args.npy:
+                fileName = f"{base}-{name}.npy"
+                np.save(fileName, values)
+                ref = "@" + os.path.basename(fileName)
+            else:
+                ref = f"@{os.path.basename(base)}.npz:{name}"
+            out.append(" ".join(head + [ref]))
+
+    if not args.npy:
+        np.savez(base + ".npz", **arrays)
+    with open(args.output, "w") as f:
+        f.write("\n".join(out) + "\n")
+    print(f"Wrote {args.output} with {len(arrays)} arrays")
+
+
+if __name__ == '__main__':
+    main()
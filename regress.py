@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#regression runner for the raytracer, rasterizer and textToPNGMP scenes
+#every scene is rendered in-process on a process pool, diffed against its golden png as arrays and timed
+#  python3 regress.py                      all scenes, python engines
+#  python3 regress.py --suite rast --engine numpy
+#  python3 regress.py --update             accept the current times and diffs as the new baseline
+#  python3 regress.py --times              also gate on the baseline times, after --update on this machine
+#a scene fails when it errors or when more pixels differ from its golden than the baseline accepts
+#with --times it also fails when it is slower than its baseline time by more than --margin (and --min-delta seconds),
+#baseline seconds come from whichever machine last ran --update so they only gate on request
+#goldens: ray-X.txt -> ray-X.png, rast-X.txt -> rast-X.png, textToPNGMP warmups -> the png on their png line
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+#suite -> folder, scene glob, how the golden is named
+SUITES = {
+    'ray': ('Raytracer', 'ray-*.txt', 'stem'),
+    'rast': ('rasterizer', 'rast-*.txt', 'stem'),
+    'text': ('textToPNGMP', 'warmup-*.txt', 'png'),
+}
+BASELINE = os.path.join(HERE, 'regress-baseline.json')
+
+#renderer modules loaded by each worker, rasterizer and textToPNGMP are both main.py so they load by path
+_modules = {}
+
+
+def loadModule(name, folder, filename):
+    module = _modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, folder, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[name] = module
+    return module
+
+
+def prepare(suite, engine):
+    #import the renderer before the clock starts, its first scene shouldn't pay for the import
+    if suite == 'ray':
+        if 'raytracer' not in _modules:
+            sys.path.insert(0, os.path.join(HERE, 'Raytracer'))
+            import raytracer
+            import wavefront
+            _modules['raytracer'] = raytracer
+            _modules['wavefront'] = wavefront
+    elif suite == 'rast':
+        contexts = _modules.setdefault('rast_contexts', {})
+        if engine not in contexts:
+            contexts[engine] = loadModule('rasterizer_main', 'rasterizer', 'main.py').RasterContext(engine)
+    else:
+        loadModule('texttopng_main', 'textToPNGMP', 'main.py')
+
+
+def renderRay(scenePath, engine):
+    #same path as raytracer.py without flags, the scene is parsed every time instead of read from .rtcache
+    raytracer = _modules['raytracer']
+    scene = raytracer.loadScene(scenePath)
+    if scene.aa_samples > 0:
+        return raytracer.renderAdaptive(scene)[0], None
+    if engine == 'numpy':
+        return _modules['wavefront'].renderWavefront(scene), None
+    return raytracer.renderScene(scene), None
+
+
+def renderRast(scenePath, engine):
+    return _modules['rast_contexts'][engine].renderFile(scenePath), None
+
+
+def renderText(scenePath, engine):
+    return _modules['texttopng_main'].renderFile(scenePath, engine)
+
+
+RENDERERS = {'ray': renderRay, 'rast': renderRast, 'text': renderText}
+
+
+def runScene(suite, name, engine, tolerance, repeat):
+    #worker side, renders one scene and diffs it, result dict for the report
+    folder, _, golden = SUITES[suite]
+    #textures and sidecars load relative to the scene folder
+    os.chdir(os.path.join(HERE, folder))
+    result = {'scene': f'{folder}/{name}', 'suite': suite}
+    try:
+        prepare(suite, engine)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            img, png = RENDERERS[suite](name, engine)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result['seconds'] = best
+        if img is None:
+            raise ValueError("no png line")
+        goldenPath = os.path.splitext(name)[0] + '.png' if golden == 'stem' else png
+        compare = loadModule('compare_images', 'Raytracer', 'compare_images.py')
+        a = np.asarray(img.convert('RGBA'))
+        b = compare.loadRgba(goldenPath)
+        if a.shape != b.shape:
+            raise ValueError(f"{a.shape[1::-1]} against golden {goldenPath} {b.shape[1::-1]}")
+        stats, _ = compare.compareArrays(a, b, tolerance)
+        result.update(golden=goldenPath, diff_pixels=stats['diff_pixels'], max_error=stats['max_error'])
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def findScenes(suites):
+    scenes = []
+    for suite in suites:
+        folder, pattern, _ = SUITES[suite]
+        for path in sorted(glob(os.path.join(HERE, folder, pattern))):
+            scenes.append((suite, os.path.basename(path)))
+    return scenes
+
+
+def judge(result, base, margin, minDelta, times):
+    #reasons the result fails against its baseline entry, empty when it passes
+    if 'error' in result:
+        return [result['error']]
+    reasons = []
+    accepted = base.get('diff_pixels', 0) if base else 0
+    if result['diff_pixels'] > accepted:
+        reasons.append(f"{result['diff_pixels']} pixels differ from {result['golden']} (baseline {accepted})")
+    if times and base and 'seconds' in base:
+        limit = base['seconds'] * (1 + margin)
+        if result['seconds'] > limit and result['seconds'] - base['seconds'] > minDelta:
+            reasons.append(f"{result['seconds']:.2f} s against baseline {base['seconds']:.2f} s (+{100 * margin:.0f}% allowed)")
+    return reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render every test scene in-process, diff against the goldens and check times against a baseline")
+    parser.add_argument('--suite', action='append', choices=sorted(SUITES), help="only these suites, can be repeated (default all)")
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python', help="engine for all three renderers")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="scenes rendered at once")
+    parser.add_argument('--repeat', type=int, default=3, help="render each scene this many times and keep the best time (default 3)")
+    parser.add_argument('--tolerance', type=int, default=0, help="largest channel difference that still counts as equal")
+    parser.add_argument('--times', action='store_true', help="also fail scenes slower than their baseline time, the baseline has to come from this machine")
+    parser.add_argument('--margin', type=float, default=0.25, help="allowed slowdown over the baseline time with --times, 0.25 = 25%%")
+    parser.add_argument('--min-delta', type=float, default=0.05, help="slowdowns under this many seconds never fail")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline json, times and accepted diffs per engine and scene")
+    parser.add_argument('--update', action='store_true', help="write this run's times and diffs to the baseline instead of checking")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    bases = baseline.get(args.engine, {})
+
+    scenes = findScenes(args.suite or sorted(SUITES))
+    #slowest scenes first so one long scene doesn't finish alone at the end
+    scenes.sort(key=lambda s: -bases.get(f'{SUITES[s[0]][0]}/{s[1]}', {}).get('seconds', 0))
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(runScene, suite, name, args.engine, args.tolerance, args.repeat) for suite, name in scenes]
+        for future in as_completed(futures):
+            results.append(future.result())
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda r: r['scene'])
+
+    failed = 0
+    for result in results:
+        base = bases.get(result['scene'])
+        reasons = [] if args.update else judge(result, base, args.margin, args.min_delta, args.times)
+        result['failures'] = reasons
+        failed += bool(reasons)
+        seconds = f"{result['seconds']:7.2f} s" if 'seconds' in result else "      - s"
+        baseText = f"(base {base['seconds']:.2f})" if base and 'seconds' in base else "(no base)"
+        diffText = f"{result['diff_pixels']:6d} px" if 'diff_pixels' in result else "     - px"
+        print(f"{'FAIL' if reasons else 'ok':4s}  {result['scene']:34s} {seconds} {baseText:12s} {diffText}")
+        for reason in reasons:
+            print(f"        {reason}")
+    print(f"{len(results) - failed}/{len(results)} scenes passed in {elapsed:.1f} s with {args.workers} workers, {args.engine} engine")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'engine': args.engine, 'seconds': elapsed, 'results': results}, f, indent=1)
+    if args.update:
+        for result in results:
+            if 'error' not in result:
+                bases[result['scene']] = {'seconds': round(result['seconds'], 3), 'diff_pixels': result['diff_pixels']}
+        baseline[args.engine] = dict(sorted(bases.items()))
+        with open(args.baseline, 'w') as f:
+            #one line per scene keeps baseline diffs readable
+            f.write('{\n' + ',\n'.join(f' {json.dumps(engine)}: {{\n' + ',\n'.join(f'  {json.dumps(scene)}: {json.dumps(entry)}' for scene, entry in entries.items()) + '\n }'
+                                    for engine, entries in sorted(baseline.items())) + '\n}\n')
+        print(f"Updated {args.baseline}")
+        return
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
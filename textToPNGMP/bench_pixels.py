@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#textToPNGMP benchmark: pixels/sec and peak memory of main.py on a generated pixel dump
+#  python3 bench_pixels.py --pixels 2000000 --size 1024
+#several position/color/drawPixels blocks, pixels land on random spots so many are drawn twice:
+#  python3 bench_pixels.py --pixels 500000 --blocks 4
+#an older main.py for comparison, it runs its own putpixel loop:
+#  git show <rev>:textToPNGMP/main.py > /tmp/old_main.py
+#  python3 bench_pixels.py --baseline /tmp/old_main.py
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def writeDump(path, pixels, size, blocks, outPath):
+    #random positions and colors split into blocks, each block drawn with one drawPixels
+    #numbers are generated a batch at a time, a big parent process would show up in the child's peak rss
+    width, height = size
+    batch = 100000
+    with open(path, 'w') as f:
+        f.write(f"png {width} {height} {outPath}\n")
+        for count in np.diff(np.linspace(0, pixels, blocks + 1).astype(np.int64)):
+            #same seed for both lines of a block, positions and colors are drawn from separate streams
+            rng = np.random.default_rng(1)
+            f.write("position 2")
+            for start in range(0, count, batch):
+                rows = min(batch, count - start)
+                pos = np.stack((rng.integers(0, width, rows), rng.integers(0, height, rows)), axis=1)
+                f.write(" " + " ".join(map(str, pos.ravel().tolist())))
+            rng = np.random.default_rng(2)
+            f.write("\ncolor 4")
+            for start in range(0, count, batch):
+                col = rng.integers(0, 256, (min(batch, count - start), 4))
+                f.write(" " + " ".join(map(str, col.ravel().tolist())))
+            f.write(f"\ndrawPixels {count}\n")
+
+
+def runMain(mainPath, dumpPath, engine):
+    #wall time and peak rss in MB of one main.py run
+    env = dict(os.environ, engine=engine)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, mainPath, dumpPath], env=env, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status):
+        raise SystemExit(f"{mainPath} failed with engine={engine}")
+    #ru_maxrss is in kilobytes on linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def parseSize(text):
+    #"512" or "3840x2160"
+    parts = text.lower().split('x')
+    return int(parts[0]), int(parts[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time main.py per engine on a generated pixel dump")
+    parser.add_argument('--pixels', type=int, default=1000000)
+    parser.add_argument('--size', type=parseSize, default=(1024, 1024), help="png size, N or WxH")
+    parser.add_argument('--blocks', type=int, default=1, help="position/color/drawPixels blocks the pixels are split into")
+    parser.add_argument('--engines', default="python numpy")
+    parser.add_argument('--baseline', help="older main.py to run first")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = [("baseline", args.baseline, "python")] if args.baseline else []
+    runs += [(engine, os.path.join(here, 'main.py'), engine) for engine in args.engines.split()]
+    with tempfile.TemporaryDirectory() as tmp:
+        width, height = args.size
+        outputs = {}
+        for label, mainPath, engine in runs:
+            outPath = os.path.join(tmp, f"{label}.png")
+            dumpPath = os.path.join(tmp, f"{label}.txt")
+            writeDump(dumpPath, args.pixels, args.size, args.blocks, outPath)
+            if not outputs:
+                print(f"{args.pixels} pixels in {args.blocks} blocks, {width}x{height}, {os.path.getsize(dumpPath) / 1e6:.1f} MB of text")
+            elapsed, peakMb = runMain(mainPath, dumpPath, engine)
+            os.remove(dumpPath)
+            with open(outPath, 'rb') as f:
+                outputs[label] = f.read()
+            print(f"{label:8s} {elapsed:8.2f} s   {args.pixels / elapsed:12.0f} pixels/sec   {peakMb:8.1f} MB peak")
+        if len(set(outputs.values())) > 1:
+            print("warning: runs wrote different pngs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,236 @@
 import sys
+import warnings
+from itertools import chain
+from os import getenv
 from PIL import Image
 
-def main():
-    if len(sys.argv) < 2:
-        print("input")
-        sys.exit(1)
+#numpy gives the fast path, without it every pixel goes through putpixel like before
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#most bytes read at once, longer lines are parsed piece by piece so a huge pixel dump never sits in memory whole
+CHUNK = 1 << 20
+#pixels blitted per step, the numpy engine's working arrays stay this size however long the runs are
+BLIT_ROWS = 1 << 16
+#positions are parsed into int32 pairs and colors into uint8 rgba
+INT32 = (-2**31, 2**31 - 1)
+BYTE = (0, 255)
+
+
+def linePieces(f, piece):
+    #one line in pieces of at most CHUNK bytes, the last one ends in a newline
+    while True:
+        yield piece
+        if piece.endswith(b"\n"):
+            return
+        piece = f.readline(CHUNK)
+        if not piece:
+            return
+
+
+def streamLines(f):
+    #(offset, pieces) for every line of the file, whatever the caller leaves of a line is skipped
+    #the first piece always holds the keyword whole
+    while True:
+        offset = f.tell()
+        piece = f.readline(CHUNK)
+        if not piece:
+            return
+        while not piece.endswith(b"\n") and len(piece.split(None, 1)) < 2 and not piece[-1:].isspace():
+            more = f.readline(CHUNK)
+            if not more:
+                break
+            piece += more
+        line = linePieces(f, piece)
+        yield offset, line
+        for _ in line:
+            pass
+
+
+def lineText(pieces):
+    #a whole line as text, for short lines and the putpixel path
+    return b"".join(pieces).decode("ascii", "ignore")
+
+
+def parseInts(text):
+    #ints of a run of words as an int64 array, a bad word raises ValueError like int() would
+    if not text.strip():
+        return np.zeros(0, np.int64)
+    with warnings.catch_warnings():
+        #fromstring only warns and stops early on a word it can't read
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=np.int64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return np.array([int(word) for word in text.split()], dtype=np.int64)
+
+
+def parseRuns(pieces, group, limits, dtype):
+    #numbers after "keyword size" as (n, group) arrays, one per piece, clipped to limits and stored as dtype
+    #a word or a group cut between two pieces is carried into the next one
+    tail = ""
+    left = np.zeros(0, np.int64)
+    skip = 2
+    for piece in pieces:
+        text = tail + piece.decode("ascii", "ignore")
+        cut = len(text)
+        while cut and not text[cut - 1].isspace():
+            cut -= 1
+        text, tail = text[:cut], text[cut:]
+        while skip and text:
+            words = text.split(None, 1)
+            if not words:
+                text = ""
+                break
+            skip -= 1
+            text = words[1] if len(words) > 1 else ""
+        values = parseInts(text)
+        if len(left):
+            values = np.concatenate((left, values))
+        whole = len(values) - len(values) % group
+        left = values[whole:]
+        if whole:
+            yield np.clip(values[:whole], *limits).astype(dtype).reshape(-1, group)
+    if tail and not skip:
+        left = np.concatenate((left, parseInts(tail)))
+    if len(left) % group:
+        raise ValueError(f"{len(left)} numbers left over, values come in groups of {group}")
+    if len(left):
+        yield np.clip(left, *limits).astype(dtype).reshape(-1, group)
+
+
+class RunReader:
+    #rows of the position or color line at offset, parsed from the file only as they are asked for
+    def __init__(self, filePath, offset, group, limits, dtype):
+        self.f = open(filePath, "rb")
+        self.f.seek(offset)
+        self.runs = parseRuns(linePieces(self.f, self.f.readline(CHUNK)), group, limits, dtype)
+        self.rows = np.zeros((0, group), dtype)
 
-    #read lines, drop blank-only ones (took embarassingly long to figure out how to do this first line right lol)
-    with open(sys.argv[1], "r", encoding="ascii", errors="ignore") as f:
-        lines = [ln.strip() for ln in f if ln.strip()]
+    def read(self, count):
+        #the next count rows, fewer only when the line runs out
+        parts = [self.rows]
+        have = len(self.rows)
+        while have < count:
+            run = next(self.runs, None)
+            if run is None:
+                break
+            parts.append(run)
+            have += len(run)
+        rows = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self.rows = rows[count:]
+        return rows[:count]
+
+    def close(self):
+        self.f.close()
+
+
+def blitPixels(buf, w, h, positions, colors, n):
+    #the first n pixels of two RunReaders scattered into the (h*w, 4) buffer BLIT_ROWS at a time
+    #chunks land in file order and each keeps its own last write per pixel, so a pixel drawn twice ends with its last color
+    index = np.int64 if w * h > INT32[1] else np.int32
+    done = 0
+    while done < n:
+        count = min(BLIT_ROWS, n - done)
+        pos = positions.read(count)
+        col = colors.read(count)
+        if len(pos) < count or len(col) < count:
+            raise IndexError(f"drawPixels {n} runs past the position or color buffer")
+        x = pos[:, 0]
+        y = pos[:, 1]
+        #putpixel wraps negative coordinates once and rejects everything else outside the image
+        if x.min() < -w or x.max() >= w or y.min() < -h or y.max() >= h:
+            raise IndexError("image index out of range")
+        flat = (y % h).astype(index) * w + x % w
+        #a stable sort keeps equal pixels in draw order, the last of each run of equal indices wins
+        order = np.argsort(flat, kind="stable")
+        flat = flat[order]
+        last = np.ones(count, bool)
+        last[:-1] = flat[1:] != flat[:-1]
+        buf[flat[last]] = col[order[last]]
+        done += count
+
+
+def renderFile(filePath, engine=None):
+    #(image, png name) for a pixel dump, image is None without a png line
+    #engine=python keeps the putpixel loop, numpy remembers where the position and color lines are
+    #and streams them from the file into the image at drawPixels
+    engine = engine or ("numpy" if np is not None else "python")
 
     image = None
+    buf = None
     filename = None
     pos_buf = []
     col_buf = []
+    pos_at = None
+    col_at = None
+
+    #read lines as a stream, blank-only ones are dropped (took embarassingly long to figure out how to do this first line right lol)
+    with open(filePath, "rb") as f:
+        for offset, pieces in streamLines(f):
+            first = next(pieces)
+            parts = first.split(None, 1)
+            if not parts:
+                continue
+            key = parts[0].decode("ascii", "ignore")
+
+            if key == "png":
+                parts = lineText(chain((first,), pieces)).split()
+                w, h, filename = int(parts[1]), int(parts[2]), parts[3]
+                image = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+                if engine == "numpy":
+                    buf = np.zeros((h * w, 4), np.uint8)
+
+            elif key == "position":
+                if engine == "numpy":
+                    pos_at = offset
+                else:
+                    nums = list(map(int, lineText(chain((first,), pieces)).split()[2:]))
+                    pos_buf = [(nums[i], nums[i+1]) for i in range(0, len(nums), 2)]
+
+            elif key == "color":
+                if engine == "numpy":
+                    col_at = offset
+                else:
+                    nums = list(map(int, lineText(chain((first,), pieces)).split()[2:]))
+                    col_buf = [(nums[i], nums[i+1], nums[i+2], nums[i+3])
+                               for i in range(0, len(nums), 4)]
+
+            elif key == "drawPixels":
+                n = int(lineText(chain((first,), pieces)).split()[1])
+                if engine == "numpy":
+                    if n <= 0:
+                        continue
+                    if pos_at is None or col_at is None:
+                        raise IndexError(f"drawPixels {n} without a position and a color line")
+                    positions = RunReader(filePath, pos_at, 2, INT32, np.int32)
+                    colors = RunReader(filePath, col_at, 4, BYTE, np.uint8)
+                    try:
+                        blitPixels(buf, w, h, positions, colors, n)
+                    finally:
+                        positions.close()
+                        colors.close()
+                    continue
+                #per note, use image.im.putpixel
+                px = image.im
+                for i in range(n):
+                    x, y = pos_buf[i]
+                    r, g, b, a = col_buf[i]
+                    px.putpixel((x, y), (r, g, b, a))
+            #ignore unknown keywords
+    if buf is not None:
+        image = Image.frombuffer("RGBA", (w, h), buf, "raw", "RGBA", 0, 1)
+    return image, filename
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("input")
+        sys.exit(1)
 
-    for line in lines:
-        parts = line.split()
-        key = parts[0]
-
-        if key == "png":
-            w, h, filename = int(parts[1]), int(parts[2]), parts[3]
-            image = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-
-        elif key == "position":
-            nums = list(map(int, parts[2:]))
-            pos_buf = [(nums[i], nums[i+1]) for i in range(0, len(nums), 2)]
-
-        elif key == "color":
-            nums = list(map(int, parts[2:]))
-            col_buf = [(nums[i], nums[i+1], nums[i+2], nums[i+3])
-                       for i in range(0, len(nums), 4)]
-
-        elif key == "drawPixels":
-            n = int(parts[1])
-            #per note, use image.im.putpixel
-            px = image.im
-            for i in range(n):
-                x, y = pos_buf[i]
-                r, g, b, a = col_buf[i]
-                px.putpixel((x, y), (r, g, b, a))
-        #ignore unknown keywords
+    image, filename = renderFile(sys.argv[1], getenv("engine"))
     if image and filename:
         image.save(filename)
         print(f"Wrote {filename}")